@@ -37,8 +37,11 @@ const DASHA_HABITS = [
     'Без мигрени'
 ];
 
-// Получить список привычек в зависимости от пользователя
+// Получить список привычек пользователя: из реестра на сервере или список по умолчанию
 function getHabitsByCategory() {
+    if (DATABASE_CONFIG.HABITS) {
+        return DATABASE_CONFIG.HABITS;
+    }
     const user = DATABASE_CONFIG.USER || 'gleb';
     if (user === 'dasha') {
         // Для Даши возвращаем простую структуру с одной категорией
@@ -55,6 +58,9 @@ let energyLevel = null; // Выбранный уровень энергии
 // Привычки с каунтером (вместо тумблера)
 const COUNTER_HABITS = ['Deep work sessions', 'Learning sessions'];
 
+// Сколько раз повторять отправку записей, которые не сохранились
+const SUBMIT_RETRIES = 2;
+
 // Варианты ответа для вопроса об энергии
 // ВАЖНО: Названия должны точно совпадать с вариантами в Notion Select поле
 const ENERGY_LEVELS = [
@@ -100,12 +106,12 @@ document.addEventListener('DOMContentLoaded', async () => {
         createNotificationButton('notificationSection');
     }
     
-    // Ссылка на статистику только для Глеба
+    // Ссылка на статистику для пользователей, у которых она включена в реестре
     const user = DATABASE_CONFIG.USER || 'gleb';
-    if (user === 'gleb') {
+    if (DATABASE_CONFIG.STATS) {
         const statLinkSection = document.getElementById('statLinkSection');
         if (statLinkSection) {
-            statLinkSection.innerHTML = '<a href="/gleb/stat" class="stat-link">📊 Посмотреть статистику за неделю</a>';
+            statLinkSection.innerHTML = `<a href="/${user}/stat" class="stat-link">📊 Посмотреть статистику за неделю</a>`;
         }
     }
     
@@ -114,17 +120,17 @@ document.addEventListener('DOMContentLoaded', async () => {
 });
 
 /**
- * Установить фавиконку в зависимости от пользователя
+ * Установить фавиконку и заголовок пользователя (из реестра на сервере)
  */
 function setUserFavicon(user) {
-    const emoji = user === 'dasha' ? '🌸' : '💪';
+    const emoji = DATABASE_CONFIG.EMOJI || (user === 'dasha' ? '🌸' : '💪');
     const favicon = document.querySelector('link[rel="icon"]');
     if (favicon) {
         favicon.href = `data:image/svg+xml,<svg xmlns=%22http://www.w3.org/2000/svg%22 viewBox=%220 0 100 100%22><text y=%22.9em%22 font-size=%2290%22>${emoji}</text></svg>`;
     }
     
     // Также обновляем title страницы
-    document.title = user === 'dasha' ? 'Привычки Даши' : 'Трекер Привычек';
+    document.title = DATABASE_CONFIG.TITLE || (user === 'dasha' ? 'Привычки Даши' : 'Трекер Привычек');
 }
 
 /**
@@ -176,8 +182,8 @@ function renderHabits() {
 
     let html = '';
     const habitsByCategory = getHabitsByCategory();
-    const user = DATABASE_CONFIG.USER || 'gleb';
-    const showEnergyQuestion = user === 'gleb';
+    // Вопрос об энергии — у пользователей с базой энергии
+    const showEnergyQuestion = Boolean(DATABASE_CONFIG.ENERGY_DATABASE_ID);
 
     // Рендерим категории и привычки
     for (const [category, habits] of Object.entries(habitsByCategory)) {
@@ -380,29 +386,45 @@ async function submitHabits() {
     try {
         const today = new Date().toISOString().split('T')[0];
         
-        // Отправляем все привычки
-        const promises = allHabits.map(habit => 
-            createHabitRecord(habit.name, habit.completed, today)
-        );
-        
-        // Отправляем ответ на вопрос об энергии, если выбран (только для Глеба)
-        const user = DATABASE_CONFIG.USER || 'gleb';
-        if (user === 'gleb' && energyLevel !== null) {
+        // Ответ на вопрос об энергии, если выбран (только у пользователей с базой энергии)
+        const hasEnergy = Boolean(DATABASE_CONFIG.ENERGY_DATABASE_ID);
+        let energy = null;
+        if (hasEnergy && energyLevel !== null) {
             const selectedLevel = ENERGY_LEVELS.find(level => level.value === energyLevel);
-            promises.push(
-                createEnergyRecord(
-                    'Какой мой уровень энергии и интереса к жизни сегодня?',
-                    selectedLevel.label,
-                    today
-                )
-            );
+            energy = {
+                question: 'Какой мой уровень энергии и интереса к жизни сегодня?',
+                answer: selectedLevel.label
+            };
         }
         
-        await Promise.all(promises);
+        // Отправляем всё одним запросом; при частичной ошибке повторяем только неудачные записи
+        let pendingHabits = allHabits;
+        let pendingEnergy = energy;
+        for (let attempt = 0; attempt <= SUBMIT_RETRIES; attempt++) {
+            const batch = await submitHabitsBatch(pendingHabits, pendingEnergy, today);
+            const failedResults = batch.results.filter(result => !result.ok);
+            if (failedResults.length === 0) {
+                pendingHabits = [];
+                pendingEnergy = null;
+                break;
+            }
+            
+            console.warn(`⚠️ Не сохранено ${failedResults.length} записей, попытка ${attempt + 1}`, failedResults);
+            // Номер записи сохраняем, чтобы повтор обновил ту же запись каунтера
+            pendingHabits = failedResults
+                .filter(result => result.type === 'habit')
+                .map(result => ({ ...pendingHabits[result.index], ordinal: result.ordinal }));
+            pendingEnergy = failedResults.some(result => result.type === 'energy') ? pendingEnergy : null;
+        }
+        
+        if (pendingHabits.length > 0 || pendingEnergy) {
+            const failedCount = pendingHabits.length + (pendingEnergy ? 1 : 0);
+            throw new Error(`не удалось сохранить ${failedCount} записей, попробуйте ещё раз`);
+        }
         
         const completedCount = allHabits.filter(h => h.completed).length;
         const totalCount = allHabits.length;
-        const energyCount = (user === 'gleb' && energyLevel !== null) ? 1 : 0;
+        const energyCount = (hasEnergy && energyLevel !== null) ? 1 : 0;
         
         console.log(`✅ Отправлено ${totalCount} привычек и ${energyCount} ответов об энергии в Notion`);
         
@@ -0,0 +1,536 @@
+"""
+Асинхронный (ASGI) режим сервера
+
+Прокси к Notion и отправка push работают на aiohttp в event loop, поэтому
+медленные запросы к Notion не занимают потоки. Остальные маршруты обслуживает
+то же Flask-приложение из server.py через пул потоков.
+
+Запуск: uvicorn asgi:app --host 0.0.0.0 --port 3000 --workers 2
+"""
+
+import os
+import json
+import gzip
+import time
+import zlib
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+import aiohttp
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from server import (
+    app as flask_app, PUSH_AVAILABLE, VAPID_PRIVATE_KEY, VAPID_CLAIMS, pywebpush,
+    subscriptions_cache, push_payload, request_user_id, users, proxy_seconds, proxy_overhead_seconds, proxy_responses,
+    NOTION_PROXY_STREAMING, PROXY_STREAM_CHUNK, PROXY_GZIP_LEVEL, accepts_gzip,
+)
+from notion_api import (
+    NOTION_TOKEN, NOTION_API_VERSION, NOTION_API_BASE,
+    NOTION_CONNECT_TIMEOUT, NOTION_READ_TIMEOUT, NOTION_MAX_RETRIES, RETRYABLE_STATUSES,
+    NotionBusy, notion_scheduler, retry_delay, observe_notion, endpoint_label, notion_cache, is_cacheable, cache_key, invalidate_notion_cache, CACHEABLE_ENDPOINT_RE,
+)
+from notion_flight import NOTION_COALESCE, NOTION_FLIGHT_WAIT, FlightResult, notion_flights, is_coalescable, flight_key
+from subscription_store import subscription_store
+from page_index import page_index, created_page_date
+from metrics import observe_push
+
+# Одновременных соединений к Notion на воркер (запросы сверх лимита ждут в event loop, а не в потоках)
+NOTION_ASYNC_CONNECTIONS = int(os.getenv('NOTION_ASYNC_CONNECTIONS', '100'))
+# Потоков для синхронных Flask-маршрутов на воркер
+ASGI_SYNC_THREADS = int(os.getenv('ASGI_SYNC_THREADS', '16'))
+PUSH_TIMEOUT = float(os.getenv('PUSH_TIMEOUT', '10'))  # Секунд на запрос к push-сервису
+
+NOTION_PROXY_PREFIX = '/api/notion/'
+
+sessions = {}  # 'notion' / 'push' -> aiohttp.ClientSession текущего event loop
+loop_flights = {}  # ключ чтения -> LoopFlight ведущей корутины этого воркера
+# Ожидание flock ключа другого воркера (notion_flights.join) блокирует поток, поэтому идёт
+# в отдельном пуле: не больше одного потока на ключ, потоки Flask-маршрутов не заняты
+flight_executor = ThreadPoolExecutor(max_workers=NOTION_ASYNC_CONNECTIONS, thread_name_prefix='flight')
+
+
+def notion_session():
+    """Общая сессия aiohttp с пулом keep-alive соединений к Notion"""
+    if 'notion' not in sessions:
+        sessions['notion'] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=NOTION_ASYNC_CONNECTIONS),
+            timeout=aiohttp.ClientTimeout(sock_connect=NOTION_CONNECT_TIMEOUT, sock_read=NOTION_READ_TIMEOUT),
+            # Сжатые ответы Notion передаются клиенту как есть, распаковываем сами при необходимости
+            auto_decompress=False,
+            headers={
+                'Authorization': f'Bearer {NOTION_TOKEN}',
+                'Notion-Version': NOTION_API_VERSION,
+                'Content-Type': 'application/json',
+                'Accept-Encoding': 'gzip, deflate',
+            },
+        )
+    return sessions['notion']
+
+
+def push_session():
+    if 'push' not in sessions:
+        sessions['push'] = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=PUSH_TIMEOUT))
+    return sessions['push']
+
+
+# ==================== ASGI-ответы ====================
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def send_json(send, status, data, headers=None):
+    """JSON-ответ с теми же CORS-заголовками, что ставит flask-cors; возвращает код ответа"""
+    body = json.dumps(data, ensure_ascii=False).encode()
+    response_headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode()),
+        (b'access-control-allow-origin', b'*'),
+    ]
+    for name, value in (headers or {}).items():
+        response_headers.append((name.lower().encode(), value.encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': body})
+    return status
+
+
+# ==================== Прокси к Notion ====================
+
+def proxy_user(scope):
+    """Пользователь запроса (для честной очереди): из параметра user или referer, как в server.py"""
+    user = parse_qs(scope.get('query_string', b'').decode()).get('user')
+    if user:
+        return request_user_id(user[0])
+    referer = dict(scope['headers']).get(b'referer', b'').decode()
+    return users.from_path(urlparse(referer).path)['id']
+
+
+def decode_body(content, encoding):
+    """Распаковать тело ответа Notion (сессия работает с auto_decompress=False)"""
+    if encoding in ('gzip', 'deflate') and content:
+        return zlib.decompress(content, 47)  # 32 + 15: gzip или zlib по заголовку
+    return content
+
+
+class StreamAborted(Exception):
+    """Ответ уже начат, а Notion оборвал передачу — новый ответ отправить нельзя"""
+
+
+async def notion_call_async(method, endpoint, body, user):
+    """Запрос к Notion через общую очередь с повторами, как notion_call
+
+    Возвращает ответ с непрочитанным телом; вызывающий освобождает его через release().
+    """
+    for attempt in range(NOTION_MAX_RETRIES + 1):
+        await notion_scheduler.acquire_async(user, retry=attempt > 0)
+        started = time.perf_counter()
+        try:
+            response = await notion_session().request(method, f"{NOTION_API_BASE}/{endpoint}", json=body)
+            observe_notion(method, endpoint, time.perf_counter() - started, response.status)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            observe_notion(method, endpoint, time.perf_counter() - started, None)
+            if attempt == NOTION_MAX_RETRIES:
+                raise
+            notion_scheduler.record_retry(None)
+            await asyncio.sleep(retry_delay(None, attempt))
+            continue
+        if response.status in RETRYABLE_STATUSES and attempt < NOTION_MAX_RETRIES:
+            delay = retry_delay(response, attempt)
+            print(f"⏳ Notion вернул {response.status} для {endpoint}, повтор через {delay:.1f}с")
+            notion_scheduler.record_retry(response.status)
+            response.release()
+            if response.status == 429:
+                # pause() берёт flock файла ведра — не в event loop
+                await asyncio.get_running_loop().run_in_executor(None, notion_scheduler.bucket.pause, delay)
+            else:
+                await asyncio.sleep(delay)
+            continue
+        return response
+
+
+async def stream_response(scope, send, response, tee=None, coalesced=None):
+    """Передать успешный ответ Notion кусками, как stream_notion_response в server.py
+
+    tee — LoopFlight, которому нужна копия тела (одинаковые запросы других корутин и воркеров).
+    """
+    client_gzip = accepts_gzip(dict(scope['headers']).get(b'accept-encoding', b'').decode())
+    upstream_encoding = response.headers.get('Content-Encoding', '').lower()
+    headers = [
+        (b'content-type', response.headers.get('Content-Type', 'application/json').encode()),
+        (b'access-control-allow-origin', b'*'),
+        (b'vary', b'Accept-Encoding'),
+        (b'x-proxy-mode', b'stream'),
+    ]
+    if coalesced:
+        headers.append((b'x-coalesced', coalesced.encode()))
+    decoder = compressor = None
+    if client_gzip and upstream_encoding == 'gzip':
+        headers.append((b'content-encoding', b'gzip'))
+        if 'Content-Length' in response.headers:
+            headers.append((b'content-length', response.headers['Content-Length'].encode()))
+    else:
+        if upstream_encoding in ('gzip', 'deflate'):
+            decoder = zlib.decompressobj(47)
+        if client_gzip:
+            compressor = zlib.compressobj(PROXY_GZIP_LEVEL, zlib.DEFLATED, 31)
+            headers.append((b'content-encoding', b'gzip'))
+        elif not upstream_encoding and 'Content-Length' in response.headers:
+            headers.append((b'content-length', response.headers['Content-Length'].encode()))
+
+    # Копия для ожидающих: распакованное тело или байты Notion как есть (gzip либо без сжатия)
+    parts = [] if tee else None
+    try:
+        await send({'type': 'http.response.start', 'status': response.status, 'headers': headers})
+        try:
+            async for chunk in response.content.iter_chunked(PROXY_STREAM_CHUNK):
+                if decoder:
+                    chunk = decoder.decompress(chunk)
+                if parts is not None:
+                    parts.append(chunk)
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            tail = decoder.flush() if decoder else b''
+            if parts is not None:
+                parts.append(tail)
+                tee.finish(FlightResult(response.status, response.headers.get('Content-Type', 'application/json'),
+                                        '' if decoder else upstream_encoding, b''.join(parts)))
+            if compressor:
+                tail = compressor.compress(tail) + compressor.flush()
+        except Exception as e:
+            print(f"❌ Notion оборвал передачу ответа: {e!r}")
+            raise StreamAborted() from e
+        await send({'type': 'http.response.body', 'body': tail})
+    finally:
+        if tee:
+            tee.abort()  # Ответ не дочитан (клиент ушёл, Notion оборвал) — ожидающие пойдут в Notion сами
+    return response.status
+
+
+class LoopFlight:
+    """Чтение из Notion ведущей корутины воркера и ожидающие его корутины
+
+    Как Flight в notion_flight.py, только ожидающие ждут asyncio.Future в event loop.
+    Между воркерами ведущий объединяется через notion_flights (flock ключа), как в server.py.
+    """
+
+    def __init__(self, key, endpoint):
+        self.key = key
+        self.endpoint = endpoint
+        self.done = asyncio.get_running_loop().create_future()  # (FlightResult или None, ошибка или None)
+        self.waiters = 0
+        self.flight = None  # Flight из notion_flights: flock ключа между воркерами
+        self.result = None
+        self.source = 'upstream'
+
+    def close(self):
+        """Больше не принимать ожидающих корутин; вернуть, есть ли они"""
+        if loop_flights.get(self.key) is self:
+            del loop_flights[self.key]
+        return self.waiters > 0
+
+    def share(self):
+        """Ответ Notion пришёл: нужно ли копировать тело для ожидающих (иначе отпустить блокировку)"""
+        waiting = self.close()
+        return self.flight.share() or waiting
+
+    def finish(self, result):
+        """Ответ целиком (None — передача оборвалась): отдать ожидающим и другим воркерам"""
+        self.close()
+        if not self.done.done():
+            self.result = result
+        if self.flight:
+            self.flight.finish(result)
+        if not self.done.done():
+            self.done.set_result((result, None))
+
+    def fail(self, error):
+        self.close()
+        if self.flight:
+            self.flight.fail(error)
+        if not self.done.done():
+            self.done.set_result((None, error))
+
+    def abort(self):
+        self.finish(None)
+
+
+async def join_flight(key, endpoint):
+    """LoopFlight с готовым result (ответ другой корутины/воркера) или без него — тогда запрос за вызывающим
+
+    Ведущий обязан завершить LoopFlight: finish(), fail(), abort() или share() == False.
+    """
+    while True:
+        leader = loop_flights.get(key)
+        if leader is None:
+            break
+        leader.waiters += 1
+        try:
+            result, error = await asyncio.wait_for(asyncio.shield(leader.done), NOTION_FLIGHT_WAIT)
+        except asyncio.TimeoutError:
+            # Ведущий завис дольше, чем ждал бы сам запрос — идём в Notion сами, без объединения
+            solo = LoopFlight(key, endpoint)
+            solo.flight = notion_flights.solo(key, endpoint)
+            return solo
+        if error is not None:
+            notion_flights.count(endpoint, 'thread')
+            raise error
+        if result is not None:
+            notion_flights.count(endpoint, 'thread')
+            shared = LoopFlight(key, endpoint)
+            shared.result, shared.source = result, 'thread'
+            return shared
+        # Ведущий не дочитал ответ — пробуем стать ведущим сами
+
+    flight = loop_flights[key] = LoopFlight(key, endpoint)
+    joining = asyncio.get_running_loop().run_in_executor(flight_executor, notion_flights.join, key, endpoint)
+    try:
+        flight.flight = await asyncio.shield(joining)
+    except BaseException:
+        # Клиент ушёл, пока другой воркер держал ключ: блокировку отпускаем, когда поток её получит
+        joining.add_done_callback(lambda done: done.cancelled() or done.exception() or done.result().abort())
+        flight.abort()
+        raise
+    if flight.flight.result is not None:
+        flight.result, flight.source = flight.flight.result, flight.flight.source
+        flight.finish(flight.result)
+    return flight
+
+
+async def forward_coalesced(method, endpoint, body, cacheable, timing, scope, send):
+    """Ответ прокси на чтение, общее с одинаковыми одновременными запросами, как forward_coalesced в server.py"""
+    upstream_started = time.perf_counter()
+    try:
+        flight = await join_flight(flight_key(method, endpoint, body), endpoint)
+        if flight.result is None:
+            try:
+                response = await notion_call_async(method, endpoint, body, proxy_user(scope))
+                try:
+                    if response.status < 400 and not cacheable and NOTION_PROXY_STREAMING:
+                        timing['upstream'] = time.perf_counter() - upstream_started
+                        return await stream_response(scope, send, response, flight if flight.share() else None,
+                                                     coalesced='upstream')
+                    # Ошибки и схемы баз читаются целиком и в обычном прокси
+                    content = decode_body(await response.read(), response.headers.get('Content-Encoding', '').lower())
+                finally:
+                    response.release()
+                flight.finish(FlightResult(response.status, response.headers.get('Content-Type', 'application/json'),
+                                           '', content))
+            except Exception as e:
+                flight.fail(e)
+                raise
+            except BaseException:
+                flight.abort()  # Отмена корутины — ожидающие пойдут в Notion сами
+                raise
+    finally:
+        timing['upstream'] = timing['upstream'] or time.perf_counter() - upstream_started
+    result, source = flight.result, flight.source
+    content = decode_body(result.body, result.encoding)
+
+    if result.status >= 400:
+        error_data = json.loads(content) if content else {'error': 'No response body'}
+        print(f"❌ Notion API ошибка {result.status} для {endpoint}: {error_data}")
+        return await send_json(send, result.status, error_data)
+
+    if cacheable:
+        data = json.loads(content)
+        notion_cache.set(cache_key(endpoint), data)
+        return await send_json(send, 200, data, {'X-Cache': 'MISS', 'X-Coalesced': source})
+
+    headers = [
+        (b'content-type', result.content_type.encode()),
+        (b'access-control-allow-origin', b'*'),
+        (b'vary', b'Accept-Encoding'),
+        (b'x-coalesced', source.encode()),
+    ]
+    if accepts_gzip(dict(scope['headers']).get(b'accept-encoding', b'').decode()):
+        headers.append((b'content-encoding', b'gzip'))
+        payload = result.body if result.encoding == 'gzip' else gzip.compress(content, PROXY_GZIP_LEVEL)
+    else:
+        payload = content
+    headers.append((b'content-length', str(len(payload)).encode()))
+    await send({'type': 'http.response.start', 'status': result.status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': payload})
+    return result.status
+
+
+async def notion_proxy(scope, receive, send):
+    """Асинхронная версия /api/notion/<endpoint> с тем же поведением и метриками, что в server.py"""
+    method = scope['method']
+    endpoint = scope['path'][len(NOTION_PROXY_PREFIX):]
+    started = time.perf_counter()
+    timing = {'upstream': 0.0, 'cache': 'none'}
+    status = await forward_to_notion(method, endpoint, timing, scope, receive, send)
+    elapsed = time.perf_counter() - started
+    label = endpoint_label(endpoint)
+    proxy_seconds.observe(elapsed, method=method, endpoint=label, cache=timing['cache'])
+    proxy_overhead_seconds.observe(elapsed - timing['upstream'], method=method, endpoint=label)
+    proxy_responses.inc(endpoint=label, status=status)
+
+
+async def forward_to_notion(method, endpoint, timing, scope, receive, send):
+    """Ответить на запрос к прокси; возвращает код ответа"""
+    try:
+        body = None
+        if method in ('POST', 'PATCH'):
+            raw = await read_body(receive)
+            body = json.loads(raw) if raw else None
+
+        # Схемы баз отдаём из кэша
+        cacheable = is_cacheable(method, endpoint)
+        if cacheable:
+            cached = notion_cache.get(cache_key(endpoint))
+            timing['cache'] = 'hit' if cached is not None else 'miss'
+            if cached is not None:
+                return await send_json(send, 200, cached, {'X-Cache': 'HIT'})
+
+        # Одинаковые одновременные чтения идут в Notion одним запросом на все корутины и воркеры
+        if NOTION_COALESCE and is_coalescable(method, endpoint):
+            return await forward_coalesced(method, endpoint, body, cacheable, timing, scope, send)
+
+        upstream_started = time.perf_counter()
+        try:
+            response = await notion_call_async(method, endpoint, body, proxy_user(scope))
+        finally:
+            timing['upstream'] = time.perf_counter() - upstream_started
+
+        try:
+            status = response.status
+            if status < 400 and method == 'PATCH' and CACHEABLE_ENDPOINT_RE.match(endpoint):
+                # Схема изменилась через прокси — сбрасываем её из кэша
+                invalidate_notion_cache(cache_key(endpoint))
+            created_date = created_page_date(method, endpoint, body) if status < 400 else None
+            if created_date:
+                page_index.set_logged(proxy_user(scope), created_date)
+            if status < 400 and NOTION_PROXY_STREAMING and not cacheable:
+                return await stream_response(scope, send, response)
+            content = decode_body(await response.read(), response.headers.get('Content-Encoding', '').lower())
+        finally:
+            response.release()
+
+        if status >= 400:
+            error_data = json.loads(content) if content else {'error': 'No response body'}
+            print(f"❌ Notion API ошибка {status} для {endpoint}: {error_data}")
+            return await send_json(send, status, error_data)
+
+        data = json.loads(content)
+        if cacheable:
+            notion_cache.set(cache_key(endpoint), data)
+            return await send_json(send, 200, data, {'X-Cache': 'MISS'})
+        return await send_json(send, 200, data)
+
+    except StreamAborted:
+        raise
+    except NotionBusy as e:
+        print(f"🚦 Запрос к {endpoint} отклонён: {e.message}")
+        return await send_json(send, 503, {'message': e.message}, {'Retry-After': str(int(e.retry_after))})
+    except asyncio.TimeoutError as e:
+        print(f"⏱️ Таймаут запроса к Notion для {endpoint}: {e!r}")
+        return await send_json(send, 504, {'message': 'Notion API не ответил вовремя'})
+    except Exception as e:
+        print(f"Ошибка прокси к Notion: {e}")
+        return await send_json(send, 500, {'message': str(e)})
+
+
+# ==================== Push ====================
+
+async def push_one(vapid, sub, payload):
+    """Отправить одно уведомление; (ok, невалидна ли подписка)"""
+    endpoint = urlparse(sub.get('endpoint', ''))
+    claims = {**VAPID_CLAIMS, 'aud': f'{endpoint.scheme}://{endpoint.netloc}', 'exp': int(time.time()) + 12 * 3600}
+    started = time.perf_counter()
+    try:
+        response = await pywebpush().WebPusher(sub, aiohttp_session=push_session()).send_async(
+            payload, vapid.sign(claims), ttl=0, timeout=aiohttp.ClientTimeout(total=PUSH_TIMEOUT))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"❌ Ошибка отправки push: {e!r}")
+        observe_push(sub.get('endpoint'), time.perf_counter() - started, None)
+        return False, False
+    observe_push(sub.get('endpoint'), time.perf_counter() - started, response.status)
+    if response.status > 202:
+        print(f"❌ Ошибка отправки push: {response.status} {response.reason}")
+        return False, response.status in (404, 410)
+    return True, False
+
+
+async def send_push(scope, receive, send):
+    """Асинхронная версия /api/push/send: все подписки пользователя отправляются одновременно"""
+    if not PUSH_AVAILABLE:
+        return await send_json(send, 500, {'error': 'Push не поддерживается'})
+    if not VAPID_PRIVATE_KEY:
+        return await send_json(send, 500, {'error': 'VAPID ключи не настроены'})
+
+    raw = await read_body(receive)
+    data = json.loads(raw) if raw else {}
+    user = request_user_id(data.get('user'))
+    message = data.get('message') or users.resolve(user)['reminder']
+
+    user_subs = subscriptions_cache.for_user(user)
+    if not user_subs:
+        return await send_json(send, 404, {'error': 'Нет подписок для пользователя'})
+
+    from py_vapid import Vapid  # Вместе с pywebpush — при первой отправке
+    vapid = Vapid.from_string(private_key=VAPID_PRIVATE_KEY)
+    payload = push_payload(user, message)
+    results = await asyncio.gather(*(push_one(vapid, sub, payload) for sub in user_subs))
+
+    # Удаляем невалидные подписки одной транзакцией
+    invalid_endpoints = [sub.get('endpoint') for sub, (_, invalid) in zip(user_subs, results) if invalid]
+    if invalid_endpoints:
+        await asyncio.get_running_loop().run_in_executor(None, subscription_store.delete_many, invalid_endpoints)
+        print(f"🗑️ Удалено {len(invalid_endpoints)} невалидных подписок")
+
+    sent = sum(1 for ok, _ in results if ok)
+    await send_json(send, 200, {'sent': sent, 'failed': len(results) - sent})
+
+
+# ==================== Flask ====================
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    # По умолчанию asgiref выполняет WSGI-приложение в одном общем потоке;
+    # Flask-маршруты независимы, поэтому запускаем их в пуле потоков event loop
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+flask_asgi = ThreadedWsgiToAsgi(flask_app)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=ASGI_SYNC_THREADS, thread_name_prefix='flask'))
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for session in sessions.values():
+                await session.close()
+            sessions.clear()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI-приложение: асинхронные маршруты здесь, остальное — во Flask"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http':
+        path, method = scope['path'], scope['method']
+        if path.startswith(NOTION_PROXY_PREFIX) and method in ('GET', 'POST', 'PATCH'):
+            return await notion_proxy(scope, receive, send)
+        if path == '/api/push/send' and method == 'POST':
+            return await send_push(scope, receive, send)
+    await flask_asgi(scope, receive, send)
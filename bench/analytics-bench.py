@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк аналитики привычек (habit_analytics.py) на синтетической истории
+
+Заполняет временное зеркало SQLite историей за --years лет по --habits привычкам
+(и оценками энергии), затем измеряет полную загрузку матрицы, запросы /api/analytics
+за разные периоды и инкрементальное обновление после записи нового дня. Печатает JSON
+с задержками p50/p95/max в миллисекундах.
+
+Пример:
+    python bench/analytics-bench.py --years 5 --habits 50 --repeat 50
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+from datetime import date, timedelta
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+from notion_mirror import NotionMirror  # noqa: E402
+from habit_analytics import AnalyticsEngine  # noqa: E402
+
+USER = 'bench'
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def timings(samples):
+    return {
+        'p50': round(percentile(samples, 0.5), 2),
+        'p95': round(percentile(samples, 0.95), 2),
+        'max': round(max(samples), 2),
+        'runs': len(samples),
+    }
+
+
+def seed_mirror(store, days, habits, rng):
+    """История: страница на каждую отмеченную привычку дня и оценка энергии почти каждый день"""
+    today = date.today()
+    names = [f'Habit {index:02d}' for index in range(habits)]
+    rates = [rng.uniform(0.1, 0.9) for _ in names]
+    habit_rows, energy_rows = [], []
+    for offset in range(days, 0, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        for index, (name, rate) in enumerate(zip(names, rates)):
+            if rng.random() < 0.6:
+                habit_rows.append({'id': f'h-{day}-{index}', 'date': day, 'habit': name,
+                                   'completed': rng.random() < rate, 'last_edited_time': f'{day}T21:00:00.000Z'})
+        if rng.random() < 0.9:
+            energy_rows.append({'id': f'e-{day}', 'date': day, 'answer': None, 'score': rng.randint(1, 5),
+                                'last_edited_time': f'{day}T21:00:00.000Z'})
+    store.upsert_habits(USER, habit_rows)
+    store.upsert_energy(USER, energy_rows)
+    return names, len(habit_rows), len(energy_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк аналитики привычек')
+    parser.add_argument('--years', type=int, default=5, help='Лет истории')
+    parser.add_argument('--habits', type=int, default=50, help='Привычек')
+    parser.add_argument('--repeat', type=int, default=30, help='Повторов каждого запроса')
+    parser.add_argument('--seed', type=int, default=1, help='Seed генератора истории')
+    parser.add_argument('--output', help='Куда записать JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    days = args.years * 365
+    today = date.today()
+
+    with tempfile.TemporaryDirectory(prefix='habbits-analytics-') as tmp:
+        store = NotionMirror(Path(tmp) / 'mirror.db')
+        started = time.perf_counter()
+        names, habit_pages, energy_pages = seed_mirror(store, days, args.habits, rng)
+        seeded = time.perf_counter() - started
+        print(f"🌱 История: {habit_pages} страниц привычек, {energy_pages} оценок энергии "
+              f"за {seeded:.1f}с", file=sys.stderr)
+
+        engine = AnalyticsEngine(store)
+        goals = {name: rng.randint(1, 7) for name in names}
+
+        started = time.perf_counter()
+        engine.matrix(USER)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        periods = {
+            'all': today - timedelta(days=days),
+            'year': today - timedelta(days=364),
+            'month': today - timedelta(days=29),
+            'week': today - timedelta(days=6),
+        }
+        queries = {}
+        for name, start in periods.items():
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                engine.summary(USER, start, today, goals, 7, today)
+                samples.append((time.perf_counter() - started) * 1000)
+            queries[name] = timings(samples)
+
+        # Новый день: запись страниц и запрос за всю историю с подхватом изменений
+        samples = []
+        for repeat in range(args.repeat):
+            day = today.isoformat()
+            store.upsert_habits(USER, [{'id': f'new-{repeat}-{index}', 'date': day, 'habit': name,
+                                        'completed': True, 'last_edited_time': f'{day}T21:00:00.000Z'}
+                                       for index, name in enumerate(names[:5])])
+            started = time.perf_counter()
+            engine.summary(USER, periods['all'], today, goals, 7, today)
+            samples.append((time.perf_counter() - started) * 1000)
+        incremental = timings(samples)
+
+    report = {
+        'meta': {
+            'years': args.years,
+            'habits': args.habits,
+            'days': days,
+            'habit_pages': habit_pages,
+            'energy_pages': energy_pages,
+            'repeat': args.repeat,
+        },
+        'build_ms': round(build_ms, 2),
+        'summary_ms': queries,
+        'incremental_ms': incremental,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+        print(f"💾 Отчёт записан в {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
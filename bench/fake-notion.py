@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка Notion API для нагрузочных тестов
+Отвечает на те же запросы, что делает сервер (databases, data_sources, query, pages),
+с настраиваемой задержкой и долей ответов 429
+"""
+
+import sys
+import gzip
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from datetime import date, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Базы, которые runner передаёт серверу в DATABASE_ID / ENERGY_DATABASE_ID
+DATA_SOURCES = {'bench-habits': 'bench-habits-ds', 'bench-energy': 'bench-energy-ds'}
+PROPERTIES = {
+    'bench-habits-ds': {
+        'Habit': {'type': 'title'},
+        'Date': {'type': 'date'},
+        'Completed': {'type': 'checkbox'},
+    },
+    'bench-energy-ds': {
+        'Вопрос': {'type': 'title'},
+        'Дата': {'type': 'date'},
+        'Ответ': {'type': 'select'},
+    },
+}
+HABITS = ['Deep work sessions', 'Learning sessions', 'Спорт', 'Чтение', 'Медитация', 'Сон до 23:00']
+ENERGY_ANSWERS = ['выжат апатия', 'тяжело', 'норм', 'хорошо', 'очень хорошо']
+
+pages = {}
+pages_lock = threading.Lock()
+counters = {'requests': 0, 'rate_limited': 0}
+
+
+def now_iso():
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+
+
+def store_page(data_source_id, properties):
+    """Сохранить страницу в формате ответа Notion"""
+    page_id = str(uuid.uuid4())
+    now = now_iso()
+    page = {
+        'object': 'page', 'id': page_id, 'created_time': now, 'last_edited_time': now,
+        'parent': {'type': 'data_source_id', 'data_source_id': data_source_id},
+        'properties': {}, 'url': f'https://www.notion.so/{page_id}', 'archived': False,
+    }
+    for name, value in properties.items():
+        if 'title' in value:
+            text = value['title'][0]['text']['content'] if value['title'] else ''
+            page['properties'][name] = {'type': 'title', 'title': [{'plain_text': text}]}
+        elif 'date' in value:
+            page['properties'][name] = {'type': 'date', 'date': value['date']}
+        elif 'checkbox' in value:
+            page['properties'][name] = {'type': 'checkbox', 'checkbox': value['checkbox']}
+        elif 'select' in value:
+            page['properties'][name] = {'type': 'select', 'select': value['select']}
+    with pages_lock:
+        pages[page_id] = page
+    return page
+
+
+def seed(days):
+    """Заполнить базы историей за последние days дней"""
+    rng = random.Random(42)
+    today = date.today()
+    for offset in range(days):
+        day = (today - timedelta(days=offset)).isoformat()
+        for habit in HABITS:
+            store_page('bench-habits-ds', {
+                'Habit': {'title': [{'text': {'content': habit}}]},
+                'Date': {'date': {'start': day}},
+                'Completed': {'checkbox': rng.random() < 0.6},
+            })
+        store_page('bench-energy-ds', {
+            'Вопрос': {'title': [{'text': {'content': 'Уровень энергии'}}]},
+            'Дата': {'date': {'start': day}},
+            'Ответ': {'select': {'name': rng.choice(ENERGY_ANSWERS)}},
+        })
+
+
+def matches(page, condition):
+    """Упрощённая проверка фильтра Notion (and, timestamp, date, checkbox, title)"""
+    if not condition:
+        return True
+    if 'and' in condition:
+        return all(matches(page, c) for c in condition['and'])
+    if 'or' in condition:
+        return any(matches(page, c) for c in condition['or'])
+    if 'timestamp' in condition:
+        bounds = condition[condition['timestamp']]
+        return page[condition['timestamp']] >= bounds.get('on_or_after', '')
+    prop = page['properties'].get(condition.get('property'))
+    if prop is None:
+        return False
+    if 'date' in condition:
+        value = (prop.get('date') or {}).get('start') or ''
+        bounds = condition['date']
+        if 'equals' in bounds:
+            return value == bounds['equals']
+        return (value >= bounds.get('on_or_after', '')
+                and value <= bounds.get('on_or_before', '￿'))
+    if 'checkbox' in condition:
+        return prop.get('checkbox') == condition['checkbox'].get('equals')
+    if 'title' in condition:
+        title = prop['title'][0]['plain_text'] if prop.get('title') else ''
+        return title == condition['title'].get('equals')
+    return True
+
+
+class FakeNotionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    rate_limit_ratio = 0.0
+    gzip = False
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if self.gzip and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            payload = gzip.compress(payload, 5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def admit(self):
+        """Задержка и случайный 429; False, если запрос отклонён"""
+        counters['requests'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.rate_limit_ratio and random.random() < self.rate_limit_ratio:
+            counters['rate_limited'] += 1
+            self.send_json(429, {'object': 'error', 'code': 'rate_limited', 'message': 'Rate limited'},
+                           {'Retry-After': '0'})
+            return False
+        return True
+
+    def route(self):
+        return self.path.split('?')[0].strip('/').split('/')[1:]  # Без префикса /v1
+
+    def do_GET(self):
+        parts = self.route()
+        if parts == ['_stats']:
+            return self.send_json(200, {**counters, 'pages': len(pages)})
+        if not self.admit():
+            return
+        if len(parts) == 2 and parts[0] == 'databases':
+            data_source_id = DATA_SOURCES.get(parts[1], f'{parts[1]}-ds')
+            return self.send_json(200, {'object': 'database', 'id': parts[1],
+                                        'data_sources': [{'id': data_source_id}]})
+        if len(parts) == 2 and parts[0] == 'data_sources':
+            properties = PROPERTIES.get(parts[1], PROPERTIES['bench-habits-ds'])
+            return self.send_json(200, {'object': 'data_source', 'id': parts[1], 'properties': properties})
+        if len(parts) == 2 and parts[0] == 'pages':
+            page = pages.get(parts[1])
+            return self.send_json(200, page) if page else self.send_json(404, {'message': 'Not found'})
+        self.send_json(404, {'message': 'Not found'})
+
+    def do_POST(self):
+        body = self.read_body()
+        if not self.admit():
+            return
+        parts = self.route()
+        if parts == ['pages']:
+            parent = body.get('parent') or {}
+            data_source_id = parent.get('data_source_id') or DATA_SOURCES.get(parent.get('database_id'))
+            return self.send_json(200, store_page(data_source_id, body.get('properties') or {}))
+        if len(parts) == 3 and parts[0] == 'data_sources' and parts[2] == 'query':
+            with pages_lock:
+                rows = [page for page in pages.values()
+                        if page['parent'].get('data_source_id') == parts[1] and not page['archived']]
+            rows = [page for page in rows if matches(page, body.get('filter'))]
+            rows.sort(key=lambda page: (page['last_edited_time'], page['created_time']))
+            size = min(int(body.get('page_size', 100)), 100)
+            start = int(body.get('start_cursor') or 0)
+            more = start + size < len(rows)
+            return self.send_json(200, {'object': 'list', 'results': rows[start:start + size],
+                                        'has_more': more, 'next_cursor': str(start + size) if more else None})
+        self.send_json(404, {'message': 'Not found'})
+
+    def do_PATCH(self):
+        body = self.read_body()
+        if not self.admit():
+            return
+        parts = self.route()
+        with pages_lock:
+            page = pages.get(parts[1]) if len(parts) == 2 and parts[0] == 'pages' else None
+            if page is None:
+                return self.send_json(404, {'message': 'Not found'})
+            for name, value in (body.get('properties') or {}).items():
+                if 'checkbox' in value:
+                    page['properties'][name] = {'type': 'checkbox', 'checkbox': value['checkbox']}
+            if 'archived' in body:
+                page['archived'] = body['archived']
+            page['last_edited_time'] = now_iso()
+        self.send_json(200, page)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Заглушка Notion API')
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--latency', type=float, default=0.05, help='Задержка ответа, сек')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Доля ответов 429 (0..1)')
+    parser.add_argument('--seed-days', type=int, default=90, help='Дней истории в базах')
+    parser.add_argument('--gzip', action='store_true', help='Сжимать ответы, как api.notion.com')
+    args = parser.parse_args()
+
+    FakeNotionHandler.latency = args.latency
+    FakeNotionHandler.rate_limit_ratio = args.rate_limit
+    FakeNotionHandler.gzip = args.gzip
+    seed(args.seed_days)
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), FakeNotionHandler)
+    print(f"🧪 Заглушка Notion на :{args.port} (задержка {args.latency}с, 429: {args.rate_limit:.0%}, "
+          f"{len(pages)} страниц)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
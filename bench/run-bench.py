@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест сервера на заглушке Notion
+
+Запускает bench/fake-notion.py и server.py под gunicorn (воркеры/потоки как в Dockerfile),
+прогоняет сценарии, похожие на реальный трафик (отправка привычек из app.js, недельная
+статистика из stat.js, прокси Notion, push, статика), и печатает JSON с пропускной
+способностью, задержками p50/p95/p99 и долей ошибок — его удобно сравнивать между коммитами.
+
+Пример:
+    python bench/run-bench.py --duration 15 --concurrency 8 --notion-latency 0.1 --output before.json
+    python bench/run-bench.py --compare before.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCH_DIR.parent
+HABITS = ['Deep work sessions', 'Learning sessions', 'Спорт', 'Чтение', 'Медитация', 'Сон до 23:00']
+ENERGY_ANSWERS = ['выжат апатия', 'тяжело', 'норм', 'хорошо', 'очень хорошо']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def dockerfile_settings():
+    """GUNICORN_WORKERS/GUNICORN_THREADS из ENV в Dockerfile"""
+    text = (ROOT_DIR / 'Dockerfile').read_text()
+    settings = {'GUNICORN_WORKERS': 2, 'GUNICORN_THREADS': 4}
+    for name in settings:
+        match = re.search(rf'{name}=(\d+)', text)
+        if match:
+            settings[name] = int(match.group(1))
+    return settings['GUNICORN_WORKERS'], settings['GUNICORN_THREADS']
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'{url} не ответил за {timeout}с')
+
+
+def percentile(values, p):
+    """Перцентиль по ближайшему рангу"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+# ==================== Сценарии ====================
+# Каждый сценарий — функция (session, base_url, rng) -> requests.Response
+
+def scenario_static(session, base, rng):
+    return session.get(base + rng.choice(['/gleb', '/app.js', '/styles.css', '/notion-api.js']))
+
+
+def scenario_config(session, base, rng):
+    return session.get(f'{base}/api/config', params={'user': 'gleb'})
+
+
+def scenario_submit(session, base, rng):
+    """Отправка дня из app.js: все привычки и ответ на вопрос об энергии одним батчем"""
+    day = (date.today() - timedelta(days=rng.randrange(30))).isoformat()
+    return session.post(f'{base}/api/habits/batch', json={
+        'user': 'gleb',
+        'date': day,
+        'habits': [{'name': name, 'completed': rng.random() < 0.6} for name in HABITS],
+        'energy': {'question': 'Уровень энергии', 'answer': rng.choice(ENERGY_ANSWERS)},
+    })
+
+
+def scenario_stats_week(session, base, rng):
+    """Недельная статистика из stat.js (одна из последних 12 недель)"""
+    today = date.today()
+    monday = today - timedelta(days=today.weekday(), weeks=rng.randrange(12))
+    return session.get(f'{base}/api/stats', params={
+        'user': 'gleb', 'from': monday.isoformat(), 'to': (monday + timedelta(days=6)).isoformat(),
+    })
+
+
+def scenario_proxy_schema(session, base, rng):
+    return session.get(f'{base}/api/notion/databases/bench-habits')
+
+
+def scenario_proxy_query(session, base, rng):
+    """Прямой запрос к базе привычек через прокси (как старый getHabits)"""
+    day = (date.today() - timedelta(days=rng.randrange(30))).isoformat()
+    return session.post(f'{base}/api/notion/data_sources/bench-habits-ds/query', json={
+        'filter': {'property': 'Date', 'date': {'equals': day}},
+    })
+
+
+def scenario_push(session, base, rng):
+    if rng.random() < 0.5:
+        return session.get(f'{base}/api/push/vapid-key')
+    endpoint = f'https://push.example.com/bench/{rng.randrange(20)}'
+    return session.post(f'{base}/api/push/subscribe', json={
+        'user': 'gleb',
+        'subscription': {'endpoint': endpoint, 'keys': {'p256dh': 'bench', 'auth': 'bench'}},
+    })
+
+
+SCENARIOS = {
+    'static': scenario_static,
+    'config': scenario_config,
+    'submit': scenario_submit,
+    'stats_week': scenario_stats_week,
+    'proxy_schema': scenario_proxy_schema,
+    'proxy_query': scenario_proxy_query,
+    'push': scenario_push,
+}
+
+
+def run_scenario(name, base, duration, concurrency, seed):
+    """Гонять сценарий concurrency клиентами в течение duration секунд"""
+    scenario = SCENARIOS[name]
+    latencies = []
+    statuses = {}
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        nonlocal errors
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = scenario(session, base, rng)
+                status = str(response.status_code)
+                failed = response.status_code >= 400 or response.status_code == 207
+            except requests.RequestException as e:
+                status = type(e).__name__
+                failed = True
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+                errors += failed
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    wall = time.monotonic() - started
+
+    total = len(latencies)
+    return {
+        'requests': total,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'throughput': round(total / wall, 2) if wall else 0.0,
+        'latency_ms': {
+            f'p{p}': round(percentile(latencies, p) * 1000, 2) if latencies else None
+            for p in (50, 95, 99)
+        } | {'max': round(max(latencies) * 1000, 2) if latencies else None},
+        'statuses': statuses,
+    }
+
+
+# ==================== Окружение ====================
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_processes(args, workdir, processes):
+    """Поднять заглушку Notion и сервер (процессы добавляются в processes); вернуть адреса"""
+    notion_port = free_port()
+    server_port = free_port()
+
+    fake = subprocess.Popen([
+        sys.executable, str(BENCH_DIR / 'fake-notion.py'), '--port', str(notion_port),
+        '--latency', str(args.notion_latency), '--rate-limit', str(args.rate_limit),
+        '--seed-days', str(args.seed_days),
+    ] + (['--gzip'] if args.notion_gzip else []), stderr=sys.stderr, stdout=sys.stderr)
+    processes.append(fake)
+
+    env = {
+        **os.environ,
+        'NOTION_TOKEN': 'bench',
+        'NOTION_API_BASE': f'http://127.0.0.1:{notion_port}/v1',
+        'DATABASE_ID': 'bench-habits',
+        'ENERGY_DATABASE_ID': 'bench-energy',
+        'ENERGY_DATA_SOURCE_ID': '',
+        'DASHA_DATABASE_ID': '',
+        'VAPID_PUBLIC_KEY': 'bench',
+        'MIRROR_DB': str(workdir / 'notion_mirror.db'),
+        'SUBSCRIPTIONS_DB': str(workdir / 'push_subscriptions.db'),
+        'GUNICORN_WORKERS': str(args.workers),
+        'GUNICORN_THREADS': str(args.threads),
+    }
+    wait_ready(f'http://127.0.0.1:{notion_port}/v1/_stats')
+
+    if args.mirror:
+        # Заполнить зеркало, чтобы статистика читалась из SQLite, а не из Notion
+        subprocess.run([sys.executable, 'notion-sync.py', '--once'], cwd=ROOT_DIR, env=env,
+                       check=True, stdout=sys.stderr)
+
+    if args.server == 'asgi':
+        command = [
+            sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(server_port),
+            '--workers', str(args.workers), '--log-level', 'warning', '--no-access-log',
+        ]
+    else:
+        command = [
+            sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{server_port}',
+            '--workers', str(args.workers), '--threads', str(args.threads),
+            '--log-level', 'warning', 'server:app',
+        ]
+    server = subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=sys.stderr, stderr=sys.stderr)
+    processes.append(server)
+
+    base = f'http://127.0.0.1:{server_port}'
+    wait_ready(f'{base}/api/config?user=gleb')
+    return base, notion_port
+
+
+def compare(report, baseline):
+    """Краткое сравнение с предыдущим отчётом (в stderr)"""
+    print(f"\n📊 Сравнение с {baseline['meta'].get('commit')}:", file=sys.stderr)
+    for name, current in report['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if not before or not before['throughput']:
+            continue
+        throughput = (current['throughput'] / before['throughput'] - 1) * 100
+        p95_before = before['latency_ms']['p95'] or 0
+        p95_now = current['latency_ms']['p95'] or 0
+        print(f"  {name:14} rps {before['throughput']:>8} → {current['throughput']:>8} ({throughput:+.0f}%)  "
+              f"p95 {p95_before}мс → {p95_now}мс  ошибки {before['error_rate']:.1%} → {current['error_rate']:.1%}",
+              file=sys.stderr)
+
+
+def main():
+    workers, threads = dockerfile_settings()
+    parser = argparse.ArgumentParser(description='Нагрузочный тест сервера трекера привычек')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f'Через запятую: {", ".join(SCENARIOS)}')
+    parser.add_argument('--duration', type=float, default=10, help='Секунд на сценарий')
+    parser.add_argument('--concurrency', type=int, default=8, help='Одновременных клиентов')
+    parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi',
+                        help='gunicorn (server:app) или uvicorn (asgi:app)')
+    parser.add_argument('--workers', type=int, default=workers, help='Воркеров gunicorn (по умолчанию из Dockerfile)')
+    parser.add_argument('--threads', type=int, default=threads, help='Потоков gunicorn (по умолчанию из Dockerfile)')
+    parser.add_argument('--notion-latency', type=float, default=0.05, help='Задержка заглушки Notion, сек')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Доля ответов 429 от заглушки (0..1)')
+    parser.add_argument('--seed-days', type=int, default=90, help='Дней истории в заглушке')
+    parser.add_argument('--notion-gzip', action='store_true', help='Заглушка сжимает ответы gzip, как Notion')
+    parser.add_argument('--mirror', action='store_true', help='Заполнить зеркало SQLite перед тестом')
+    parser.add_argument('--seed', type=int, default=1, help='Seed генератора запросов')
+    parser.add_argument('--output', help='Куда записать JSON (по умолчанию stdout)')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'Неизвестные сценарии: {", ".join(unknown)}')
+
+    with tempfile.TemporaryDirectory(prefix='habbits-bench-') as tmp:
+        processes = []
+        try:
+            base, notion_port = start_processes(args, Path(tmp), processes)
+            scenarios = {}
+            for name in names:
+                print(f"⏱️  {name}: {args.duration}с, {args.concurrency} клиентов", file=sys.stderr)
+                scenarios[name] = run_scenario(name, base, args.duration, args.concurrency, args.seed)
+            notion = requests.get(f'http://127.0.0.1:{notion_port}/v1/_stats', timeout=5).json()
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'server': args.server,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'workers': args.workers,
+            'threads': args.threads,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'notion_latency': args.notion_latency,
+            'rate_limit': args.rate_limit,
+            'notion_gzip': args.notion_gzip,
+            'mirror': args.mirror,
+        },
+        'scenarios': scenarios,
+        'notion': notion,
+    }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+        print(f"💾 Отчёт записан в {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        compare(report, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == '__main__':
+    main()
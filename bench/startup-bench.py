@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодного старта сервера: время до первого байта от запуска процесса
+
+Поднимает bench/fake-notion.py, затем несколько раз запускает сервер с нуля и сразу
+начинает опрашивать /gleb и /api/config. Для каждого пути записывается время от запуска
+процесса до заголовков первого успешного ответа (TTFB), а также время до открытия порта.
+Так выглядит первый запрос после простоя на хостинге со scale-to-zero (Render free).
+
+Пример:
+    python bench/startup-bench.py --runs 5 --entry gunicorn,flask --notion-latency 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+import requests
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCH_DIR.parent
+PATHS = ['/gleb', '/api/config?user=gleb']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'{url} не ответил за {timeout}с')
+
+
+def server_command(entry, port):
+    if entry == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', 'server:app']
+    if entry == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                '--log-level', 'warning']
+    return [sys.executable, 'server.py']
+
+
+def first_byte(url, started, deadline, results, key):
+    """Опрашивать url до первого успешного ответа; записать секунды от started до заголовков"""
+    session = requests.Session()
+    while time.perf_counter() < deadline:
+        try:
+            with session.get(url, timeout=30, stream=True) as response:
+                if response.status_code < 500:
+                    results[key] = time.perf_counter() - started
+                    results[f'{key} status'] = response.status_code
+                    return
+        except requests.RequestException:
+            time.sleep(0.005)
+
+
+def port_open(port, started, deadline, results):
+    while time.perf_counter() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                results['port'] = time.perf_counter() - started
+                return
+        except OSError:
+            time.sleep(0.002)
+
+
+def cold_start(entry, env, timeout):
+    """Один запуск сервера с нуля: {путь: TTFB, 'port': ..., 'warm <путь>': TTFB повторного запроса}"""
+    port = free_port()
+    results = {}
+    started = time.perf_counter()
+    process = subprocess.Popen(server_command(entry, port), cwd=ROOT_DIR, env={**env, 'PORT': str(port)},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = started + timeout
+    try:
+        pollers = [threading.Thread(target=port_open, args=(port, started, deadline, results))]
+        pollers += [threading.Thread(target=first_byte, args=(f'http://127.0.0.1:{port}{path}', started,
+                                                               deadline, results, path))
+                    for path in PATHS]
+        for poller in pollers:
+            poller.start()
+        for poller in pollers:
+            poller.join()
+        for path in PATHS:
+            if path in results:
+                warm_started = time.perf_counter()
+                requests.get(f'http://127.0.0.1:{port}{path}', timeout=30)
+                results[f'warm {path}'] = time.perf_counter() - warm_started
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return results
+
+
+def summarize(runs):
+    keys = ['port'] + PATHS + [f'warm {path}' for path in PATHS]
+    summary = {}
+    for key in keys:
+        values = [run[key] * 1000 for run in runs if key in run]
+        if values:
+            summary[key] = {
+                'median_ms': round(statistics.median(values), 1),
+                'min_ms': round(min(values), 1),
+                'max_ms': round(max(values), 1),
+                'runs': len(values),
+            }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк холодного старта сервера трекера привычек')
+    parser.add_argument('--entry', default='gunicorn,flask',
+                        help='Через запятую: gunicorn (gunicorn.conf.py), flask (python server.py), asgi (uvicorn)')
+    parser.add_argument('--runs', type=int, default=5, help='Запусков каждого варианта')
+    parser.add_argument('--workers', type=int, default=1, help='Воркеров gunicorn (как на Render free)')
+    parser.add_argument('--threads', type=int, default=8, help='Потоков gunicorn')
+    parser.add_argument('--notion-latency', type=float, default=0.1, help='Задержка заглушки Notion, сек')
+    parser.add_argument('--timeout', type=float, default=60, help='Сколько ждать первого ответа, сек')
+    parser.add_argument('--output', help='Куда записать JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    entries = [entry.strip() for entry in args.entry.split(',') if entry.strip()]
+    unknown = [entry for entry in entries if entry not in ('gunicorn', 'flask', 'asgi')]
+    if unknown:
+        parser.error(f'Неизвестные варианты: {", ".join(unknown)}')
+
+    notion_port = free_port()
+    fake = subprocess.Popen([
+        sys.executable, str(BENCH_DIR / 'fake-notion.py'), '--port', str(notion_port),
+        '--latency', str(args.notion_latency), '--seed-days', '7',
+    ], stdout=subprocess.DEVNULL, stderr=sys.stderr)
+    report = {'meta': {'runs': args.runs, 'workers': args.workers, 'threads': args.threads,
+                       'notion_latency': args.notion_latency}, 'entries': {}}
+    try:
+        wait_ready(f'http://127.0.0.1:{notion_port}/v1/_stats')
+        with tempfile.TemporaryDirectory(prefix='habbits-startup-') as tmp:
+            env = {
+                **os.environ,
+                'NOTION_TOKEN': 'bench',
+                'NOTION_API_BASE': f'http://127.0.0.1:{notion_port}/v1',
+                'DATABASE_ID': 'bench-habits',
+                'ENERGY_DATABASE_ID': 'bench-energy',
+                'ENERGY_DATA_SOURCE_ID': '',
+                'DASHA_DATABASE_ID': '',
+                'USERS_FILE': str(Path(tmp) / 'users.json'),
+                'MIRROR_DB': str(Path(tmp) / 'notion_mirror.db'),
+                'SUBSCRIPTIONS_DB': str(Path(tmp) / 'push_subscriptions.db'),
+                'PAGE_INDEX_DB': str(Path(tmp) / 'page_index.db'),
+                'NOTION_BUCKET_FILE': str(Path(tmp) / 'notion_bucket'),
+                'GUNICORN_WORKERS': str(args.workers),
+                'GUNICORN_THREADS': str(args.threads),
+            }
+            for entry in entries:
+                runs = []
+                for index in range(args.runs):
+                    run = cold_start(entry, env, args.timeout)
+                    runs.append(run)
+                    timings = ', '.join(f'{key} {run[key] * 1000:.0f}мс' for key in ['port'] + PATHS if key in run)
+                    print(f"⏱️  {entry} #{index + 1}: {timings}", file=sys.stderr)
+                report['entries'][entry] = summarize(runs)
+    finally:
+        fake.terminate()
+        fake.wait(timeout=10)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+        print(f"💾 Отчёт записан в {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -16,17 +16,24 @@ const DATABASE_CONFIG = {
     // Если не указан, будет получен автоматически из database
     ENERGY_DATA_SOURCE_ID: null, // Будет загружено с сервера
     
+    // data_source_id базы привычек и поля базы энергии ({questionField, dateField, answerField})
+    // Определяются сервером, чтобы не запрашивать схемы баз из браузера
+    DATA_SOURCE_ID: null, // Будет загружено с сервера
+    ENERGY_SCHEMA: null, // Будет загружено с сервера
+    
+    // Оформление и настройки пользователя из реестра на сервере (users.json)
+    TITLE: null, // Заголовок страницы
+    EMOJI: null, // Фавиконка
+    STATS: false, // Есть ли страница статистики
+    HABITS: null, // {категория: [привычки]}; null — список по умолчанию из app.js
+    
     // Текущий пользователь
     USER: 'gleb', // Будет определен из URL
 };
 
-// Определяем пользователя из URL
+// Определяем пользователя из URL (/dasha, /dasha/stat); пустая строка — пользователь по умолчанию
 function getCurrentUser() {
-    const path = window.location.pathname;
-    if (path.includes('/dasha')) {
-        return 'dasha';
-    }
-    return 'gleb'; // По умолчанию
+    return window.location.pathname.split('/')[1] || '';
 }
 
 // Загружаем конфигурацию с сервера при загрузке страницы
@@ -47,8 +54,18 @@ const configLoadPromise = (async function loadConfig() {
             if (config.ENERGY_DATA_SOURCE_ID) {
                 DATABASE_CONFIG.ENERGY_DATA_SOURCE_ID = config.ENERGY_DATA_SOURCE_ID;
             }
+            if (config.DATA_SOURCE_ID) {
+                DATABASE_CONFIG.DATA_SOURCE_ID = config.DATA_SOURCE_ID;
+            }
+            if (config.ENERGY_SCHEMA) {
+                DATABASE_CONFIG.ENERGY_SCHEMA = config.ENERGY_SCHEMA;
+            }
+            DATABASE_CONFIG.TITLE = config.TITLE || null;
+            DATABASE_CONFIG.EMOJI = config.EMOJI || null;
+            DATABASE_CONFIG.STATS = Boolean(config.STATS);
+            DATABASE_CONFIG.HABITS = config.HABITS || null;
             // Сохраняем информацию о пользователе
-            DATABASE_CONFIG.USER = config.USER || user;
+            DATABASE_CONFIG.USER = config.USER || user || DATABASE_CONFIG.USER;
             currentUser = DATABASE_CONFIG.USER;
             console.log(`✅ Конфигурация загружена с сервера для пользователя: ${currentUser}`);
             configLoaded = true;
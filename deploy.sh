@@ -1,6 +1,6 @@
 #!/bin/bash
-# Скрипт автоматического деплоя для habbits
-# Запускается при пуше в main ветку
+# Скрипт ручного деплоя для habbits (полная пересборка)
+# Пуши в main деплоит очередь webhook-server.py, история — на :9000/status
 
 set -e
 
@@ -20,15 +20,22 @@ git reset --hard origin/$BRANCH
 
 # Пересобираем и перезапускаем контейнер
 echo "🔨 Пересобираем Docker-образ..."
-docker compose build --no-cache
+docker compose build
 
 echo "🔄 Перезапускаем контейнер..."
 docker compose up -d
 
 # Проверяем здоровье
 echo "🏥 Проверяем статус..."
-sleep 5
-if docker compose ps | grep -q "Up"; then
+HEALTHY=""
+for i in $(seq 1 60); do
+    if curl -fs -o /dev/null "http://127.0.0.1:3000/"; then
+        HEALTHY=1
+        break
+    fi
+    sleep 1
+done
+if [ -n "$HEALTHY" ]; then
     echo "✅ Деплой завершён успешно!"
     docker compose ps
 else
@@ -0,0 +1,37 @@
+"""
+Настройки gunicorn для продакшена (Docker и Render): gunicorn -c gunicorn.conf.py server:app
+
+Мастер открывает порт до загрузки приложения, а воркеры импортируют server.py уже
+после bind: хостинг сразу видит открытый порт, первые запросы ждут в очереди сокета,
+а прогрев (соединение с Notion, схемы баз) начинается в фоне сразу после импорта.
+"""
+
+import os
+import time
+
+bind = f"0.0.0.0:{os.getenv('PORT', '3000')}"
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+keepalive = 5
+
+# Без preload: фоновые потоки прогрева запускаются в каждом воркере, а не в мастере до fork
+preload_app = False
+
+# Файлы heartbeat воркеров в памяти, а не на диске контейнера
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+started = time.monotonic()
+
+
+def when_ready(server):
+    server.log.info(f"🚀 Порт {bind} открыт через {time.monotonic() - started:.2f}с после запуска")
+
+
+def post_worker_init(worker):
+    worker.log.info(f"✅ Воркер {worker.pid} загрузил приложение через {time.monotonic() - started:.2f}с после запуска")
@@ -0,0 +1,344 @@
+"""
+Аналитика привычек за всю историю: серии, цели по неделям и месяцам, скользящие средние,
+связь привычек с энергией
+
+История пользователя из зеркала (notion_mirror.py) лежит в памяти воркера матрицей
+день × привычка (NumPy, число выполненных записей за день) и вектором оценок энергии
+по дням. Матрица строится один раз, а дальше обновляется по журналу изменений зеркала:
+приходят только изменённые и удалённые страницы. Все расчёты — векторные операции над
+срезом матрицы, поэтому запрос за несколько лет занимает миллисекунды.
+"""
+
+import time
+import threading
+from datetime import date as Date, timedelta
+
+import numpy as np
+
+from notion_mirror import mirror as default_mirror
+
+# Цели в неделю по умолчанию (как HABITS_GOALS в stat.js); у пользователя — поле goals в users.json
+DEFAULT_GOALS = {
+    'Daily': 5,
+    'Healthy food': 7,
+    'Workouts': 2,
+    'Doomscroll < 30m': 7,
+    'Go outside': 7,
+    'Deep work sessions': 5,
+    'Outs this week': 2,
+    'Learning sessions': 3,
+    'Inner work': 1,
+    'Family call': 1,
+    'Friday date': 1,
+    'Offline go out': 1,
+    'Tier 2-4 reaching out': 2,
+}
+
+EPOCH = Date(1970, 1, 1)
+GROW_DAYS = 366  # Запас строк матрицы при добавлении новых дней
+
+
+def day_number(value):
+    """'YYYY-MM-DD' или date -> номер дня от 1970-01-01"""
+    if isinstance(value, str):
+        value = Date.fromisoformat(value[:10])
+    return (value - EPOCH).days
+
+
+def day_numbers(values):
+    """Список строк 'YYYY-MM-DD' -> массив номеров дней (векторно)"""
+    return np.array([value[:10] for value in values], dtype='datetime64[D]').astype(np.int64)
+
+
+def run_lengths(done):
+    """Длина непрерывной серии, заканчивающейся в каждой строке (по столбцам)
+
+    [1, 1, 0, 1] -> [1, 2, 0, 1]: накопленная сумма минус её значение в последнем пропуске.
+    """
+    total = np.cumsum(done, axis=0, dtype=np.int32)
+    at_gaps = np.where(done, 0, total)
+    return total - np.maximum.accumulate(at_gaps, axis=0)
+
+
+def rolling_mean(values, window):
+    """Скользящее среднее по строкам (в начале периода — по доступным дням)"""
+    total = np.cumsum(values, axis=0, dtype=np.float64)
+    shifted = np.zeros_like(total)
+    shifted[window:] = total[:-window]
+    counts = np.minimum(np.arange(1, len(values) + 1), window).reshape((-1,) + (1,) * (values.ndim - 1))
+    return (total - shifted) / counts
+
+
+def rounded(values, digits=3):
+    """Массив -> список чисел для JSON (NaN -> None)"""
+    values = np.round(np.asarray(values, dtype=np.float64), digits)
+    result = values.tolist()
+    if np.isnan(values).any():
+        result = [None if value != value else value for value in result]
+    return result
+
+
+class HabitMatrix:
+    """История одного пользователя: день × привычка и оценки энергии по дням"""
+
+    def __init__(self):
+        self.origin = None  # Номер дня первой строки
+        self.counts = np.zeros((0, 0), dtype=np.int16)
+        self.energy = np.zeros(0, dtype=np.float32)
+        self.columns = {}  # Привычка -> столбец
+        self.names = []
+        self.pages = {}  # page_id привычки -> (день, столбец, выполнена)
+        self.energy_pages = {}  # page_id энергии -> (день, оценка)
+        self.seq = 0  # Последний учтённый номер журнала изменений зеркала
+
+    # ---------- Размер ----------
+
+    def ensure_days(self, first, last):
+        """Расширить матрицу, чтобы в неё попали дни [first, last]"""
+        if self.origin is None:
+            self.origin = first
+        rows = self.counts.shape[0]
+        before = max(self.origin - first, 0)
+        after = max(last - (self.origin + rows - 1), 0)
+        if not before and not after:
+            return
+        if after:
+            after = max(after, GROW_DAYS)  # Новые дни приходят по одному — растём с запасом
+        self.counts = np.pad(self.counts, ((before, after), (0, 0)))
+        self.energy = np.pad(self.energy, (before, after), constant_values=np.nan)
+        self.origin -= before
+
+    def column(self, name):
+        index = self.columns.get(name)
+        if index is None:
+            index = self.columns[name] = len(self.names)
+            self.names.append(name)
+            self.counts = np.pad(self.counts, ((0, 0), (0, 1)))
+        return index
+
+    # ---------- Обновление ----------
+
+    def apply_habits(self, rows):
+        """Учесть страницы привычек [(page_id, date, habit, completed), ...]; date = None — страница удалена"""
+        rows = list(rows)
+        present = [row for row in rows if row[1] and row[2]]
+        if present:
+            days = day_numbers([row[1] for row in present])
+            self.ensure_days(int(days.min()), int(days.max()))
+        else:
+            days = np.zeros(0, dtype=np.int64)
+        columns = [self.column(row[2]) for row in present]
+
+        # Снимаем прежний вклад изменённых страниц и добавляем новый
+        previous = [self.pages.pop(row[0], None) for row in rows]
+        old = [(day, column) for day, column, completed in filter(None, previous) if completed]
+        if old:
+            old_days, old_columns = zip(*old)
+            np.subtract.at(self.counts, (np.array(old_days) - self.origin, np.array(old_columns)), 1)
+
+        completed = np.array([bool(row[3]) for row in present], dtype=bool)
+        if completed.any():
+            np.add.at(self.counts, (days[completed] - self.origin, np.array(columns)[completed]), 1)
+        for row, day, column, done in zip(present, days.tolist(), columns, completed.tolist()):
+            self.pages[row[0]] = (day, column, done)
+
+    def apply_energy(self, rows):
+        """Учесть страницы энергии [(page_id, date, score), ...]; date = None — страница удалена"""
+        touched = set()
+        for page_id, date, score in rows:
+            previous = self.energy_pages.pop(page_id, None)
+            if previous:
+                touched.add(previous[0])
+            if date and score is not None:
+                day = day_number(date)
+                self.ensure_days(day, day)
+                self.energy_pages[page_id] = (day, float(score))
+                touched.add(day)
+        if touched:
+            # Оценка дня — среднее по его страницам (обычно одна)
+            scores = {}
+            for day, score in self.energy_pages.values():
+                if day in touched:
+                    scores.setdefault(day, []).append(score)
+            for day in touched:
+                self.energy[day - self.origin] = np.mean(scores[day]) if day in scores else np.nan
+
+    # ---------- Срезы ----------
+
+    def window(self, first, last):
+        """(привычки дни × столбцы, энергия) за дни [first, last]; дни вне истории — нули и NaN"""
+        days = last - first + 1
+        counts = np.zeros((days, len(self.names)), dtype=np.int32)
+        energy = np.full(days, np.nan, dtype=np.float64)
+        if self.origin is not None:
+            start = max(first, self.origin)
+            end = min(last, self.origin + self.counts.shape[0] - 1)
+            if start <= end:
+                counts[start - first:end - first + 1] = self.counts[start - self.origin:end - self.origin + 1]
+                energy[start - first:end - first + 1] = self.energy[start - self.origin:end - self.origin + 1]
+        return counts, energy
+
+
+class AnalyticsEngine:
+    """Матрицы пользователей в памяти воркера, обновляемые по журналу изменений зеркала"""
+
+    def __init__(self, store=default_mirror):
+        self.store = store
+        self.lock = threading.Lock()
+        self.matrices = {}
+
+    def matrix(self, user):
+        """Актуальная матрица пользователя: полная загрузка один раз, дальше — только изменения"""
+        with self.lock:
+            return self.refresh(user)
+
+    def refresh(self, user):
+        # Вызывается под self.lock
+        first, last = self.store.change_bounds()
+        matrix = self.matrices.get(user)
+        if matrix is not None and matrix.seq == last:
+            return matrix
+        if matrix is None or matrix.seq < first - 1:
+            # Нет матрицы или журнал обрезан дальше, чем мы успели прочитать
+            matrix = HabitMatrix()
+            matrix.apply_habits(self.store.all_habits(user))
+            matrix.apply_energy(self.store.all_energy(user))
+        else:
+            matrix.apply_habits(self.store.changed_habits(user, matrix.seq))
+            matrix.apply_energy(self.store.changed_energy(user, matrix.seq))
+        # Изменения, пришедшие во время чтения, применятся повторно — это безопасно
+        matrix.seq = last
+        self.matrices[user] = matrix
+        return matrix
+
+    def summary(self, user, start, end, goals=None, window=7, today=None):
+        """Аналитика за период [start, end] (даты включительно)"""
+        started = time.perf_counter()
+        goals = goals or DEFAULT_GOALS
+        today = today or Date.today()
+        with self.lock:
+            matrix = self.refresh(user)
+            counts, energy = matrix.window(day_number(start), day_number(end))
+            names = list(matrix.names)
+
+        # Только привычки, у которых в периоде что-то было или задана цель
+        keep = sorted((index for index, name in enumerate(names) if counts[:, index].any() or name in goals),
+                      key=names.__getitem__)
+        names = [names[index] for index in keep]
+        counts = counts[:, keep]
+        done = counts > 0
+        # Серии считаем по сегодняшний день: будущие дни периода пусты и обнулили бы текущую серию
+        elapsed = done[:max(0, (min(end, today) - start).days + 1)]
+
+        result = {
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'days': int(counts.shape[0]),
+            'habits': names,
+            'totals': dict(zip(names, counts.sum(axis=0).tolist())),
+            'streaks': self.streaks(names, elapsed, end >= today),
+            'weeks': self.weeks(names, counts, start, goals),
+            'months': self.months(names, counts, start, goals),
+            'rolling': self.rolling(names, counts, start, window),
+            'energy': self.energy_links(names, done, energy),
+        }
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+    # ---------- Расчёты ----------
+
+    @staticmethod
+    def streaks(names, done, includes_today):
+        """Текущая и самая длинная серия дней подряд по каждой привычке"""
+        if not len(done):
+            return {}
+        runs = run_lengths(done)
+        current = runs[-1]
+        if includes_today and len(runs) > 1:
+            # Сегодня ещё не отмечено — серия до вчера не прервана
+            current = np.where(done[-1], runs[-1], runs[-2])
+        longest = runs.max(axis=0)
+        return {name: {'current': int(now), 'longest': int(best)}
+                for name, now, best in zip(names, current.tolist(), longest.tolist())}
+
+    @staticmethod
+    def weeks(names, counts, start, goals):
+        """Записи по неделям (с понедельника) и выполнение недельных целей"""
+        lead = start.weekday()  # Дни до start в первой неделе
+        days = lead + counts.shape[0]
+        padded = np.zeros((-(-days // 7) * 7, counts.shape[1]), dtype=np.int32)
+        padded[lead:lead + counts.shape[0]] = counts
+        weekly = padded.reshape(-1, 7, counts.shape[1]).sum(axis=1)
+
+        targets = np.array([goals.get(name, 0) for name in names], dtype=np.float64)
+        met = (weekly >= targets) & (targets > 0)
+        week_runs = run_lengths(met)
+        monday = start - timedelta(days=lead)
+        return {
+            'starts': [(monday + timedelta(weeks=index)).isoformat() for index in range(len(weekly))],
+            'counts': {name: weekly[:, index].tolist() for index, name in enumerate(names)},
+            'goals': {name: goals[name] for name in names if name in goals},
+            'attainment': {name: round(float(met[:, index].mean()), 3)
+                           for index, name in enumerate(names) if targets[index] > 0},
+            'streaks': {name: {'current': int(week_runs[-1, index]), 'longest': int(week_runs[:, index].max())}
+                        for index, name in enumerate(names) if targets[index] > 0 and len(week_runs)},
+        }
+
+    @staticmethod
+    def months(names, counts, start, goals):
+        """Записи по месяцам и доля недельной цели, пересчитанной на дни месяца в периоде"""
+        days = np.arange(counts.shape[0])
+        dates = np.datetime64(start.isoformat(), 'D') + days
+        month_ids = dates.astype('datetime64[M]')
+        boundaries = np.flatnonzero(np.r_[True, month_ids[1:] != month_ids[:-1]])
+        monthly = np.add.reduceat(counts, boundaries, axis=0) if len(boundaries) else counts[:0]
+        lengths = np.diff(np.r_[boundaries, counts.shape[0]])
+
+        targets = np.array([goals.get(name, 0) for name in names], dtype=np.float64)
+        expected = np.outer(lengths / 7.0, targets)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(expected > 0, monthly / expected, np.nan)
+        return {
+            'starts': [str(month) for month in month_ids[boundaries]],
+            'counts': {name: monthly[:, index].tolist() for index, name in enumerate(names)},
+            'attainment': {name: rounded(ratio[:, index])
+                           for index, name in enumerate(names) if targets[index] > 0},
+        }
+
+    @staticmethod
+    def rolling(names, counts, start, window):
+        """Скользящее среднее выполненных записей в день: всего по дням и последнее значение по привычкам"""
+        window = max(1, int(window))
+        if not len(counts):
+            return {'window': window, 'total': [], 'last': {}}
+        total = rolling_mean(counts.sum(axis=1), window)
+        return {
+            'window': window,
+            'total': rounded(total),
+            'last': dict(zip(names, rounded(counts[-window:].mean(axis=0)))),
+        }
+
+    @staticmethod
+    def energy_links(names, done, energy):
+        """Корреляция выполнения привычки с оценкой энергии в тот же день и разница средних"""
+        known = ~np.isnan(energy)
+        scores = energy[known]
+        result = {'days': int(known.sum()), 'mean': rounded([scores.mean()])[0] if len(scores) else None,
+                  'correlation': {}, 'lift': {}}
+        if len(scores) < 3:
+            return result
+        habits = done[known].astype(np.float64)
+        centered = habits - habits.mean(axis=0)
+        centered_scores = scores - scores.mean()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = (centered.T @ centered_scores) / (
+                np.sqrt((centered ** 2).sum(axis=0)) * np.sqrt((centered_scores ** 2).sum()))
+            # Средняя энергия в дни с привычкой минус в дни без неё
+            with_habit = (habits.T @ scores) / habits.sum(axis=0)
+            without = ((1 - habits).T @ scores) / (1 - habits).sum(axis=0)
+        result['correlation'] = dict(zip(names, rounded(correlation)))
+        result['lift'] = dict(zip(names, rounded(with_habit - without)))
+        return result
+
+
+analytics = AnalyticsEngine()
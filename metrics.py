@@ -0,0 +1,205 @@
+"""
+Метрики в памяти процесса в формате Prometheus
+
+Счётчики и гистограммы задержек на горячих путях (прокси к Notion, запросы к
+Notion, хранилище подписок, отправка push). Запись — словарь по кортежу меток
+и bisect по границам корзин под блокировкой метрики, без внешних зависимостей.
+Сервер отдаёт метрики на /metrics, планировщик пишет их в файл после каждой
+рассылки.
+
+У каждого воркера gunicorn свои метрики: /metrics показывает воркер, который
+обработал запрос (метка pid в habbits_process_info).
+"""
+
+import os
+import time
+import bisect
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+
+# Границы корзин гистограмм задержек, сек
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            items = sorted(self.values.items())
+            lines.extend(self.samples(items))
+        return lines
+
+    def samples(self, items):
+        return [f'{self.name}{format_labels(self.labels, key)} {format_value(value)}' for key, value in items]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # [счётчики корзин..., +Inf], сумма
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, **labels):
+        """Контекстный менеджер: измерить длительность блока"""
+        return Timer(self, labels)
+
+    def samples(self, items):
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, key, [("le", format_value(bound))])} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+        self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            # Повторный импорт модуля (например, server и asgi) получает ту же метрику
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, description, labels=()):
+        return self.register(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=()):
+        return self.register(Gauge(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Записать метрики в файл атомарно (для textfile collector node_exporter)"""
+        path = Path(path)
+        tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        tmp.write_text(self.render())
+        os.replace(tmp, path)
+
+
+registry = Registry()
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+process_info = registry.gauge('habbits_process_info', 'Процесс, отдавший метрики', ('pid', 'role'))
+process_start = registry.gauge('habbits_process_start_time_seconds', 'Время запуска процесса (unix)')
+process_start.set(time.time())
+
+# ==================== Push ====================
+# Общие для server.py, asgi.py и push-scheduler.py
+
+push_seconds = registry.histogram('habbits_push_send_seconds', 'Задержка отправки push по push-сервису',
+                                  ('service',))
+push_results = registry.counter('habbits_push_sent_total', 'Отправленные push по push-сервису и результату',
+                                ('service', 'result'))
+
+
+def push_service(endpoint):
+    """Хост push-сервиса (fcm.googleapis.com, web.push.apple.com, ...) — без токена подписки"""
+    return urlparse(endpoint or '').netloc or 'unknown'
+
+
+def observe_push(endpoint, seconds, status):
+    """Записать отправку push: status — HTTP-код ответа или None при сетевой ошибке"""
+    service = push_service(endpoint)
+    push_seconds.observe(seconds, service=service)
+    if status is None:
+        result = 'error'
+    elif status <= 202:
+        result = 'ok'
+    elif status in (404, 410):
+        result = 'invalid'
+    else:
+        result = f'http_{status}'
+    push_results.inc(service=service, result=result)
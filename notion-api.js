@@ -59,6 +59,11 @@ async function getDataSourceId(databaseId = null) {
     if (!isEnergyDb && cachedDataSourceId) {
         return cachedDataSourceId;
     }
+    // data_source_id, определённый сервером (приходит в /api/config)
+    if (!isEnergyDb && targetDatabaseId === DATABASE_CONFIG.DATABASE_ID && DATABASE_CONFIG.DATA_SOURCE_ID) {
+        cachedDataSourceId = DATABASE_CONFIG.DATA_SOURCE_ID;
+        return cachedDataSourceId;
+    }
 
     try {
         // Получаем информацию о базе данных с версией 2025-09-03
@@ -104,49 +109,36 @@ async function getEnergyDataSourceId() {
 }
 
 /**
- * Получить все привычки из базы данных на сегодня
+ * Получить записи за период в компактном виде
+ * Сервер отдаёт только нужные поля (без метаданных страниц Notion), сжатые gzip и с ETag:
+ * браузер перепроверяет кэш условным запросом и при неизменных данных получает 304 без тела
+ * @param {string} kind - 'habits' или 'energy'
+ * @param {string} from - Начало периода YYYY-MM-DD
+ * @param {string} to - Конец периода YYYY-MM-DD
+ * @returns {Promise<Array<Object>>} Записи с полями из ответа сервера (fields)
+ */
+async function getRecords(kind, from, to) {
+    const user = DATABASE_CONFIG.USER || 'gleb';
+    const params = new URLSearchParams({ user, kind, from, to, format: 'rows' });
+    const response = await fetch(`/api/records?${params}`);
+    const data = await response.json();
+
+    if (!response.ok) {
+        throw new Error(data.message || data.error || `Ошибка API: ${response.status}`);
+    }
+
+    return data.rows.map(row => Object.fromEntries(data.fields.map((field, i) => [field, row[i]])));
+}
+
+/**
+ * Получить все записи о привычках на сегодня
+ * Сервер отдаёт их из локального зеркала Notion (или из Notion, если зеркало устарело)
+ * @returns {Promise<Array<{id: string, habit: string, date: string, completed: boolean}>>}
  */
 async function getHabits() {
     try {
-        // Получаем data_source_id
-        const dataSourceId = await getDataSourceId();
-        
-        // Используем новый endpoint для data sources согласно 2025-09-03
-        const endpoint = `/data_sources/${dataSourceId}/query`;
         const today = new Date().toISOString().split('T')[0];
-        
-        // Пробуем с фильтром по дате
-        let response;
-        try {
-            response = await notionRequest(endpoint, 'POST', {
-                filter: {
-                    property: 'Date',
-                    date: {
-                        equals: today,
-                    },
-                },
-                page_size: 100,
-            });
-        } catch (error) {
-            // Если фильтр не работает, получаем все записи и фильтруем на клиенте
-            console.warn('Фильтр по дате не работает, получаем все записи:', error.message);
-            response = await notionRequest(endpoint, 'POST', {
-                page_size: 100,
-            });
-            
-            // Фильтруем на клиенте
-            if (response.results) {
-                response.results = response.results.filter(page => {
-                    const dateProperty = page.properties?.Date?.date;
-                    if (dateProperty?.start) {
-                        return dateProperty.start.startsWith(today);
-                    }
-                    return false;
-                });
-            }
-        }
-
-        return response.results || [];
+        return await getRecords('habits', today, today);
     } catch (error) {
         console.error('Ошибка получения привычек:', error);
         return [];
@@ -163,6 +155,7 @@ async function getDatabaseSchema() {
 
 /**
  * Получить схему базы данных энергии и определить названия полей
+ * Обычно поля уже определены сервером и пришли в /api/config; иначе определяем сами
  * Согласно новой версии Notion API, properties находятся в data_source, а не в database
  */
 async function getEnergyDatabaseSchema() {
@@ -174,6 +167,13 @@ async function getEnergyDatabaseSchema() {
         throw new Error('ENERGY_DATABASE_ID не настроен');
     }
 
+    // Поля, определённые сервером (приходят в /api/config) — запросы к Notion не нужны
+    const serverSchema = DATABASE_CONFIG.ENERGY_SCHEMA;
+    if (serverSchema && serverSchema.questionField && serverSchema.dateField && serverSchema.answerField) {
+        cachedEnergyDatabaseSchema = { ...serverSchema };
+        return cachedEnergyDatabaseSchema;
+    }
+
     try {
         // Шаг 1: Получаем database для получения data_sources
         const dbEndpoint = `/databases/${DATABASE_CONFIG.ENERGY_DATABASE_ID}`;
@@ -364,115 +364,66 @@ async function createHabitRecord(habitName, completed = true, date = null) {
 
 /**
  * Создать или обновить запись о привычке
+ * Сервер помнит ID страниц за день, поэтому обновление — один PATCH без поиска записи
  * @param {string} habitName - Название привычки
  * @param {boolean} completed - Выполнена ли привычка
  * @param {string} date - Дата в формате YYYY-MM-DD (по умолчанию сегодня)
+ * @param {number} ordinal - Номер записи привычки за день (для каунтеров)
  */
-async function updateHabit(habitName, completed, date = null) {
+async function updateHabit(habitName, completed, date = null, ordinal = 0) {
     if (!date) {
         date = new Date().toISOString().split('T')[0];
     }
 
-    // Получаем data_source_id
-    const dataSourceId = await getDataSourceId();
+    const response = await fetch('/api/habits/upsert', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Idempotency-Key': createIdempotencyKey(),
+        },
+        body: JSON.stringify({
+            user: DATABASE_CONFIG.USER || 'gleb',
+            date,
+            name: habitName,
+            completed,
+            ordinal,
+        }),
+    });
+    const data = await response.json();
 
-    // Сначала ищем существующую запись на эту дату
-    // Используем новый endpoint для data sources
-    const existingRecords = await notionRequest(
-        `/data_sources/${dataSourceId}/query`,
-        'POST',
-        {
-            filter: {
-                and: [
-                    {
-                        property: 'Date',
-                        date: {
-                            equals: date,
-                        },
-                    },
-                    {
-                        property: 'Habit',
-                        title: {
-                            equals: habitName,
-                        },
-                    },
-                ],
-            },
-        }
-    );
+    if (!response.ok) {
+        console.error(`❌ Ошибка записи привычки ${response.status}:`, data);
+        throw new Error(data.message || data.error || `Ошибка API: ${response.status}`);
+    }
 
-    const pageId = existingRecords.results?.[0]?.id;
+    return data;
+}
 
-    if (pageId) {
-        // Обновляем существующую запись
-        const endpoint = `/pages/${pageId}`;
-        return await notionRequest(endpoint, 'PATCH', {
-            properties: {
-                Completed: {
-                    checkbox: completed,
-                },
-            },
-        });
-    } else {
-        // Создаем новую запись
-        // Согласно 2025-09-03, используем data_source_id вместо database_id
-        const endpoint = '/pages';
-        return await notionRequest(endpoint, 'POST', {
-            parent: {
-                type: 'data_source_id',
-                data_source_id: dataSourceId,
-            },
-            properties: {
-                Habit: {
-                    title: [
-                        {
-                            text: {
-                                content: habitName,
-                            },
-                        },
-                    ],
-                },
-                Date: {
-                    date: {
-                        start: date,
-                    },
-                },
-                Completed: {
-                    checkbox: completed,
-                },
-            },
-        });
+/**
+ * Ключ идемпотентности: повтор запроса с тем же ключом не запишет данные второй раз
+ */
+function createIdempotencyKey() {
+    if (window.crypto && window.crypto.randomUUID) {
+        return window.crypto.randomUUID();
     }
+    return `${Date.now()}-${Math.random().toString(36).slice(2)}`;
 }
 
 /**
  * Получить все уникальные привычки (для начальной загрузки)
+ * Список строится по всей истории, а не только по первым 100 записям
  */
 async function getAllHabitsList() {
     try {
-        // Получаем data_source_id
-        const dataSourceId = await getDataSourceId();
-        
-        // Используем новый endpoint для data sources согласно 2025-09-03
-        const endpoint = `/data_sources/${dataSourceId}/query`;
-        
-        // Получаем все записи (можно ограничить период, но для простоты получаем все)
-        const response = await notionRequest(endpoint, 'POST', {
-            page_size: 100,
-        });
-
-        // Извлекаем уникальные названия привычек
-        const habitsSet = new Set();
-        if (response.results) {
-            response.results.forEach(page => {
-                const habitProperty = page.properties?.Habit;
-                if (habitProperty?.title?.[0]?.plain_text) {
-                    habitsSet.add(habitProperty.title[0].plain_text);
-                }
-            });
+        const user = DATABASE_CONFIG.USER || 'gleb';
+        const response = await fetch(`/api/habits/names?user=${user}`);
+        const data = await response.json();
+
+        if (!response.ok) {
+            throw new Error(data.message || data.error || `Ошибка API: ${response.status}`);
         }
 
-        return Array.from(habitsSet);
+        return data.names || [];
     } catch (error) {
         console.error('Ошибка получения списка привычек:', error);
         return [];
@@ -536,3 +487,49 @@ async function createEnergyRecord(question, answer, date = null) {
         properties: properties,
     });
 }
+
+/**
+ * Отправить все привычки за день и ответ об энергии одним запросом
+ * Сервер сам пишет записи в Notion с учётом лимитов и повторов;
+ * уже записанные за день привычки обновляются, а не дублируются
+ * @param {Array<{name: string, completed: boolean}>} habits - Записи о привычках
+ * @param {{question: string, answer: string}|null} energy - Ответ об энергии (опционально)
+ * @param {string} date - Дата в формате YYYY-MM-DD
+ * @returns {Promise<{results: Array, succeeded: number, failed: number}>}
+ */
+async function submitHabitsBatch(habits, energy = null, date = null) {
+    if (!date) {
+        date = new Date().toISOString().split('T')[0];
+    }
+
+    // Если ответ потерялся по сети, повторяем с тем же ключом — сервер вернёт сохранённый результат
+    const idempotencyKey = createIdempotencyKey();
+    const request = {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Idempotency-Key': idempotencyKey,
+        },
+        body: JSON.stringify({
+            user: DATABASE_CONFIG.USER || 'gleb',
+            date,
+            habits,
+            energy,
+        }),
+    };
+    let response;
+    try {
+        response = await fetch('/api/habits/batch', request);
+    } catch (error) {
+        console.warn('⚠️ Сетевая ошибка при отправке, повторяем с тем же ключом:', error);
+        response = await fetch('/api/habits/batch', request);
+    }
+    const data = await response.json();
+
+    if (!response.ok) {
+        console.error(`❌ Ошибка batch-записи ${response.status}:`, data);
+        throw new Error(data.message || data.error || `Ошибка API: ${response.status}`);
+    }
+
+    return data;
+}
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Фоновая синхронизация зеркала Notion
+Подтягивает изменённые записи привычек и энергии в локальную SQLite-базу
+"""
+
+import os
+import sys
+import time
+import threading
+
+try:
+    from apscheduler.schedulers.blocking import BlockingScheduler
+    from apscheduler.triggers.interval import IntervalTrigger
+except ImportError:
+    print("❌ apscheduler не установлен. Запустите: pip install apscheduler")
+    sys.exit(1)
+
+from notion_api import NOTION_TOKEN, NotionError
+from notion_mirror import mirror, sync_user, MIRROR_DB
+from users import get_user_databases, configured_users
+
+# Как часто подтягивать изменения и как часто делать полную сверку (ловит удалённые страницы)
+MIRROR_SYNC_INTERVAL = int(os.getenv('MIRROR_SYNC_INTERVAL', '60'))  # Секунд
+MIRROR_FULL_SYNC_INTERVAL = int(os.getenv('MIRROR_FULL_SYNC_INTERVAL', str(6 * 3600)))  # Секунд
+
+# Инкрементальная и полная синхронизация не должны идти одновременно
+sync_lock = threading.Lock()
+
+
+def sync_all(full=False):
+    """Синхронизировать зеркало всех пользователей"""
+    started = time.monotonic()
+    for user in configured_users():
+        try:
+            with sync_lock:
+                result = sync_user(mirror, get_user_databases(user), full=full)
+        except NotionError as e:
+            print(f"❌ Ошибка синхронизации {user}: {e.message}")
+            continue
+        except Exception as e:
+            print(f"❌ Ошибка синхронизации {user}: {e}")
+            continue
+        for kind, (fetched, removed) in result.items():
+            if fetched or removed:
+                print(f"🔄 {user}/{kind}: получено {fetched}, удалено {removed}")
+    if full:
+        print(f"✅ Полная синхронизация за {time.monotonic() - started:.1f}с")
+
+
+def main():
+    """Запуск синхронизации"""
+    print("🚀 Запуск синхронизации зеркала Notion")
+    print(f"📁 База зеркала: {MIRROR_DB}")
+    print(f"👥 Пользователи: {', '.join(configured_users()) or 'нет'}")
+
+    if not NOTION_TOKEN:
+        print("\n❌ NOTION_TOKEN не установлен!")
+        sys.exit(1)
+
+    # Первый запуск — полная загрузка
+    sync_all(full=True)
+
+    if '--once' in sys.argv:
+        return
+
+    scheduler = BlockingScheduler()
+    scheduler.add_job(
+        sync_all,
+        IntervalTrigger(seconds=MIRROR_SYNC_INTERVAL),
+        id='incremental_sync',
+        name='Инкрементальная синхронизация',
+        max_instances=1,
+        coalesce=True
+    )
+    scheduler.add_job(
+        sync_all,
+        IntervalTrigger(seconds=MIRROR_FULL_SYNC_INTERVAL),
+        kwargs={'full': True},
+        id='full_sync',
+        name='Полная сверка',
+        max_instances=1,
+        coalesce=True
+    )
+
+    print(f"\n⏰ Изменения подтягиваются каждые {MIRROR_SYNC_INTERVAL}с, полная сверка каждые {MIRROR_FULL_SYNC_INTERVAL}с")
+    print("Нажмите Ctrl+C для остановки\n")
+
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        print("\n👋 Синхронизация остановлена")
+
+
+if __name__ == '__main__':
+    main()
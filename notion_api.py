@@ -0,0 +1,627 @@
+"""
+Клиент Notion API для сервера и фоновых воркеров
+
+Общий пул соединений, соблюдение лимитов, повторы при 429/5xx,
+кэш схем баз и определение полей баз привычек и энергии.
+"""
+
+import os
+import re
+import time
+import fcntl
+import random
+import struct
+import asyncio
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from collections import OrderedDict, deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import registry
+
+NOTION_TOKEN = os.getenv('NOTION_TOKEN')
+
+NOTION_API_VERSION = '2025-09-03'  # Версия с поддержкой multi-source databases
+NOTION_API_BASE = os.getenv('NOTION_API_BASE', 'https://api.notion.com/v1')
+
+# Пул соединений к Notion: по умолчанию размер пула = числу потоков gunicorn,
+# чтобы каждый поток воркера мог держать своё keep-alive соединение
+NOTION_POOL_MAXSIZE = int(os.getenv('NOTION_POOL_MAXSIZE', os.getenv('GUNICORN_THREADS', '4')))
+NOTION_POOL_CONNECTIONS = int(os.getenv('NOTION_POOL_CONNECTIONS', '1'))  # Число хостов в пуле
+NOTION_CONNECT_TIMEOUT = float(os.getenv('NOTION_CONNECT_TIMEOUT', '5'))
+NOTION_READ_TIMEOUT = float(os.getenv('NOTION_READ_TIMEOUT', '30'))
+
+# Лимиты Notion: ~3 запроса в секунду на интеграцию (общие для всех воркеров и процессов)
+NOTION_RATE_LIMIT = float(os.getenv('NOTION_RATE_LIMIT', '3'))  # Запросов в секунду на токен
+NOTION_RATE_BURST = float(os.getenv('NOTION_RATE_BURST', '3'))  # Запросов подряд без ожидания
+NOTION_MAX_RETRIES = int(os.getenv('NOTION_MAX_RETRIES', '3'))  # Повторы при 429/5xx
+# Очередь к Notion в воркере: сверх неё (или после долгого ожидания) запросы получают 503
+NOTION_QUEUE_MAX = int(os.getenv('NOTION_QUEUE_MAX', '64'))  # Ожидающих запросов
+NOTION_QUEUE_TIMEOUT = float(os.getenv('NOTION_QUEUE_TIMEOUT', '20'))  # Секунд ожидания
+
+# Кэш GET-ответов со схемами баз (databases/*, data_sources/{id}) — они почти не меняются
+NOTION_CACHE_TTL = float(os.getenv('NOTION_CACHE_TTL', '600'))  # Секунд
+NOTION_CACHE_MAXSIZE = int(os.getenv('NOTION_CACHE_MAXSIZE', '256'))  # Записей
+
+def create_notion_session():
+    """Создать общую сессию с пулом keep-alive соединений к Notion
+
+    requests.Session с HTTPAdapter переиспользует TCP/TLS соединения между
+    запросами; сам пул urllib3 потокобезопасен, поэтому одна сессия
+    разделяется всеми потоками воркера.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=NOTION_POOL_CONNECTIONS,
+        pool_maxsize=NOTION_POOL_MAXSIZE,
+        pool_block=False,  # При нехватке соединений создаём временное, а не ждём
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Authorization': f'Bearer {NOTION_TOKEN}',
+        'Notion-Version': NOTION_API_VERSION,
+        'Content-Type': 'application/json',
+    })
+    return session
+
+notion_session = create_notion_session()
+
+notion_upstream_seconds = registry.histogram(
+    'habbits_notion_request_seconds', 'Задержка запросов к Notion API', ('method', 'endpoint'))
+notion_upstream_responses = registry.counter(
+    'habbits_notion_responses_total', 'Ответы Notion API по коду (error — сетевая ошибка)', ('endpoint', 'status'))
+notion_queue_wait = registry.histogram(
+    'habbits_notion_queue_wait_seconds', 'Ожидание очереди и токена перед запросом к Notion')
+notion_queue_rejected = registry.counter(
+    'habbits_notion_queue_rejected_total', 'Запросы, отклонённые очередью (overflow, timeout)', ('reason',))
+notion_retries = registry.counter(
+    'habbits_notion_retries_total', 'Повторы запросов к Notion по коду ответа', ('status',))
+
+ENDPOINT_ID_RE = re.compile(r'^([a-z_]+)/[^/?]+')
+
+def endpoint_label(endpoint):
+    """Шаблон endpoint для меток метрик: data_sources/{id}/query вместо конкретного ID"""
+    return ENDPOINT_ID_RE.sub(r'\1/{id}', endpoint.split('?')[0].strip('/'))
+
+def observe_notion(method, endpoint, seconds, status):
+    """Записать запрос к Notion в метрики (и из синхронного клиента, и из asgi.py)"""
+    label = endpoint_label(endpoint)
+    notion_upstream_seconds.observe(seconds, method=method, endpoint=label)
+    notion_upstream_responses.inc(endpoint=label, status=status if status is not None else 'error')
+
+def notion_request(method, endpoint, body=None, stream=False):
+    """Выполнить запрос к Notion API через общий пул соединений
+
+    stream=True — тело не читается (для потоковой передачи), соединение
+    возвращается в пул после response.close().
+    """
+    url = f"{NOTION_API_BASE}/{endpoint}"
+    started = time.perf_counter()
+    status = None
+    try:
+        response = notion_session.request(
+            method,
+            url,
+            json=body,
+            timeout=(NOTION_CONNECT_TIMEOUT, NOTION_READ_TIMEOUT),
+            stream=stream,
+        )
+        status = response.status_code
+        return response
+    finally:
+        observe_notion(method, endpoint, time.perf_counter() - started, status)
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш с ограничением времени жизни записей"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.items[key]
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self.lock:
+            self.items[key] = (time.monotonic() + self.ttl, value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, prefix=''):
+        """Удалить записи, ключ которых начинается с prefix (пустой prefix — все)"""
+        with self.lock:
+            keys = [key for key in self.items if key.startswith(prefix)]
+            for key in keys:
+                del self.items[key]
+        return len(keys)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.items),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+notion_cache = TTLCache(NOTION_CACHE_MAXSIZE, NOTION_CACHE_TTL)
+
+CACHEABLE_ENDPOINT_RE = re.compile(r'^(databases|data_sources)/[^/]+/?$')
+
+def is_cacheable(method, endpoint):
+    """Кэшируем только GET схем баз данных и data sources (без query)"""
+    return method == 'GET' and bool(CACHEABLE_ENDPOINT_RE.match(endpoint))
+
+def cache_key(endpoint):
+    return endpoint.rstrip('/')
+
+class NotionError(Exception):
+    """Ошибка ответа Notion API"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class NotionBusy(NotionError):
+    """Очередь к Notion переполнена или ожидание слишком долгое — запрос отклонён"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(503, message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Ведро токенов одной интеграции, общее для всех процессов
+
+    Состояние (токены, время обновления, пауза по Retry-After) лежит в файле под flock,
+    поэтому воркеры gunicorn и фоновая синхронизация вместе не превышают лимит токена.
+    """
+
+    STATE = struct.Struct('ddd')  # tokens, updated_at, paused_until
+
+    def __init__(self, path, rate, burst):
+        self.path = Path(path)
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.fd = None
+        self.fd_lock = threading.Lock()
+
+    def locked_state(self, update):
+        """Прочитать состояние под flock, применить update(state, now) -> (state, result)"""
+        with self.fd_lock:
+            if self.fd is None:
+                self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                raw = os.pread(self.fd, self.STATE.size, 0)
+                state = self.STATE.unpack(raw) if len(raw) == self.STATE.size else (self.burst, now, 0.0)
+                state, result = update(state, now)
+                os.pwrite(self.fd, self.STATE.pack(*state), 0)
+                return result
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def take(self):
+        """Взять токен: 0, если получилось, иначе сколько секунд ждать"""
+        def update(state, now):
+            tokens, updated_at, paused_until = state
+            if now < paused_until:
+                return state, paused_until - now
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                return (tokens - 1, now, paused_until), 0.0
+            return (tokens, now, paused_until), (1 - tokens) / self.rate
+        if self.rate <= 0:
+            return 0.0
+        return self.locked_state(update)
+
+    def pause(self, seconds):
+        """Не выдавать токены seconds секунд (Notion ответил 429 с Retry-After)"""
+        def update(state, now):
+            tokens, updated_at, paused_until = state
+            return (0.0, now, max(paused_until, now + seconds)), None
+        if seconds > 0:
+            self.locked_state(update)
+
+    def peek(self):
+        def update(state, now):
+            tokens, updated_at, paused_until = state
+            return state, {
+                'tokens': round(min(self.burst, tokens + max(now - updated_at, 0) * self.rate), 2),
+                'paused_for': round(max(paused_until - now, 0), 2),
+            }
+        return self.locked_state(update)
+
+class Ticket:
+    __slots__ = ('user', 'enqueued_at', 'deadline')
+
+    def __init__(self, user, timeout):
+        self.user = user
+        self.enqueued_at = time.monotonic()
+        self.deadline = self.enqueued_at + timeout
+
+class NotionScheduler:
+    """Очередь запросов к Notion: по очереди на пользователя, пользователи обслуживаются по кругу
+
+    Запрос получает токен, только когда он первый в очереди своего пользователя и
+    очередь пользователя — следующая по кругу, поэтому всплеск одного устройства
+    не задерживает остальных. При переполнении очереди или слишком долгом ожидании
+    запрос отклоняется с NotionBusy (503).
+    """
+
+    def __init__(self, bucket, max_queue, max_wait):
+        self.bucket = bucket
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.cond = threading.Condition()
+        self.async_waiters = {}  # Ticket -> (event loop, asyncio.Event) корутин из acquire_async
+        self.queues = OrderedDict()  # user -> deque[Ticket]; порядок ключей — порядок обхода
+        self.depth = 0
+        self.granted = 0
+        self.shed = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.waits = deque(maxlen=1000)  # Последние времена ожидания, сек
+
+    def enqueue(self, user, retry=False):
+        """Встать в очередь (повтор — в начало очереди своего пользователя)"""
+        with self.cond:
+            if self.depth >= self.max_queue:
+                self.shed += 1
+                notion_queue_rejected.inc(reason='overflow')
+                # rate <= 0 — лимит выключен (как в TokenBucket.take), очередь разойдётся быстро
+                retry_after = max(1.0, self.depth / self.bucket.rate) if self.bucket.rate > 0 else 1.0
+                raise NotionBusy(f'Очередь к Notion переполнена ({self.depth} запросов)', retry_after)
+            ticket = Ticket(user, self.max_wait)
+            queue = self.queues.setdefault(user, deque())
+            if retry:
+                queue.appendleft(ticket)
+            else:
+                queue.append(ticket)
+            self.depth += 1
+            return ticket
+
+    def remove(self, ticket):
+        queue = self.queues.get(ticket.user)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self.depth -= 1
+            if not queue:
+                del self.queues[ticket.user]
+            self.notify()
+
+    def notify(self):
+        """Под self.cond: разбудить ожидающие потоки и корутину, чья очередь подошла"""
+        self.cond.notify_all()
+        if self.queues:
+            waiter = self.async_waiters.get(next(iter(self.queues.values()))[0])
+            if waiter:
+                loop, wakeup = waiter
+                loop.call_soon_threadsafe(wakeup.set)
+
+    def poll(self, ticket):
+        """Под self.cond: 0 — токен выдан, иначе сколько ждать (None — до уведомления)"""
+        queue = self.queues[ticket.user]
+        if next(iter(self.queues)) == ticket.user and queue[0] is ticket:
+            wait = self.bucket.take()
+            if wait == 0:
+                queue.popleft()
+                self.depth -= 1
+                # Пользователь уходит в конец круга
+                del self.queues[ticket.user]
+                if queue:
+                    self.queues[ticket.user] = queue
+                self.granted += 1
+                self.waits.append(time.monotonic() - ticket.enqueued_at)
+                notion_queue_wait.observe(self.waits[-1])
+                self.notify()
+                return 0.0
+        else:
+            wait = None
+        remaining = ticket.deadline - time.monotonic()
+        if remaining <= 0:
+            self.timeouts += 1
+            notion_queue_rejected.inc(reason='timeout')
+            self.remove(ticket)
+            raise NotionBusy(f'Запрос ждал очереди к Notion дольше {self.max_wait:.0f}с', self.max_wait)
+        return min(wait, remaining) if wait is not None else remaining
+
+    def acquire(self, user='system', retry=False):
+        """Дождаться своей очереди и токена"""
+        ticket = self.enqueue(user, retry)
+        with self.cond:
+            while True:
+                wait = self.poll(ticket)
+                if wait == 0:
+                    return
+                self.cond.wait(wait)
+
+    async def acquire_async(self, user='system', retry=False):
+        """То же для event loop (ASGI): ожидание без занятого потока
+
+        Очередь и ведро токенов (flock) трогаются в потоке пула, чтобы не блокировать loop.
+        Пока очередь запроса не подошла, корутина спит до notify() или своего таймаута.
+        """
+        loop = asyncio.get_running_loop()
+        ticket = await loop.run_in_executor(None, self.enqueue, user, retry)
+        wakeup = asyncio.Event()
+        self.async_waiters[ticket] = (loop, wakeup)
+        try:
+            while True:
+                wakeup.clear()
+                wait = await loop.run_in_executor(None, self.try_acquire, ticket)
+                if wait == 0:
+                    return
+                try:
+                    await asyncio.wait_for(wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            loop.run_in_executor(None, self.cancel, ticket)
+            raise
+        finally:
+            self.async_waiters.pop(ticket, None)
+
+    def try_acquire(self, ticket):
+        with self.cond:
+            return self.poll(ticket)
+
+    def cancel(self, ticket):
+        with self.cond:
+            self.remove(ticket)
+
+    def record_retry(self, status):
+        with self.cond:
+            self.retries += 1
+            notion_retries.inc(status=status if status is not None else 'error')
+            if status == 429:
+                self.rate_limited += 1
+
+    def stats(self):
+        with self.cond:
+            waits = sorted(self.waits)
+            stats = {
+                'rate': self.bucket.rate,
+                'burst': self.bucket.burst,
+                'queue_depth': self.depth,
+                'queue_max': self.max_queue,
+                'max_wait': self.max_wait,
+                'queues': {user: len(queue) for user, queue in self.queues.items()},
+                'granted': self.granted,
+                'shed': self.shed,
+                'timeouts': self.timeouts,
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+                'wait_ms': {
+                    'p50': round(waits[len(waits) // 2] * 1000, 1) if waits else None,
+                    'p95': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else None,
+                    'max': round(waits[-1] * 1000, 1) if waits else None,
+                },
+            }
+        stats.update(self.bucket.peek())
+        return stats
+
+def bucket_path():
+    """Файл ведра токенов: свой для каждого токена интеграции, общий для процессов"""
+    if os.getenv('NOTION_BUCKET_FILE'):
+        return Path(os.getenv('NOTION_BUCKET_FILE'))
+    directory = Path('/app/data') if os.path.exists('/app/data') else Path(tempfile.gettempdir())
+    token_hash = hashlib.sha256((NOTION_TOKEN or '').encode()).hexdigest()[:12]
+    return directory / f'notion_bucket_{token_hash}'
+
+notion_scheduler = NotionScheduler(
+    TokenBucket(bucket_path(), NOTION_RATE_LIMIT, NOTION_RATE_BURST),
+    NOTION_QUEUE_MAX,
+    NOTION_QUEUE_TIMEOUT,
+)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+def retry_delay(response, attempt):
+    """Пауза перед повтором: Retry-After от Notion или экспоненциальный backoff с jitter"""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return (0.5 * 2 ** attempt) * (0.5 + random.random())
+
+def notion_call(method, endpoint, body=None, user='system', stream=False):
+    """Запрос к Notion через общую очередь с повторами при 429/5xx и сетевых ошибках
+
+    429 ставит на паузу всё ведро токенов (лимит общий для интеграции),
+    5xx и сетевые ошибки ждут backoff только для своего запроса.
+    """
+    for attempt in range(NOTION_MAX_RETRIES + 1):
+        notion_scheduler.acquire(user, retry=attempt > 0)
+        try:
+            response = notion_request(method, endpoint, body, stream)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == NOTION_MAX_RETRIES:
+                raise
+            notion_scheduler.record_retry(None)
+            time.sleep(retry_delay(None, attempt))
+            continue
+        if response.status_code in RETRYABLE_STATUSES and attempt < NOTION_MAX_RETRIES:
+            delay = retry_delay(response, attempt)
+            print(f"⏳ Notion вернул {response.status_code} для {endpoint}, повтор через {delay:.1f}с")
+            notion_scheduler.record_retry(response.status_code)
+            response.close()
+            if response.status_code == 429:
+                notion_scheduler.bucket.pause(delay)
+            else:
+                time.sleep(delay)
+            continue
+        return response
+
+def notion_json(method, endpoint, body=None, user='system'):
+    """Запрос к Notion, возвращающий JSON или бросающий NotionError"""
+    cacheable = is_cacheable(method, endpoint)
+    if cacheable:
+        cached = notion_cache.get(cache_key(endpoint))
+        if cached is not None:
+            return cached
+    response = notion_call(method, endpoint, body, user)
+    data = response.json() if response.content else {}
+    if response.status_code >= 400:
+        raise NotionError(response.status_code, data.get('message') or f'Ошибка API: {response.status_code}')
+    if cacheable:
+        notion_cache.set(cache_key(endpoint), data)
+    return data
+
+def notion_pool_stats():
+    """Статистика пула: сколько соединений открыто заново, а сколько переиспользовано"""
+    stats = {
+        'pool_maxsize': NOTION_POOL_MAXSIZE,
+        'pool_connections': NOTION_POOL_CONNECTIONS,
+        'connect_timeout': NOTION_CONNECT_TIMEOUT,
+        'read_timeout': NOTION_READ_TIMEOUT,
+        'hosts': {},
+    }
+    for adapter in set(notion_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats['hosts'][f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                'requests': pool.num_requests,
+                'new_connections': pool.num_connections,
+                'reused_connections': max(pool.num_requests - pool.num_connections, 0),
+                'idle_connections': sum(1 for conn in list(pool.pool.queue) if conn) if pool.pool else 0,
+            }
+    return stats
+
+# Кэш схем баз энергии (как в notion-api.js); ответы databases/* кэшируются в notion_cache
+energy_schemas = {}
+schema_lock = threading.Lock()
+
+def resolve_data_source_id(database_id):
+    """Получить data_source_id для базы данных (первый data source)"""
+    database = notion_json('GET', f'databases/{database_id}')
+    sources = database.get('data_sources') or []
+    if not sources:
+        raise NotionError(500, 'База данных не содержит data sources')
+    return sources[0]['id']
+
+def detect_energy_fields(properties):
+    """Определить поля вопроса/даты/ответа по типу и названию (логика getEnergyDatabaseSchema)"""
+    hints = {
+        'questionField': ('title', ('вопрос', 'question', 'name')),
+        'dateField': ('date', ('дата', 'date')),
+        'answerField': ('select', ('ответ', 'answer')),
+    }
+    schema = {}
+    for key, (field_type, names) in hints.items():
+        candidates = [name for name, info in properties.items() if info.get('type') == field_type]
+        by_name = [name for name in candidates if any(hint in name.lower() for hint in names)]
+        schema[key] = (by_name or candidates or [None])[0]
+    return schema
+
+def resolve_energy_schema(user_config):
+    """Получить data_source_id и названия полей базы энергии пользователя"""
+    database_id = user_config['ENERGY_DATABASE_ID']
+    if not database_id:
+        raise NotionError(400, 'ENERGY_DATABASE_ID не настроен')
+    with schema_lock:
+        if database_id in energy_schemas:
+            return energy_schemas[database_id]
+
+    data_source_id = user_config['ENERGY_DATA_SOURCE_ID'] or resolve_data_source_id(database_id)
+    try:
+        properties = notion_json('GET', f'data_sources/{data_source_id}').get('properties') or {}
+    except NotionError as e:
+        # Fallback: берём properties первой страницы
+        print(f"⚠️ Не удалось получить data_source напрямую, пробуем через query: {e.message}")
+        results = notion_json('POST', f'data_sources/{data_source_id}/query', {'page_size': 1}).get('results') or []
+        properties = results[0].get('properties', {}) if results else {}
+
+    schema = detect_energy_fields(properties)
+    if not all(schema.values()):
+        raise NotionError(500, f"Не удалось определить поля базы энергии. Доступные поля: {', '.join(properties) or 'нет полей'}")
+    schema['dataSourceId'] = data_source_id
+    with schema_lock:
+        energy_schemas[database_id] = schema
+    return schema
+
+def invalidate_notion_cache(prefix=''):
+    """Сбросить кэш схем (и выведенные из них data_source_id/поля энергии)"""
+    removed = notion_cache.invalidate(prefix)
+    with schema_lock:
+        energy_schemas.clear()
+    return removed
+
+def query_all(data_source_id, body, user='system'):
+    """Получить все страницы запроса, проходя по start_cursor до конца"""
+    results = []
+    body = {**body, 'page_size': 100}
+    while True:
+        data = notion_json('POST', f'data_sources/{data_source_id}/query', body, user)
+        results.extend(data.get('results') or [])
+        if not data.get('has_more') or not data.get('next_cursor'):
+            return results
+        body['start_cursor'] = data['next_cursor']
+
+# Маппинг уровней энергии на числа (как ENERGY_MAPPING в stat.js)
+ENERGY_MAPPING = {
+    'выжат апатия': 1,
+    'тяжело': 2,
+    'норм': 3,
+    'хорошо': 4,
+    'очень хорошо': 5
+}
+
+def parse_habit_page(page):
+    """Достать из страницы привычки название, дату и отметку о выполнении"""
+    properties = page.get('properties', {})
+    title = properties.get('Habit', {}).get('title') or []
+    return {
+        'id': page.get('id'),
+        'habit': title[0].get('plain_text') if title else None,
+        'date': ((properties.get('Date', {}).get('date') or {}).get('start') or '')[:10] or None,
+        'completed': bool(properties.get('Completed', {}).get('checkbox')),
+        'created_time': page.get('created_time'),
+        'last_edited_time': page.get('last_edited_time'),
+    }
+
+def parse_energy_page(page, schema):
+    """Достать из страницы энергии дату, ответ и числовую оценку"""
+    properties = page.get('properties', {})
+    answer = (properties.get(schema['answerField'], {}).get('select') or {}).get('name')
+    return {
+        'id': page.get('id'),
+        'date': ((properties.get(schema['dateField'], {}).get('date') or {}).get('start') or '')[:10] or None,
+        'answer': answer,
+        'score': ENERGY_MAPPING.get((answer or '').lower()),
+        'last_edited_time': page.get('last_edited_time'),
+    }
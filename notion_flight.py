@@ -0,0 +1,320 @@
+"""
+Объединение одинаковых одновременных чтений из Notion (single-flight)
+
+Открытие приложения и статистики сразу, несколько устройств или волна перезагрузок
+после напоминания в 23:00 присылают в прокси одинаковые GET databases/{id} и
+одинаковые запросы data_sources/{id}/query. Такие запросы получают ключ по методу,
+endpoint и канонизированному телу: первый идёт в Notion, остальные ждут его ответ.
+
+Внутри воркера ожидающие потоки ждут threading.Event. Между воркерами gunicorn
+ведущий держит flock на файле ключа; воркер, который застал блокировку занятой,
+отмечается в файле .wanted, дожидается её и берёт ответ из файла .result.
+Ведущий по-прежнему передаёт ответ своему клиенту потоком и копирует тело только
+если его кто-то ждёт; файл ответа пишется только для ожидающих воркеров.
+"""
+
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+
+from metrics import registry
+from notion_api import endpoint_label, NOTION_QUEUE_TIMEOUT, NOTION_READ_TIMEOUT
+
+NOTION_COALESCE = os.getenv('NOTION_COALESCE', '1') == '1'
+# Сколько ждать чужой запрос, прежде чем идти в Notion самому
+NOTION_FLIGHT_WAIT = float(os.getenv('NOTION_FLIGHT_WAIT', str(NOTION_QUEUE_TIMEOUT + NOTION_READ_TIMEOUT)))
+NOTION_FLIGHT_KEEP = float(os.getenv('NOTION_FLIGHT_KEEP', '60'))  # Секунд хранить файлы ответов и отметок
+
+# Кроме GET объединяем только чтения, отправляемые POST
+COALESCABLE_POST_RE = re.compile(r'^((databases|data_sources)/[^/]+/query|search)/?$')
+
+
+def is_coalescable(method, endpoint):
+    return method == 'GET' or (method == 'POST' and bool(COALESCABLE_POST_RE.match(endpoint)))
+
+
+def flight_key(method, endpoint, body):
+    """Ключ запроса: метод, endpoint и тело с отсортированными ключами без пробелов"""
+    canonical = json.dumps(body, sort_keys=True, separators=(',', ':'), ensure_ascii=False) if body else ''
+    return hashlib.sha256(f"{method} {endpoint.strip('/')}\n{canonical}".encode()).hexdigest()
+
+
+def flight_dir():
+    if os.getenv('NOTION_FLIGHT_DIR'):
+        return Path(os.getenv('NOTION_FLIGHT_DIR'))
+    directory = Path('/app/data') if os.path.exists('/app/data') else Path(tempfile.gettempdir())
+    return directory / 'notion_flights'
+
+
+class FlightResult:
+    """Ответ Notion целиком: код, тип, кодировка (gzip от Notion сохраняется) и байты тела"""
+
+    def __init__(self, status, content_type, encoding, body):
+        self.status = status
+        self.content_type = content_type
+        self.encoding = encoding
+        self.body = body
+
+    def dump(self, finished_at):
+        header = {'status': self.status, 'content_type': self.content_type,
+                  'encoding': self.encoding, 'finished_at': finished_at}
+        return json.dumps(header).encode() + b'\n' + self.body
+
+    @classmethod
+    def load(cls, raw):
+        header, _, body = raw.partition(b'\n')
+        header = json.loads(header)
+        return cls(header['status'], header['content_type'], header['encoding'], body), header['finished_at']
+
+
+class Flight:
+    """Один запрос к Notion и ожидающие его потоки этого воркера
+
+    Ведущий поток получает Flight без result и сам идёт в Notion, остальные ждут done.
+    Ответ копируется для других только если к моменту ответа Notion его кто-то ждёт:
+    ожидающие потоки этого воркера (followers) или другие воркеры (файл .wanted).
+    """
+
+    def __init__(self, group, key, endpoint):
+        self.group = group
+        self.key = key
+        self.endpoint = endpoint
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.source = 'upstream'
+        self.followers = 0
+        self.fd = None  # flock ключа, пока ведущий выполняет запрос
+        self.locked_at = 0.0
+        self.open = True  # Новые потоки ещё могут присоединиться
+
+    def close_window(self):
+        """Больше не принимать ожидающих потоков; вернуть, есть ли они"""
+        with self.group.lock:
+            if self.open:
+                self.open = False
+                if self.group.flights.get(self.key) is self:
+                    del self.group.flights[self.key]
+            return self.followers > 0
+
+    def share(self):
+        """Ответ Notion пришёл: нужно ли копировать тело для ожидающих (иначе отпустить блокировку)"""
+        wanted = self.close_window() or (self.fd is not None and self.group.wanted(self.key, self.locked_at))
+        if not wanted:
+            self.release()
+        return wanted
+
+    def finish(self, result):
+        """Ответ целиком (None — передача оборвалась): отдать ожидающим и другим воркерам"""
+        if self.done.is_set():
+            return
+        self.close_window()
+        self.result = result
+        if (result is not None and self.source == 'upstream' and self.fd is not None
+                and self.group.wanted(self.key, self.locked_at)):
+            self.group.write_result(self.key, result)
+        self.release()
+
+    def fail(self, error):
+        if self.done.is_set():
+            return
+        self.close_window()
+        self.error = error
+        self.release()
+
+    def abort(self):
+        """Ведущий не дочитал ответ: ожидающие пойдут в Notion сами"""
+        self.finish(None)
+
+    def release(self):
+        if self.fd is not None:
+            os.close(self.fd)  # Закрытие снимает flock
+            self.fd = None
+            self.group.prune()
+        self.done.set()
+
+
+flight_requests = registry.counter('habbits_notion_flight_requests_total',
+                                   'Чтения из Notion через прокси по источнику ответа: upstream — свой запрос, '
+                                   'thread/worker — ответ другого потока/воркера (сэкономленный запрос)',
+                                   ('endpoint', 'source'))
+
+
+class SingleFlight:
+    """Одинаковые одновременные запросы выполняются один раз на все потоки и воркеры"""
+
+    def __init__(self, directory, wait, keep):
+        self.directory = Path(directory)
+        self.wait = wait
+        self.keep = keep
+        self.flights = {}  # ключ -> Flight ведущего потока этого воркера
+        self.lock = threading.Lock()
+        self.counts = {'upstream': 0, 'thread': 0, 'worker': 0}
+        self.pruned_at = 0.0
+
+    def join(self, key, endpoint):
+        """Flight с готовым result (ответ другого потока/воркера) или без него — тогда запрос за вызывающим
+
+        Ведущий обязан завершить Flight: finish(), fail(), abort() или share() == False.
+        """
+        while True:
+            with self.lock:
+                flight = self.flights.get(key)
+                if flight is None:
+                    flight = self.flights[key] = Flight(self, key, endpoint)
+                    break
+                flight.followers += 1
+            if not flight.done.wait(self.wait):
+                # Ведущий завис дольше, чем ждал бы сам запрос — идём в Notion сами, без объединения
+                return self.solo(key, endpoint)
+            if flight.error is not None:
+                self.count(endpoint, 'thread')
+                raise flight.error
+            if flight.result is not None:
+                self.count(endpoint, 'thread')
+                shared = Flight(self, key, endpoint)
+                shared.result, shared.source = flight.result, 'thread'
+                shared.done.set()
+                return shared
+            # Ведущий не дочитал ответ — пробуем стать ведущим сами
+
+        self.lock_key(flight)
+        if flight.result is None:
+            self.count(endpoint, 'upstream')
+        return flight
+
+    def solo(self, key, endpoint):
+        self.count(endpoint, 'upstream')
+        flight = Flight(self, key, endpoint)
+        flight.open = False
+        return flight
+
+    def lock_key(self, flight):
+        """flock ключа между воркерами: если его держал другой воркер — взять его ответ из файла"""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.directory / f'{flight.key}.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError as e:
+            print(f"⚠️ Объединение запросов между воркерами недоступно: {e}")
+            return
+        arrived = time.time()
+        acquired = self.acquire(fd, flight.key)
+        if acquired is None:
+            os.close(fd)
+            return
+        flight.fd, flight.locked_at = fd, time.time()
+        if acquired == 'waited':
+            # Ждали чужой запрос: его ответ, записанный после нашего прихода, подходит и нам
+            shared = self.read_result(flight.key, arrived)
+            if shared is not None:
+                self.count(flight.endpoint, 'worker')
+                flight.source = 'worker'
+                flight.finish(shared)
+
+    def acquire(self, fd, key):
+        """flock с ограничением ожидания: 'free', 'waited' (был занят другим воркером) или None"""
+        deadline = time.monotonic() + self.wait
+        delay = 0.005
+        waited = False
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return 'waited' if waited else 'free'
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return None
+                # Отмечаемся, пока ждём: ведущий сохранит ответ в файл только для ожидающих
+                self.mark_wanted(key)
+                waited = True
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+
+    def mark_wanted(self, key):
+        try:
+            (self.directory / f'{key}.wanted').touch()
+        except OSError:
+            pass
+
+    def wanted(self, key, since):
+        """Ждёт ли ответа другой воркер (отмечался после захвата блокировки ведущим)"""
+        try:
+            return (self.directory / f'{key}.wanted').stat().st_mtime >= since
+        except OSError:
+            return False
+
+    def read_result(self, key, not_before):
+        try:
+            result, finished_at = FlightResult.load((self.directory / f'{key}.result').read_bytes())
+        except (OSError, ValueError, KeyError):
+            return None
+        return result if finished_at >= not_before else None
+
+    def write_result(self, key, result):
+        path = self.directory / f'{key}.result'
+        tmp = path.with_name(f'{key}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            tmp.write_bytes(result.dump(time.time()))
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить ответ для других воркеров: {e}")
+
+    def prune(self):
+        """Удалить старые файлы ответов и свободные блокировки (не чаще раза в keep секунд)"""
+        now = time.time()
+        with self.lock:
+            if now - self.pruned_at < self.keep:
+                return
+            self.pruned_at = now
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if now - entry.stat().st_mtime <= self.keep:
+                    continue
+                if not entry.name.endswith('.lock'):
+                    os.unlink(entry.path)
+                    continue
+                # Файл блокировки удаляем, только если его сейчас никто не держит
+                fd = os.open(entry.path, os.O_RDWR)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.unlink(entry.path)
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass
+
+    def count(self, endpoint, source):
+        flight_requests.inc(endpoint=endpoint_label(endpoint), source=source)
+        with self.lock:
+            self.counts[source] += 1
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+            in_flight = len(self.flights)
+            waiting = sum(flight.followers for flight in self.flights.values())
+        total = sum(counts.values())
+        saved = counts['thread'] + counts['worker']
+        return {
+            'enabled': NOTION_COALESCE,
+            'requests': total,
+            'upstream': counts['upstream'],
+            'shared_thread': counts['thread'],
+            'shared_worker': counts['worker'],
+            'saved': saved,
+            'dedup_ratio': round(saved / total, 3) if total else None,
+            'in_flight': in_flight,
+            'followers': waiting,
+        }
+
+
+notion_flights = SingleFlight(flight_dir(), NOTION_FLIGHT_WAIT, NOTION_FLIGHT_KEEP)
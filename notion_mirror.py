@@ -0,0 +1,328 @@
+"""
+Локальное зеркало баз привычек и энергии в SQLite
+
+Фоновый воркер (notion-sync.py) подтягивает из Notion изменённые страницы
+по last_edited_time, а сервер читает статистику и списки привычек отсюда,
+пока зеркало свежее. Каждая запись и удаление попадает в журнал changes, по
+которому аналитика (habit_analytics.py) обновляется инкрементально.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+from notion_api import (
+    resolve_data_source_id, resolve_energy_schema, query_all,
+    parse_habit_page, parse_energy_page,
+)
+
+# Путь к базе зеркала (используем /app/data в Docker)
+if os.getenv('MIRROR_DB'):
+    MIRROR_DB = Path(os.getenv('MIRROR_DB'))
+elif os.path.exists('/app/data'):
+    MIRROR_DB = Path('/app/data/notion_mirror.db')
+elif os.path.exists('/opt/habbits'):
+    MIRROR_DB = Path('/opt/habbits/data/notion_mirror.db')
+else:
+    MIRROR_DB = Path('data/notion_mirror.db')
+
+# Если зеркало не синхронизировалось дольше этого времени, сервер читает из Notion
+MIRROR_MAX_STALENESS = float(os.getenv('MIRROR_MAX_STALENESS', '900'))  # Секунд
+
+# Сколько последних изменений хранить в журнале (отставшие читатели перечитывают всё)
+MIRROR_CHANGES_KEEP = int(os.getenv('MIRROR_CHANGES_KEEP', '100000'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS habits (
+    page_id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    date TEXT,
+    habit TEXT,
+    completed INTEGER NOT NULL DEFAULT 0,
+    last_edited_time TEXT,
+    created_time TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_habits_user_date_habit ON habits (user, date, habit);
+
+CREATE TABLE IF NOT EXISTS energy (
+    page_id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    date TEXT,
+    answer TEXT,
+    score INTEGER,
+    last_edited_time TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_energy_user_date ON energy (user, date);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    user TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    cursor TEXT,
+    synced_at REAL,
+    full_synced_at REAL,
+    PRIMARY KEY (user, kind)
+);
+
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    page_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_changes_user ON changes (user, seq);
+"""
+
+
+class NotionMirror:
+    """Хранилище зеркала: по соединению SQLite на поток, WAL для чтения во время записи"""
+
+    def __init__(self, path=MIRROR_DB):
+        self.path = Path(path)
+        self.local = threading.local()
+        self.init_lock = threading.Lock()
+        self.initialized = False
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with self.init_lock:
+                if not self.initialized:
+                    conn.executescript(SCHEMA)
+                    columns = {row['name'] for row in conn.execute('PRAGMA table_info(habits)')}
+                    if 'created_time' not in columns:
+                        # Зеркало старой версии: время создания заполнится при следующей синхронизации страниц
+                        conn.execute('ALTER TABLE habits ADD COLUMN created_time TEXT')
+                    self.initialized = True
+            self.local.conn = conn
+        return conn
+
+    # ---------- Запись ----------
+
+    def upsert_habits(self, user, records):
+        """Добавить или обновить записи о привычках (ключ — page_id)"""
+        rows = [(r['id'], user, r['date'], r['habit'], int(r['completed']), r['last_edited_time'], r.get('created_time'))
+                for r in records if r.get('id')]
+        with self.connection() as conn:
+            conn.executemany("""
+                INSERT INTO habits (page_id, user, date, habit, completed, last_edited_time, created_time)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (page_id) DO UPDATE SET
+                    date = excluded.date, habit = excluded.habit,
+                    completed = excluded.completed, last_edited_time = excluded.last_edited_time,
+                    created_time = COALESCE(excluded.created_time, habits.created_time)
+            """, rows)
+            self.log_changes(conn, user, 'habits', [row[0] for row in rows])
+        return len(rows)
+
+    def upsert_energy(self, user, records):
+        """Добавить или обновить записи об энергии (ключ — page_id)"""
+        rows = [(r['id'], user, r['date'], r['answer'], r['score'], r['last_edited_time'])
+                for r in records if r.get('id')]
+        with self.connection() as conn:
+            conn.executemany("""
+                INSERT INTO energy (page_id, user, date, answer, score, last_edited_time)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (page_id) DO UPDATE SET
+                    date = excluded.date, answer = excluded.answer,
+                    score = excluded.score, last_edited_time = excluded.last_edited_time
+            """, rows)
+            self.log_changes(conn, user, 'energy', [row[0] for row in rows])
+        return len(rows)
+
+    def delete_missing(self, user, kind, page_ids):
+        """Удалить записи пользователя, которых больше нет в Notion (после полной синхронизации)"""
+        table = 'habits' if kind == 'habits' else 'energy'
+        with self.connection() as conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS seen (page_id TEXT PRIMARY KEY)')
+            conn.execute('DELETE FROM seen')
+            conn.executemany('INSERT OR IGNORE INTO seen VALUES (?)', [(pid,) for pid in page_ids])
+            conn.execute(f"""
+                INSERT INTO changes (user, kind, page_id)
+                SELECT user, ?, page_id FROM {table} WHERE user = ? AND page_id NOT IN (SELECT page_id FROM seen)
+            """, (kind, user))
+            removed = conn.execute(
+                f'DELETE FROM {table} WHERE user = ? AND page_id NOT IN (SELECT page_id FROM seen)',
+                (user,)).rowcount
+            conn.execute('DELETE FROM seen')
+        return removed
+
+    def log_changes(self, conn, user, kind, page_ids):
+        """Записать изменённые страницы в журнал и обрезать его до MIRROR_CHANGES_KEEP"""
+        if not page_ids:
+            return
+        conn.executemany('INSERT INTO changes (user, kind, page_id) VALUES (?, ?, ?)',
+                         [(user, kind, page_id) for page_id in page_ids])
+        conn.execute('DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?', (MIRROR_CHANGES_KEEP,))
+
+    def get_state(self, user, kind):
+        row = self.connection().execute(
+            'SELECT cursor, synced_at, full_synced_at FROM sync_state WHERE user = ? AND kind = ?',
+            (user, kind)).fetchone()
+        return dict(row) if row else {'cursor': None, 'synced_at': None, 'full_synced_at': None}
+
+    def set_state(self, user, kind, cursor, full=False):
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute("""
+                INSERT INTO sync_state (user, kind, cursor, synced_at, full_synced_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user, kind) DO UPDATE SET
+                    cursor = excluded.cursor, synced_at = excluded.synced_at,
+                    full_synced_at = COALESCE(excluded.full_synced_at, sync_state.full_synced_at)
+            """, (user, kind, cursor, now, now if full else None))
+
+    # ---------- Чтение ----------
+
+    def is_fresh(self, user, kind='habits'):
+        """Синхронизировалось ли зеркало пользователя недавно"""
+        try:
+            synced_at = self.get_state(user, kind)['synced_at']
+        except sqlite3.Error:
+            return False
+        return synced_at is not None and time.time() - synced_at <= MIRROR_MAX_STALENESS
+
+    def habit_counts(self, user, start, end):
+        """Число выполненных привычек за период {название: количество}"""
+        rows = self.connection().execute("""
+            SELECT habit, COUNT(*) AS count FROM habits
+            WHERE user = ? AND date BETWEEN ? AND ? AND completed = 1 AND habit IS NOT NULL
+            GROUP BY habit
+        """, (user, start.isoformat(), end.isoformat())).fetchall()
+        return {row['habit']: row['count'] for row in rows}
+
+    def energy_scores(self, user, start, end):
+        """Оценки энергии за период {дата: оценка}"""
+        rows = self.connection().execute("""
+            SELECT date, score FROM energy
+            WHERE user = ? AND date BETWEEN ? AND ? AND score IS NOT NULL
+            ORDER BY date, last_edited_time
+        """, (user, start.isoformat(), end.isoformat())).fetchall()
+        return {row['date']: row['score'] for row in rows}
+
+    def habits_on(self, user, day):
+        """Записи о привычках за день (одноимённые — в порядке создания, как CREATED_ASCENDING в Notion)"""
+        rows = self.connection().execute("""
+            SELECT page_id AS id, habit, date, completed FROM habits
+            WHERE user = ? AND date = ? ORDER BY habit, created_time, page_id
+        """, (user, day.isoformat())).fetchall()
+        return [{**dict(row), 'completed': bool(row['completed'])} for row in rows]
+
+    def habit_pages_on(self, user, day):
+        """[(привычка, page_id), ...] за день в порядке создания; None, если у части записей нет created_time"""
+        rows = self.connection().execute("""
+            SELECT habit, page_id, created_time FROM habits
+            WHERE user = ? AND date = ? ORDER BY created_time, page_id
+        """, (user, day.isoformat())).fetchall()
+        if any(row['created_time'] is None for row in rows):
+            return None
+        return [(row['habit'] or '', row['page_id']) for row in rows]
+
+    def habit_rows(self, user, start, end):
+        """Записи о привычках за период: [(id, habit, date, completed), ...]"""
+        rows = self.connection().execute("""
+            SELECT page_id, habit, date, completed FROM habits
+            WHERE user = ? AND date BETWEEN ? AND ? ORDER BY date, habit
+        """, (user, start.isoformat(), end.isoformat())).fetchall()
+        return [(row[0], row[1], row[2], bool(row[3])) for row in rows]
+
+    def energy_rows(self, user, start, end):
+        """Ответы об энергии за период: [(id, date, answer), ...]"""
+        rows = self.connection().execute("""
+            SELECT page_id, date, answer FROM energy
+            WHERE user = ? AND date BETWEEN ? AND ? ORDER BY date, last_edited_time
+        """, (user, start.isoformat(), end.isoformat())).fetchall()
+        return [tuple(row) for row in rows]
+
+    # ---------- Журнал изменений ----------
+
+    def change_bounds(self):
+        """(первый, последний) номер в журнале изменений; (0, 0) — журнал пуст"""
+        first, last = self.connection().execute(
+            'SELECT (SELECT MIN(seq) FROM changes), (SELECT MAX(seq) FROM changes)').fetchone()
+        return first or 0, last or 0
+
+    def last_change(self, user):
+        """Последний номер в журнале изменений пользователя; None — зеркало недоступно"""
+        try:
+            return self.connection().execute(
+                'SELECT COALESCE(MAX(seq), 0) FROM changes WHERE user = ?', (user,)).fetchone()[0]
+        except sqlite3.Error:
+            return None
+
+    def all_habits(self, user):
+        """Все записи о привычках пользователя: [(page_id, date, habit, completed), ...]"""
+        return [tuple(row) for row in self.connection().execute(
+            'SELECT page_id, date, habit, completed FROM habits WHERE user = ?', (user,))]
+
+    def all_energy(self, user):
+        """Все оценки энергии пользователя: [(page_id, date, score), ...]"""
+        return [tuple(row) for row in self.connection().execute(
+            'SELECT page_id, date, score FROM energy WHERE user = ?', (user,))]
+
+    def changed_habits(self, user, after):
+        """Текущее состояние страниц привычек, изменённых после номера after (удалённые — с date = None)"""
+        return [tuple(row) for row in self.connection().execute("""
+            SELECT c.page_id, h.date, h.habit, h.completed
+            FROM (SELECT DISTINCT page_id FROM changes WHERE seq > ? AND user = ? AND kind = 'habits') c
+            LEFT JOIN habits h ON h.page_id = c.page_id
+        """, (after, user))]
+
+    def changed_energy(self, user, after):
+        """Текущее состояние страниц энергии, изменённых после номера after (удалённые — с date = None)"""
+        return [tuple(row) for row in self.connection().execute("""
+            SELECT c.page_id, e.date, e.score
+            FROM (SELECT DISTINCT page_id FROM changes WHERE seq > ? AND user = ? AND kind = 'energy') c
+            LEFT JOIN energy e ON e.page_id = c.page_id
+        """, (after, user))]
+
+    def habit_names(self, user):
+        """Все названия привычек пользователя за всю историю"""
+        rows = self.connection().execute("""
+            SELECT DISTINCT habit FROM habits WHERE user = ? AND habit IS NOT NULL ORDER BY habit
+        """, (user,)).fetchall()
+        return [row['habit'] for row in rows]
+
+
+mirror = NotionMirror()
+
+
+def sync_kind(store, user, kind, data_source_id, parse, full=False):
+    """Синхронизировать одну базу пользователя; инкрементально — по last_edited_time"""
+    state = store.get_state(user, kind)
+    body = {'sorts': [{'timestamp': 'last_edited_time', 'direction': 'ascending'}]}
+    if state['cursor'] and not full:
+        # on_or_after: Notion округляет last_edited_time до минуты, повторно полученные страницы просто перезапишутся
+        body['filter'] = {'timestamp': 'last_edited_time', 'last_edited_time': {'on_or_after': state['cursor']}}
+
+    records = [parse(page) for page in query_all(data_source_id, body)]
+    if kind == 'habits':
+        store.upsert_habits(user, records)
+    else:
+        store.upsert_energy(user, records)
+
+    removed = 0
+    if full:
+        removed = store.delete_missing(user, kind, [r['id'] for r in records])
+    edited = [r['last_edited_time'] for r in records if r.get('last_edited_time')]
+    store.set_state(user, kind, max(edited + [state['cursor'] or '']) or None, full=full)
+    return len(records), removed
+
+
+def sync_user(store, user_config, full=False):
+    """Синхронизировать базы привычек и энергии пользователя"""
+    user = user_config['USER']
+    result = {}
+    data_source_id = resolve_data_source_id(user_config['DATABASE_ID'])
+    result['habits'] = sync_kind(store, user, 'habits', data_source_id, parse_habit_page, full)
+    if user_config['ENERGY_DATABASE_ID']:
+        schema = resolve_energy_schema(user_config)
+        result['energy'] = sync_kind(store, user, 'energy', schema['dataSourceId'],
+                                     lambda page: parse_energy_page(page, schema), full)
+    return result
@@ -0,0 +1,206 @@
+"""
+Индекс страниц Notion по (пользователь, тип, дата, привычка, номер)
+
+Повторная отправка дня обновляет уже созданные страницы одним PATCH, без поиска
+через query и без дубликатов. Индекс заполняется лениво: при первой записи за день
+страницы этого дня подтягиваются одним запросом (или из свежего зеркала), дальше —
+из результатов создания страниц. Номер (ordinal) различает несколько записей одной
+привычки за день (каунтеры Deep work / Learning sessions).
+
+Здесь же хранятся ответы на запросы с заголовком Idempotency-Key и отметки «пользователь
+уже записал день» (logged_days): сервер ставит их при записи, а планировщик напоминаний
+не отправляет push тем, кто уже отметился.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+# Путь к базе индекса (используем /app/data в Docker)
+if os.getenv('PAGE_INDEX_DB'):
+    PAGE_INDEX_DB = Path(os.getenv('PAGE_INDEX_DB'))
+elif os.path.exists('/app/data'):
+    PAGE_INDEX_DB = Path('/app/data/page_index.db')
+elif os.path.exists('/opt/habbits'):
+    PAGE_INDEX_DB = Path('/opt/habbits/data/page_index.db')
+else:
+    PAGE_INDEX_DB = Path('data/page_index.db')
+
+# Сколько хранить ответы по Idempotency-Key и сколько ждать завершения первого запроса
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', str(24 * 3600)))  # Секунд
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', '120'))  # Секунд
+
+# Сколько дней хранить отметки logged_days
+LOGGED_DAYS_KEEP = int(os.getenv('LOGGED_DAYS_KEEP', '7'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    user TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    date TEXT NOT NULL,
+    name TEXT NOT NULL,
+    ordinal INTEGER NOT NULL,
+    page_id TEXT NOT NULL,
+    PRIMARY KEY (user, kind, date, name, ordinal)
+);
+
+CREATE TABLE IF NOT EXISTS warmed_days (
+    user TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    date TEXT NOT NULL,
+    warmed_at REAL NOT NULL,
+    PRIMARY KEY (user, kind, date)
+);
+
+CREATE TABLE IF NOT EXISTS idempotency (
+    key TEXT PRIMARY KEY,
+    status INTEGER,
+    response TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency (created_at);
+
+CREATE TABLE IF NOT EXISTS logged_days (
+    user TEXT NOT NULL,
+    date TEXT NOT NULL,
+    logged INTEGER NOT NULL,
+    checked_at REAL NOT NULL,
+    PRIMARY KEY (user, date)
+);
+"""
+
+# Результаты claim()
+CLAIMED = 'claimed'
+PENDING = 'pending'
+
+
+class PageIndex:
+    """Индекс страниц и ответов по Idempotency-Key; по соединению SQLite на поток"""
+
+    def __init__(self, path=PAGE_INDEX_DB):
+        self.path = Path(path)
+        self.local = threading.local()
+        self.init_lock = threading.Lock()
+        self.initialized = False
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with self.init_lock:
+                if not self.initialized:
+                    conn.executescript(SCHEMA)
+                    self.initialized = True
+            self.local.conn = conn
+        return conn
+
+    # ---------- Страницы ----------
+
+    def is_warm(self, user, kind, date):
+        """Загружены ли уже страницы этого дня"""
+        return self.connection().execute(
+            'SELECT 1 FROM warmed_days WHERE user = ? AND kind = ? AND date = ?',
+            (user, kind, date)).fetchone() is not None
+
+    def warm(self, user, kind, date, pages):
+        """Заменить страницы дня найденными в Notion: pages — [(name, page_id), ...] в порядке создания"""
+        ordinals = {}
+        rows = []
+        for name, page_id in pages:
+            ordinal = ordinals.get(name, 0)
+            ordinals[name] = ordinal + 1
+            rows.append((user, kind, date, name, ordinal, page_id))
+        with self.connection() as conn:
+            conn.execute('DELETE FROM pages WHERE user = ? AND kind = ? AND date = ?', (user, kind, date))
+            conn.executemany('INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?)', rows)
+            conn.execute('INSERT OR REPLACE INTO warmed_days VALUES (?, ?, ?, ?)', (user, kind, date, time.time()))
+
+    def pages_for(self, user, kind, date):
+        """Страницы дня {(name, ordinal): page_id}"""
+        rows = self.connection().execute(
+            'SELECT name, ordinal, page_id FROM pages WHERE user = ? AND kind = ? AND date = ?',
+            (user, kind, date)).fetchall()
+        return {(name, ordinal): page_id for name, ordinal, page_id in rows}
+
+    def set_pages(self, user, kind, date, entries):
+        """Запомнить страницы: entries — [(name, ordinal, page_id), ...]"""
+        with self.connection() as conn:
+            conn.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                             [(user, kind, date, name, ordinal, page_id) for name, ordinal, page_id in entries])
+
+    def forget_day(self, user, kind, date):
+        """Сбросить день (следующая запись заново загрузит его из Notion)"""
+        with self.connection() as conn:
+            conn.execute('DELETE FROM pages WHERE user = ? AND kind = ? AND date = ?', (user, kind, date))
+            conn.execute('DELETE FROM warmed_days WHERE user = ? AND kind = ? AND date = ?', (user, kind, date))
+
+    # ---------- Idempotency-Key ----------
+
+    def claim(self, key):
+        """Занять ключ: CLAIMED — выполнять запрос, PENDING — он уже выполняется,
+        иначе (status, response) сохранённого ответа"""
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute('DELETE FROM idempotency WHERE created_at < ?', (now - IDEMPOTENCY_TTL,))
+            # Брошенный (упавший) запрос можно выполнить заново
+            conn.execute('DELETE FROM idempotency WHERE key = ? AND status IS NULL AND created_at < ?',
+                         (key, now - IDEMPOTENCY_LOCK_TIMEOUT))
+            inserted = conn.execute('INSERT OR IGNORE INTO idempotency (key, created_at) VALUES (?, ?)',
+                                    (key, now)).rowcount
+            if inserted:
+                return CLAIMED
+            status, response = conn.execute(
+                'SELECT status, response FROM idempotency WHERE key = ?', (key,)).fetchone()
+        if status is None:
+            return PENDING
+        return status, json.loads(response)
+
+    def finish(self, key, status, response):
+        """Сохранить ответ для повторов с тем же ключом"""
+        with self.connection() as conn:
+            conn.execute('UPDATE idempotency SET status = ?, response = ? WHERE key = ?',
+                         (status, json.dumps(response), key))
+
+    def release(self, key):
+        """Освободить ключ, если запрос не удалось выполнить"""
+        with self.connection() as conn:
+            conn.execute('DELETE FROM idempotency WHERE key = ? AND status IS NULL', (key,))
+
+    # ---------- Отметки дня ----------
+
+    def logged_state(self, user, date):
+        """(logged, checked_at) для дня пользователя или None, если день ещё не проверялся"""
+        row = self.connection().execute(
+            'SELECT logged, checked_at FROM logged_days WHERE user = ? AND date = ?', (user, date)).fetchone()
+        return (bool(row[0]), row[1]) if row else None
+
+    def set_logged(self, user, date, logged=True):
+        """Запомнить, есть ли у пользователя записи за день; отметку «записал» не перезаписывает"""
+        now = time.time()
+        with self.connection() as conn:
+            if logged:
+                conn.execute('INSERT OR REPLACE INTO logged_days VALUES (?, ?, 1, ?)', (user, date, now))
+            else:
+                conn.execute('INSERT INTO logged_days VALUES (?, ?, 0, ?) '
+                             'ON CONFLICT (user, date) DO UPDATE SET checked_at = excluded.checked_at '
+                             'WHERE logged = 0', (user, date, now))
+            # Старые дни больше не спрашивают (даты ISO сравниваются как строки)
+            conn.execute("DELETE FROM logged_days WHERE date < date('now', ?)", (f'-{LOGGED_DAYS_KEEP} days',))
+
+
+def created_page_date(method, endpoint, body):
+    """Дата записи, если запрос к прокси создаёт страницу с полем Date (POST pages), иначе None"""
+    if method != 'POST' or endpoint.strip('/') != 'pages' or not isinstance(body, dict):
+        return None
+    date = ((body.get('properties') or {}).get('Date') or {}).get('date') or {}
+    start = (date.get('start') or '')[:10] if isinstance(date, dict) else ''
+    return start or None
+
+
+page_index = PageIndex()
@@ -1,147 +1,503 @@
 #!/usr/bin/env python3
 """
 Планировщик push-уведомлений
-Отправляет напоминания в 23:00 по московскому времени
+Отправляет напоминания каждому пользователю в его время (reminder_time) и часовом поясе
+(timezone) из реестра пользователей. Напоминания собираются в корзины по времени
+(REMINDER_BUCKET), корзины отправляются одной параллельной рассылкой, а REMINDER_JITTER
+разносит пользователей одного времени по окну, чтобы не создавать пик нагрузки.
 """
 
 import os
 import sys
 import json
+import math
 import time
-from pathlib import Path
-from datetime import datetime
+import heapq
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 import pytz
+import requests
+from requests.adapters import HTTPAdapter
 
 try:
-    from pywebpush import webpush, WebPushException
+    from pywebpush import WebPusher
+    from py_vapid import Vapid
 except ImportError:
     print("❌ pywebpush не установлен. Запустите: pip install pywebpush")
     sys.exit(1)
 
-try:
-    from apscheduler.schedulers.blocking import BlockingScheduler
-    from apscheduler.triggers.cron import CronTrigger
-except ImportError:
-    print("❌ apscheduler не установлен. Запустите: pip install apscheduler")
-    sys.exit(1)
+from subscription_store import subscription_store, SubscriptionCache, DATA_DIR
+from page_index import page_index
+from notion_mirror import mirror
+from notion_api import NOTION_TOKEN, notion_json, resolve_data_source_id
+from users import registry as users, DEFAULT_TIMEZONE
+from metrics import registry, process_info, observe_push
 
-# Конфигурация - путь для хранения подписок (используем /app/data в Docker)
-if os.path.exists('/app/data'):
-    SUBSCRIPTIONS_FILE = Path('/app/data/push_subscriptions.json')
-elif os.path.exists('/opt/habbits'):
-    SUBSCRIPTIONS_FILE = Path('/opt/habbits/push_subscriptions.json')
-else:
-    SUBSCRIPTIONS_FILE = Path('push_subscriptions.json')
+# Конфигурация
 VAPID_PRIVATE_KEY = os.getenv('VAPID_PRIVATE_KEY', '')
 VAPID_PUBLIC_KEY = os.getenv('VAPID_PUBLIC_KEY', '')
 VAPID_CLAIMS = {
     "sub": "mailto:gleb@hlebgleb.ru"
 }
 
-# Таймзона
-MOSCOW_TZ = pytz.timezone('Europe/Moscow')
+# Расписание напоминаний
+REMINDER_BUCKET = float(os.getenv('REMINDER_BUCKET', '60'))  # Секунд: напоминания корзины уходят одной рассылкой
+REMINDER_JITTER = float(os.getenv('REMINDER_JITTER', '0'))  # Секунд: окно, по которому разносятся пользователи
+REMINDER_RECHECK = float(os.getenv('REMINDER_RECHECK', '30'))  # Секунд между проверками реестра и подписок
 
+# Не напоминать тем, кто уже отметил привычки за день
+REMINDER_SKIP_LOGGED = os.getenv('REMINDER_SKIP_LOGGED', '1') == '1'
+LOGGED_CHECK_TTL = float(os.getenv('LOGGED_CHECK_TTL', '600'))  # Секунд доверять ответу «ещё не отметился»
 
-def load_subscriptions():
-    """Загрузить подписки из файла"""
-    if SUBSCRIPTIONS_FILE.exists():
-        try:
-            with open(SUBSCRIPTIONS_FILE, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"❌ Ошибка загрузки подписок: {e}")
-            return {}
-    return {}
+# Параллельная рассылка
+PUSH_WORKERS = int(os.getenv('PUSH_WORKERS', '16'))  # Одновременных отправок
+PUSH_TIMEOUT = float(os.getenv('PUSH_TIMEOUT', '10'))  # Таймаут запроса к push-сервису, сек
+PUSH_TTL = int(os.getenv('PUSH_TTL', '0'))  # Сколько push-сервис хранит сообщение для офлайн-устройства, сек
+VAPID_TOKEN_LIFETIME = 12 * 60 * 60  # Срок жизни VAPID JWT (максимум по спецификации — 24ч)
+VAPID_REFRESH_MARGIN = 10 * 60  # Перевыпускаем JWT заранее, чтобы он не истёк в полёте
 
+# Метрики рассылок (формат Prometheus, сервер отдаёт файл на /metrics/scheduler)
+PUSH_METRICS_FILE = os.getenv('PUSH_METRICS_FILE', str(DATA_DIR / 'push_scheduler.prom'))
 
-def save_subscriptions(subscriptions):
-    """Сохранить подписки в файл"""
-    with open(SUBSCRIPTIONS_FILE, 'w') as f:
-        json.dump(subscriptions, f, indent=2)
+process_info.set(1, pid=os.getpid(), role='scheduler')
+run_seconds = registry.gauge('habbits_push_run_seconds', 'Длительность последней рассылки', ('kind',))
+run_timestamp = registry.gauge('habbits_push_run_timestamp_seconds', 'Время окончания последней рассылки (unix)',
+                               ('kind',))
+run_jobs = registry.gauge('habbits_push_run_messages', 'Сообщений в последней рассылке по результату',
+                          ('kind', 'result'))
+runs_total = registry.counter('habbits_push_runs_total', 'Рассылки планировщика', ('kind',))
 
 
-def send_notification(user, message):
-    """Отправить push-уведомление пользователю"""
-    if not VAPID_PRIVATE_KEY:
-        print("❌ VAPID_PRIVATE_KEY не настроен")
-        return 0, 0
-    
-    subscriptions = load_subscriptions()
-    user_subs = subscriptions.get(user, [])
-    
-    if not user_subs:
-        print(f"ℹ️ Нет подписок для пользователя {user}")
-        return 0, 0
-    
-    payload = json.dumps({
-        'title': 'Трекер Привычек 📊',
+class VapidSigner:
+    """Подписывает VAPID JWT один раз на аудиторию (origin push-сервиса) до истечения срока"""
+
+    def __init__(self, private_key, claims):
+        self.vapid = Vapid.from_string(private_key=private_key)
+        self.claims = claims
+        self.tokens = {}  # audience -> (expires_at, headers)
+        self.lock = threading.Lock()
+
+    def headers(self, audience):
+        now = int(time.time())
+        with self.lock:
+            cached = self.tokens.get(audience)
+            if cached and cached[0] - VAPID_REFRESH_MARGIN > now:
+                return dict(cached[1])
+            exp = now + VAPID_TOKEN_LIFETIME
+            headers = self.vapid.sign({**self.claims, 'aud': audience, 'exp': exp})
+            self.tokens[audience] = (exp, headers)
+            return dict(headers)
+
+
+class PushSessions:
+    """Keep-alive сессии по одной на origin push-сервиса (FCM, Mozilla, Apple...)"""
+
+    def __init__(self, pool_size):
+        self.pool_size = pool_size
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, origin):
+        with self.lock:
+            session = self.sessions.get(origin)
+            if session is None:
+                session = requests.Session()
+                session.mount(origin, HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+                self.sessions[origin] = session
+            return session
+
+
+push_sessions = PushSessions(PUSH_WORKERS)
+vapid_signer = None
+
+
+def endpoint_origin(endpoint):
+    url = urlparse(endpoint)
+    return f"{url.scheme}://{url.netloc}"
+
+
+def percentile(values, pct):
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def deliver(job):
+    """Отправить одно push-сообщение; возвращает результат с задержкой"""
+    user, sub, payload = job
+    endpoint = sub.get('endpoint', '')
+    origin = endpoint_origin(endpoint)
+    started = time.monotonic()
+    result = {'user': user, 'endpoint': endpoint, 'origin': origin, 'ok': False, 'invalid': False}
+    try:
+        response = WebPusher(sub, requests_session=push_sessions.get(origin)).send(
+            payload,
+            headers=vapid_signer.headers(origin),
+            ttl=PUSH_TTL,
+            content_encoding='aes128gcm',
+            timeout=PUSH_TIMEOUT,
+        )
+        result['status'] = response.status_code
+        observe_push(endpoint, time.monotonic() - started, response.status_code)
+        result['ok'] = response.status_code <= 202
+        # Если подписка невалидна (устройство отписалось), помечаем для удаления
+        result['invalid'] = response.status_code in [404, 410]
+        if not result['ok']:
+            result['error'] = f"{response.status_code} {response.reason}"
+    except Exception as e:
+        result['error'] = str(e)
+        observe_push(endpoint, time.monotonic() - started, None)
+    result['latency'] = time.monotonic() - started
+    return result
+
+
+def deliver_all(jobs):
+    """Разослать сообщения параллельно и вернуть сводку по доставке"""
+    global vapid_signer
+    if vapid_signer is None:
+        vapid_signer = VapidSigner(VAPID_PRIVATE_KEY, VAPID_CLAIMS)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=PUSH_WORKERS, thread_name_prefix='push') as executor:
+        results = list(executor.map(deliver, jobs))
+    elapsed = time.monotonic() - started
+
+    by_origin = {}
+    for result in results:
+        if result['ok']:
+            print(f"✅ Push отправлен для {result['user']}")
+        else:
+            print(f"❌ Ошибка отправки push для {result['user']}: {result.get('error')}")
+        by_origin.setdefault(result['origin'], []).append(result['latency'])
+
+    report = {
+        'sent': sum(1 for r in results if r['ok']),
+        'failed': sum(1 for r in results if not r['ok']),
+        'elapsed': elapsed,
+        'throughput': len(results) / elapsed if elapsed > 0 else 0.0,
+        'origins': {},
+        'invalid': [(r['user'], r['endpoint']) for r in results if r['invalid']],
+    }
+    for origin, latencies in by_origin.items():
+        latencies.sort()
+        report['origins'][origin] = {
+            'count': len(latencies),
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'max': latencies[-1],
+        }
+    return report
+
+
+def print_report(report):
+    """Вывести пропускную способность и задержки по push-сервисам"""
+    print(f"⚡ {report['sent'] + report['failed']} отправок за {report['elapsed']:.2f}с "
+          f"({report['throughput']:.1f}/с, {PUSH_WORKERS} потоков)")
+    for origin, stats in sorted(report['origins'].items()):
+        print(f"   {origin}: {stats['count']} шт, p50 {stats['p50'] * 1000:.0f}мс, "
+              f"p95 {stats['p95'] * 1000:.0f}мс, max {stats['max'] * 1000:.0f}мс")
+
+
+def record_run(kind, report):
+    """Записать итоги рассылки в метрики и сохранить их в PUSH_METRICS_FILE"""
+    run_seconds.set(report['elapsed'], kind=kind)
+    run_timestamp.set(time.time(), kind=kind)
+    run_jobs.set(report['sent'], kind=kind, result='sent')
+    run_jobs.set(report['failed'], kind=kind, result='failed')
+    run_jobs.set(len(report['invalid']), kind=kind, result='invalid')
+    runs_total.inc(kind=kind)
+    try:
+        registry.write(PUSH_METRICS_FILE)
+    except OSError as e:
+        print(f"⚠️ Не удалось записать метрики в {PUSH_METRICS_FILE}: {e}")
+
+
+def remove_invalid(invalid):
+    """Удалить невалидные подписки одной транзакцией"""
+    if not invalid:
+        return
+    removed = subscription_store.delete_many([endpoint for _, endpoint in invalid])
+    print(f"🗑️ Удалено {removed} невалидных подписок")
+
+
+def build_payload(user, message):
+    return json.dumps({
+        'title': f"{users.resolve(user)['title']} 📊",
         'body': message,
         'icon': '/icons/icon.svg',
         'badge': '/icons/icon.svg',
         'tag': 'habits-reminder',
         'data': {'url': f'/{user}'}
     })
-    
-    sent = 0
-    failed = 0
-    invalid_endpoints = []
-    
-    for sub in user_subs:
-        try:
-            webpush(
-                subscription_info=sub,
-                data=payload,
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims=VAPID_CLAIMS
-            )
-            sent += 1
-            print(f"✅ Push отправлен для {user}")
-        except WebPushException as e:
-            print(f"❌ Ошибка отправки push для {user}: {e}")
-            failed += 1
-            # Если подписка невалидна (устройство отписалось), помечаем для удаления
-            if e.response and e.response.status_code in [404, 410]:
-                invalid_endpoints.append(sub.get('endpoint'))
-    
-    # Удаляем невалидные подписки
-    if invalid_endpoints:
-        subscriptions[user] = [s for s in subscriptions[user] if s.get('endpoint') not in invalid_endpoints]
-        save_subscriptions(subscriptions)
-        print(f"🗑️ Удалено {len(invalid_endpoints)} невалидных подписок")
-    
-    return sent, failed
 
 
 def send_daily_reminder():
-    """Отправить ежедневное напоминание всем пользователям"""
-    now = datetime.now(MOSCOW_TZ)
+    """Отправить напоминание всем пользователям сразу (тестовая рассылка)"""
     print(f"\n{'='*50}")
-    print(f"🔔 Отправка напоминаний в {now.strftime('%H:%M %d.%m.%Y')} MSK")
+    print(f"🔔 Отправка напоминаний всем в {datetime.now().strftime('%H:%M %d.%m.%Y')}")
     print(f"{'='*50}")
     
-    subscriptions = load_subscriptions()
-    
-    messages = {
-        'gleb': 'Привет! Не забудь отметить привычки за сегодня 💪',
-        'dasha': 'Привет! Пора отметить привычки за сегодня ✨'
-    }
-    
-    total_sent = 0
-    total_failed = 0
+    report = send_reminders(subscription_store.all_by_user(), 'daily')
+    if report:
+        print(f"\n📊 Итого: отправлено {report['sent']}, ошибок {report['failed']}")
+        print_report(report)
+
+
+def send_reminders(subscriptions, kind, skip_logged=False):
+    """Разослать напоминания пользователям {user: [subscription, ...]} одной рассылкой
+
+    skip_logged — не отправлять тем, у кого уже есть записи за сегодня.
+    """
+    # Все сообщения всех пользователей уходят одной параллельной рассылкой
+    jobs = []
+    skipped = []
+    now = time.time()
+    for user, user_subs in subscriptions.items():
+        record = users.get(user)
+        if record is None:
+            print(f"ℹ️ Пользователя {user} нет в реестре, пропускаем {len(user_subs)} подписок")
+            continue
+        if skip_logged and user_subs and has_logged(record, now):
+            skipped.append(user)
+            continue
+        payload = build_payload(user, record['reminder'])
+        jobs.extend((user, sub, payload) for sub in user_subs)
     
-    for user in subscriptions.keys():
-        message = messages.get(user, 'Не забудь отметить привычки!')
-        sent, failed = send_notification(user, message)
-        total_sent += sent
-        total_failed += failed
+    if skipped:
+        print(f"⏭️ Уже отметились за сегодня, без напоминания: {', '.join(skipped)}")
+    if not jobs:
+        print("ℹ️ Нет подписок")
+        return None
     
-    print(f"\n📊 Итого: отправлено {total_sent}, ошибок {total_failed}")
+    report = deliver_all(jobs)
+    remove_invalid(report['invalid'])
+    record_run(kind, report)
+    return report
+
+
+# ==================== Отметки за день ====================
+
+reminder_checks = registry.counter('habbits_reminder_checks_total',
+                                   'Проверки «уже отметился за день» перед напоминанием по источнику и результату',
+                                   ('source', 'result'))
+
+
+def user_timezone(record):
+    try:
+        return pytz.timezone(record['timezone'])
+    except pytz.UnknownTimeZoneError:
+        print(f"⚠️ Неизвестный часовой пояс {record['timezone']} у {record['id']}, используем {DEFAULT_TIMEZONE}")
+        return pytz.timezone(DEFAULT_TIMEZONE)
+
+
+def has_logged(record, now):
+    """Есть ли у пользователя записи о привычках за сегодня (по его часовому поясу)
+
+    Отметку «записал» ставит сервер при записи дня, она действует до конца дня. Иначе —
+    свежее зеркало или один запрос к Notion (page_size 1); ответ «не записал» кэшируется на
+    LOGGED_CHECK_TTL. При ошибке проверки напоминание отправляется.
+    """
+    user = record['id']
+    day = datetime.fromtimestamp(now, user_timezone(record)).date()
+    state = page_index.logged_state(user, day.isoformat())
+    if state is not None and (state[0] or now - state[1] < LOGGED_CHECK_TTL):
+        reminder_checks.inc(source='cache', result='logged' if state[0] else 'not_logged')
+        return state[0]
+
+    if mirror.is_fresh(user):
+        source = 'mirror'
+        logged = bool(mirror.habits_on(user, day))
+    elif NOTION_TOKEN and record['database_id']:
+        source = 'notion'
+        try:
+            data_source_id = resolve_data_source_id(record['database_id'])
+            data = notion_json('POST', f'data_sources/{data_source_id}/query', {
+                'filter': {'property': 'Date', 'date': {'equals': day.isoformat()}},
+                'page_size': 1,
+            }, user)
+        except Exception as e:
+            print(f"⚠️ Не удалось проверить записи {user} за {day.isoformat()}: {e}")
+            reminder_checks.inc(source=source, result='error')
+            return False
+        logged = bool(data.get('results'))
+    else:
+        return False
+
+    page_index.set_logged(user, day.isoformat(), logged)
+    reminder_checks.inc(source=source, result='logged' if logged else 'not_logged')
+    return logged
+
+
+# ==================== Расписание ====================
+
+def parse_reminder_time(value):
+    """'23:00' -> (23, 0)"""
+    hours, minutes = value.split(':')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(value)
+    return hours, minutes
+
+
+def jitter_offset(user, day):
+    """Стабильный сдвиг пользователя внутри окна REMINDER_JITTER (свой на каждый день)"""
+    if REMINDER_JITTER <= 0:
+        return 0.0
+    digest = hashlib.sha256(f'{user}:{day.isoformat()}'.encode()).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64 * REMINDER_JITTER
+
+
+def next_reminder(record, after):
+    """Ближайший момент напоминания пользователя (unix) позже after"""
+    tz = user_timezone(record)
+    try:
+        hours, minutes = parse_reminder_time(record['reminder_time'])
+    except ValueError:
+        print(f"⚠️ Некорректное время напоминания {record['reminder_time']!r} у {record['id']}, используем 23:00")
+        hours, minutes = 23, 0
+
+    day = datetime.fromtimestamp(after, tz).date()
+    while True:
+        local = tz.localize(datetime(day.year, day.month, day.day, hours, minutes))
+        when = local.timestamp() + jitter_offset(record['id'], day)
+        if when > after:
+            return when
+        day += timedelta(days=1)
+
+
+class ReminderQueue:
+    """Очередь напоминаний по корзинам времени
+
+    Куча хранит моменты корзин, словарь — пользователей каждой корзины. Перенос
+    пользователя не трогает кучу: он просто переходит в другую корзину, а опустевшие
+    корзины выбрасываются, когда доходят до вершины кучи.
+    """
+
+    def __init__(self, bucket_seconds):
+        self.bucket_seconds = max(bucket_seconds, 1.0)
+        self.heap = []  # Моменты корзин (unix)
+        self.buckets = {}  # Момент корзины -> множество пользователей
+        self.due = {}  # Пользователь -> момент его корзины
+
+    def schedule(self, user, when):
+        """Поставить напоминание пользователю (в корзину, которая начинается не раньше when)"""
+        self.cancel(user)
+        bucket = math.ceil(when / self.bucket_seconds) * self.bucket_seconds
+        if bucket not in self.buckets:
+            self.buckets[bucket] = set()
+            heapq.heappush(self.heap, bucket)
+        self.buckets[bucket].add(user)
+        self.due[user] = bucket
+        return bucket
+
+    def cancel(self, user):
+        bucket = self.due.pop(user, None)
+        if bucket is not None:
+            self.buckets[bucket].discard(user)
+
+    def next_wakeup(self):
+        """Момент ближайшей непустой корзины или None"""
+        while self.heap and not self.buckets.get(self.heap[0]):
+            self.buckets.pop(heapq.heappop(self.heap), None)
+        return self.heap[0] if self.heap else None
+
+    def pop_due(self, now):
+        """Забрать пользователей всех наступивших корзин"""
+        due = []
+        while self.heap and self.heap[0] <= now:
+            bucket = heapq.heappop(self.heap)
+            for user in self.buckets.pop(bucket, ()):
+                del self.due[user]
+                due.append(user)
+        return due
+
+
+class ReminderPlanner:
+    """Расписание напоминаний, пересчитываемое только для изменившихся пользователей
+
+    Реестр пользователей и кэш подписок сообщают о своих изменениях (version и
+    PRAGMA data_version), поэтому в обычном цикле ничего не перечитывается, а после
+    изменения переносятся только пользователи с новыми настройками или подписками.
+    """
+
+    def __init__(self, queue, subscriptions):
+        self.queue = queue
+        self.subscriptions = subscriptions
+        self.settings = {}  # Пользователь -> (timezone, reminder_time), по которым он поставлен в очередь
+        self.seen = None  # (версия реестра, число перечитываний подписок)
+
+    def refresh(self, now):
+        """Учесть изменения реестра и подписок"""
+        by_user, _ = self.subscriptions.refresh()
+        users.check()
+        seen = (users.version, self.subscriptions.reloads)
+        if seen == self.seen:
+            return 0
+        self.seen = seen
+
+        wanted = {user: users.get(user) for user in by_user if by_user[user]}
+        wanted = {user: record for user, record in wanted.items() if record is not None}
+        changed = 0
+        for user in set(self.settings) - set(wanted):
+            self.queue.cancel(user)
+            del self.settings[user]
+            changed += 1
+        for user, record in wanted.items():
+            settings = (record['timezone'], record['reminder_time'])
+            if self.settings.get(user) != settings:
+                self.queue.schedule(user, next_reminder(record, now))
+                self.settings[user] = settings
+                changed += 1
+        if changed:
+            print(f"📅 Расписание обновлено: {changed} пользователей, всего {len(self.settings)}")
+        return changed
+
+    def reschedule(self, user, after):
+        """Поставить следующее напоминание пользователя после отправки"""
+        record = users.get(user)
+        if record is None or user not in self.settings:
+            return
+        self.queue.schedule(user, next_reminder(record, after))
+
+    def upcoming(self, limit=5):
+        return sorted((bucket, user) for user, bucket in self.queue.due.items())[:limit]
+
+
+def run_schedule(stop):
+    """Цикл планировщика: спать до ближайшей корзины или следующей проверки изменений"""
+    queue = ReminderQueue(REMINDER_BUCKET)
+    planner = ReminderPlanner(queue, SubscriptionCache(subscription_store))
+    planner.refresh(time.time())
+    for bucket, user in planner.upcoming():
+        print(f"   {user}: {datetime.fromtimestamp(bucket).strftime('%d.%m %H:%M:%S')}")
+
+    while not stop.is_set():
+        now = time.time()
+        planner.refresh(now)
+        due = queue.pop_due(now)
+        if due:
+            by_user, _ = planner.subscriptions.refresh()
+            print(f"\n🔔 Напоминания для {len(due)} пользователей ({datetime.now().strftime('%H:%M:%S %d.%m.%Y')})")
+            report = send_reminders({user: by_user.get(user, []) for user in due}, 'bucket', REMINDER_SKIP_LOGGED)
+            if report:
+                print_report(report)
+            for user in due:
+                planner.reschedule(user, now)
+            continue
+        wakeup = queue.next_wakeup()
+        timeout = REMINDER_RECHECK if wakeup is None else min(wakeup - now, REMINDER_RECHECK)
+        stop.wait(max(timeout, 0.0))
 
 
 def main():
     """Запуск планировщика"""
     print("🚀 Запуск планировщика push-уведомлений")
-    print(f"📁 Файл подписок: {SUBSCRIPTIONS_FILE}")
+    print(f"📁 База подписок: {subscription_store.path}")
     print(f"🔑 VAPID ключ: {'настроен' if VAPID_PRIVATE_KEY else 'НЕ НАСТРОЕН'}")
     
     if not VAPID_PRIVATE_KEY:
@@ -151,27 +507,17 @@ def main():
         print("  python generate-vapid-keys.py")
         sys.exit(1)
     
-    scheduler = BlockingScheduler(timezone=MOSCOW_TZ)
-    
-    # Ежедневно в 23:00 по Москве
-    scheduler.add_job(
-        send_daily_reminder,
-        CronTrigger(hour=23, minute=0, timezone=MOSCOW_TZ),
-        id='daily_reminder',
-        name='Ежедневное напоминание в 23:00'
-    )
-    
-    print(f"\n⏰ Напоминания будут отправляться в 23:00 MSK")
-    print("Нажмите Ctrl+C для остановки\n")
-    
     # Для отладки: отправить сразу
     if '--test' in sys.argv:
         print("🧪 Тестовая отправка...")
         send_daily_reminder()
         return
     
+    print(f"\n⏰ Напоминания по времени пользователей (корзины {REMINDER_BUCKET:.0f}с, разброс {REMINDER_JITTER:.0f}с)")
+    print("Нажмите Ctrl+C для остановки\n")
+    
     try:
-        scheduler.start()
+        run_schedule(threading.Event())
     except (KeyboardInterrupt, SystemExit):
         print("\n👋 Планировщик остановлен")
 
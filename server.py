@@ -4,42 +4,60 @@
 + Push-уведомления для PWA
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, abort
 from flask_cors import CORS
 import requests
 import os
 import sys
 import json
-from pathlib import Path
-
-# Push notifications
-try:
-    from pywebpush import webpush, WebPushException
-    PUSH_AVAILABLE = True
-except ImportError:
-    PUSH_AVAILABLE = False
+import re
+import time
+import gzip
+import zlib
+import hashlib
+import importlib.util
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as Date, timedelta
+from urllib.parse import urlparse
+
+from notion_api import (
+    NOTION_TOKEN, NotionError, NotionBusy, TTLCache, notion_cache, is_cacheable, cache_key,
+    CACHEABLE_ENDPOINT_RE, notion_call, notion_pool_stats, notion_scheduler, endpoint_label,
+    invalidate_notion_cache, resolve_data_source_id, resolve_energy_schema,
+    query_all, parse_habit_page, parse_energy_page,
+)
+from users import registry as users, get_user_databases, configured_users
+from notion_mirror import mirror
+from subscription_store import subscription_store, SubscriptionCache, DATA_DIR
+from page_index import page_index, created_page_date, CLAIMED, PENDING
+from notion_flight import NOTION_COALESCE, FlightResult, notion_flights, is_coalescable, flight_key
+from metrics import registry, process_info, observe_push, PROMETHEUS_CONTENT_TYPE
+from static_assets import STATIC_ASSETS, BROTLI_AVAILABLE, Asset, AssetPipeline, REVALIDATE, is_public
+
+# Push notifications и аналитика (NumPy) тянут тяжёлые модули (pywebpush → cryptography, aiohttp),
+# поэтому при старте только проверяем, что они установлены, а импортируем при первом использовании
+PUSH_AVAILABLE = importlib.util.find_spec('pywebpush') is not None
+if not PUSH_AVAILABLE:
     print("⚠️ pywebpush не установлен, push-уведомления недоступны")
 
+ANALYTICS_AVAILABLE = importlib.util.find_spec('numpy') is not None
+if not ANALYTICS_AVAILABLE:
+    print("⚠️ numpy не установлен, аналитика /api/analytics недоступна")
+
+def pywebpush():
+    """Модуль pywebpush (импорт при первой отправке push)"""
+    import pywebpush
+    return pywebpush
+
+def analytics():
+    """Движок аналитики (импорт NumPy при первом запросе /api/analytics)"""
+    from habit_analytics import analytics
+    return analytics
+
 app = Flask(__name__, static_folder='.')
 CORS(app)
 
-# Путь для хранения подписок (используем /app/data в Docker)
-if os.path.exists('/app/data'):
-    SUBSCRIPTIONS_FILE = Path('/app/data/push_subscriptions.json')
-elif os.path.exists('/opt/habbits'):
-    SUBSCRIPTIONS_FILE = Path('/opt/habbits/push_subscriptions.json')
-else:
-    SUBSCRIPTIONS_FILE = Path('push_subscriptions.json')
-
-# Загружаем конфигурацию из переменных окружения
-NOTION_TOKEN = os.getenv('NOTION_TOKEN')
-# База данных для Глеба (по умолчанию)
-GLEB_DATABASE_ID = os.getenv('DATABASE_ID')  # Для обратной совместимости
-GLEB_ENERGY_DATABASE_ID = os.getenv('ENERGY_DATABASE_ID', '')  # Опционально
-GLEB_ENERGY_DATA_SOURCE_ID = os.getenv('ENERGY_DATA_SOURCE_ID', '')  # Опционально
-# База данных для Даши
-DASHA_DATABASE_ID = os.getenv('DASHA_DATABASE_ID', '')
-
 # VAPID ключи для push-уведомлений
 # Генерируются один раз: python -c "from pywebpush import webpush; from cryptography.hazmat.primitives.asymmetric import ec; from cryptography.hazmat.backends import default_backend; import base64; key = ec.generate_private_key(ec.SECP256R1(), default_backend()); print('Private:', base64.urlsafe_b64encode(key.private_numbers().private_value.to_bytes(32, 'big')).decode()); pub = key.public_key().public_numbers(); print('Public:', base64.urlsafe_b64encode(b'\\x04' + pub.x.to_bytes(32, 'big') + pub.y.to_bytes(32, 'big')).decode())"
 VAPID_PRIVATE_KEY = os.getenv('VAPID_PRIVATE_KEY', '')
@@ -53,52 +71,109 @@ if not NOTION_TOKEN:
     print("   Установите ее в настройках Render или через .env файл")
     sys.exit(1)
 
-if not GLEB_DATABASE_ID:
-    print("❌ Ошибка: Не установлена переменная окружения DATABASE_ID (для Глеба)")
-    print("   Установите ее в настройках Render или через .env файл")
+if not configured_users():
+    print("❌ Ошибка: Ни у одного пользователя не настроена база привычек")
+    print("   Опишите пользователей в users.json (USERS_FILE) или задайте DATABASE_ID в настройках Render или .env файле")
     sys.exit(1)
 
-NOTION_API_VERSION = '2025-09-03'  # Версия с поддержкой multi-source databases
-NOTION_API_BASE = 'https://api.notion.com/v1'
+# Запись привычек пачкой
+NOTION_BATCH_CONCURRENCY = int(os.getenv('NOTION_BATCH_CONCURRENCY', '3'))  # Параллельных записей
+NOTION_BATCH_MAX_ITEMS = int(os.getenv('NOTION_BATCH_MAX_ITEMS', '100'))
+
+# Недельные сводки статистики: прошедшие недели считаются один раз
+STATS_ROLLUP_TTL = float(os.getenv('STATS_ROLLUP_TTL', str(7 * 24 * 3600)))  # Секунд
+STATS_ROLLUP_MAXSIZE = int(os.getenv('STATS_ROLLUP_MAXSIZE', '1000'))  # Недель (всех пользователей)
+STATS_MAX_DAYS = int(os.getenv('STATS_MAX_DAYS', '366'))  # Максимальный период запроса
+ANALYTICS_MAX_DAYS = int(os.getenv('ANALYTICS_MAX_DAYS', '3660'))  # Максимальный период /api/analytics
+
+# Как часто заново определять data_source_id и поля баз пользователей (0 — только при старте)
+SCHEMA_REFRESH_INTERVAL = float(os.getenv('SCHEMA_REFRESH_INTERVAL', '600'))  # Секунд
+# Сколько /api/config ждёт прогрева воркера, вместо того чтобы параллельно запрашивать те же схемы
+SCHEMA_PREWARM_WAIT = float(os.getenv('SCHEMA_PREWARM_WAIT', '5'))  # Секунд
+
+# Прокси передаёт успешные ответы Notion потоком, без разбора JSON (0 — разбирать и сериализовать заново)
+NOTION_PROXY_STREAMING = os.getenv('NOTION_PROXY_STREAMING', '1') == '1'
+PROXY_STREAM_CHUNK = 64 * 1024  # Байт
+PROXY_GZIP_LEVEL = int(os.getenv('PROXY_GZIP_LEVEL', '5'))  # Сжатие ответов, если Notion прислал их без gzip
+
+def referer_user():
+    """Пользователь по странице, с которой пришёл запрос (/dasha, /dasha/stat)"""
+    return users.from_path(urlparse(request.headers.get('Referer', '')).path)
+
+def request_user_id(value=None):
+    """id пользователя из параметра запроса (неизвестные — пользователь по умолчанию)"""
+    return get_user_databases(value)['USER']
+
+# ==================== Статика ====================
+
+# Скрипты, стили и страницы читаются и сжимаются один раз при старте воркера
+assets = AssetPipeline('.').build() if STATIC_ASSETS else None
+if assets:
+    print(f"📦 Статика {assets.version}: {len(assets.urls)} файлов с отпечатком, "
+          f"brotli {'есть' if BROTLI_AVAILABLE else 'нет (pip install brotli)'}")
+
+def asset_response(asset):
+    """Ответ файлом из памяти: сжатый вариант по Accept-Encoding, 304 по ETag"""
+    encoding, body = asset.negotiate(request.headers.get('Accept-Encoding'))
+    headers = {'ETag': asset.etag_for(encoding), 'Cache-Control': asset.cache_control, 'Vary': 'Accept-Encoding'}
+    if asset.matches(request.headers.get('If-None-Match')):
+        return Response(status=304, headers=headers)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(body, status=200, headers=headers, content_type=asset.content_type)
+
+def serve_asset(name):
+    """Файл из памяти, если он есть в статике, иначе с диска"""
+    asset = assets.get(name) if assets else None
+    if asset is None:
+        return send_from_directory('.', name)
+    return asset_response(asset)
 
 @app.route('/')
 def index():
-    """Главная страница - редирект на /gleb"""
+    """Главная страница - редирект на страницу пользователя по умолчанию"""
     from flask import redirect
-    return redirect('/gleb')
+    return redirect(f"/{get_user_databases(None)['USER']}")
+
+@app.route('/<user>')
+def user_page(user):
+    """Страница пользователя из реестра (остальные пути — статические файлы)"""
+    if users.get(user) is None:
+        return static_files(user)
+    return serve_asset('index.html')
 
-@app.route('/gleb')
-def gleb():
-    """Страница для Глеба"""
-    return send_from_directory('.', 'index.html')
+@app.route('/<user>/stat')
+def user_stat(user):
+    """Страница статистики пользователя"""
+    record = users.get(user)
+    if record is None or not record['stats']:
+        return static_files(f'{user}/stat')
+    return serve_asset('stat.html')
 
-@app.route('/gleb/stat')
-def gleb_stat():
-    """Страница статистики для Глеба"""
-    return send_from_directory('.', 'stat.html')
+# Манифесты по пользователю; сбрасываются при изменении реестра
+manifest_cache = {'version': None, 'assets': {}}
 
 @app.route('/manifest.json')
 def manifest():
     """Динамический манифест PWA в зависимости от referer"""
-    # Определяем пользователя из referer
-    referer = request.headers.get('Referer', '')
-    if '/dasha' in referer:
-        user = 'dasha'
-        name = 'Привычки Даши'
-        start_url = '/dasha'
-    else:
-        user = 'gleb'
-        name = 'Трекер Привычек'
-        start_url = '/gleb'
-    
-    manifest_data = {
-        "name": name,
-        "short_name": "Привычки",
+    record = referer_user()
+    if manifest_cache['version'] != users.version:
+        manifest_cache.update(version=users.version, assets={})
+    asset = manifest_cache['assets'].get(record['id'])
+    if asset is None:
+        body = json.dumps(build_manifest(record), ensure_ascii=False).encode()
+        asset = manifest_cache['assets'][record['id']] = Asset('manifest.json', body, REVALIDATE)
+    return asset_response(asset)
+
+def build_manifest(record):
+    return {
+        "name": record['title'],
+        "short_name": record['short_name'],
         "description": "Ежедневный трекер привычек с напоминаниями",
-        "start_url": start_url,
+        "start_url": f"/{record['id']}",
         "display": "standalone",
-        "background_color": "#667eea",
-        "theme_color": "#667eea",
+        "background_color": record['theme_color'],
+        "theme_color": record['theme_color'],
         "orientation": "portrait",
         "icons": [
             {
@@ -109,59 +184,115 @@ def manifest():
             }
         ]
     }
-    
-    return jsonify(manifest_data)
 
-@app.route('/dasha')
-def dasha():
-    """Страница для Даши"""
-    return send_from_directory('.', 'index.html')
+# ==================== Схемы баз ====================
+
+# data_source_id и поля базы энергии определяются на сервере при старте и отдаются
+# в /api/config, чтобы клиенту не нужна была цепочка запросов databases → data_sources → query
+user_schemas = {}
+user_schemas_lock = threading.Lock()
+schemas_ready = threading.Event()  # Прогрев при старте закончен (успешно или нет)
+
+def resolve_user_schema(user):
+    """Определить data_source_id баз пользователя и поля базы энергии"""
+    user_config = get_user_databases(user)
+    schema = {
+        'DATABASE_ID': user_config['DATABASE_ID'],  # Для какой базы определено (реестр может смениться)
+        'DATA_SOURCE_ID': resolve_data_source_id(user_config['DATABASE_ID']),
+        'ENERGY_DATA_SOURCE_ID': None,
+        'ENERGY_SCHEMA': None,
+    }
+    if user_config['ENERGY_DATABASE_ID']:
+        energy = resolve_energy_schema(user_config)
+        schema['ENERGY_DATA_SOURCE_ID'] = energy['dataSourceId']
+        schema['ENERGY_SCHEMA'] = {key: energy[key] for key in ('questionField', 'dateField', 'answerField')}
+    with user_schemas_lock:
+        user_schemas[user] = schema
+    return schema
+
+def refresh_user_schemas(force=False):
+    """Определить схемы всех пользователей; force — перечитать из Notion в обход кэша"""
+    for user in configured_users():
+        if force:
+            user_config = get_user_databases(user)
+            with user_schemas_lock:
+                previous = user_schemas.get(user) or {}
+            for prefix in (f"databases/{user_config['DATABASE_ID']}",
+                           f"databases/{user_config['ENERGY_DATABASE_ID']}" if user_config['ENERGY_DATABASE_ID'] else None,
+                           f"data_sources/{previous['ENERGY_DATA_SOURCE_ID']}" if previous.get('ENERGY_DATA_SOURCE_ID') else None):
+                if prefix:
+                    invalidate_notion_cache(prefix)
+        try:
+            resolve_user_schema(user)
+        except NotionError as e:
+            print(f"⚠️ Не удалось определить схемы баз для {user}: {e.message}")
+        except requests.RequestException as e:
+            print(f"⚠️ Notion недоступен при определении схем баз для {user}: {e}")
+
+def prewarm():
+    """Прогрев воркера сразу после старта: соединение с Notion, схемы баз для /api/config, подписки"""
+    started = time.perf_counter()
+    try:
+        refresh_user_schemas()
+    finally:
+        schemas_ready.set()
+    subscriptions_cache.refresh()
+    print(f"🔥 Воркер прогрет за {time.perf_counter() - started:.2f}с")
+
+def schema_refresh_loop():
+    """Прогреть воркер при старте и обновлять схемы в фоне (ловит изменения структуры баз)"""
+    prewarm()
+    while SCHEMA_REFRESH_INTERVAL > 0:
+        time.sleep(SCHEMA_REFRESH_INTERVAL)
+        refresh_user_schemas(force=True)
 
 @app.route('/api/config')
 def get_config():
-    """Получить конфигурацию для клиента"""
-    # Определяем пользователя из заголовка Referer или параметра
-    user = request.args.get('user', 'gleb')
+    """Получить конфигурацию для клиента (вместе с data_source_id и полями базы энергии)"""
+    # Определяем пользователя из параметра (неизвестные — пользователь по умолчанию)
+    config = get_user_databases(request.args.get('user'))
     
-    if user == 'dasha':
-        if not DASHA_DATABASE_ID:
-            return jsonify({'error': 'DASHA_DATABASE_ID не настроен'}), 500
-        return jsonify({
-            'DATABASE_ID': DASHA_DATABASE_ID,
-            'ENERGY_DATABASE_ID': None,  # У Даши нет вопроса об энергии
-            'ENERGY_DATA_SOURCE_ID': None,
-            'USER': 'dasha'
-        })
-    else:
-        # Глеб (по умолчанию)
-        return jsonify({
-            'DATABASE_ID': GLEB_DATABASE_ID,
-            'ENERGY_DATABASE_ID': GLEB_ENERGY_DATABASE_ID or None,
-            'ENERGY_DATA_SOURCE_ID': GLEB_ENERGY_DATA_SOURCE_ID or None,
-            'USER': 'gleb'
-        })
+    if not config['DATABASE_ID']:
+        return jsonify({'error': f"База привычек пользователя {config['USER']} не настроена"}), 500
+    
+    # Оформление и настройки интерфейса из реестра пользователей
+    record = users.resolve(config['USER'])
+    config.update({
+        'TITLE': record['title'],
+        'EMOJI': record['emoji'],
+        'STATS': record['stats'],
+        'TIMEZONE': record['timezone'],
+    })
+    if record['habits']:
+        config['HABITS'] = record['habits']
+    
+    with user_schemas_lock:
+        schema = user_schemas.get(config['USER'])
+    if schema is None and not schemas_ready.is_set():
+        # Воркер только запустился: схемы уже запрашиваются прогревом
+        schemas_ready.wait(SCHEMA_PREWARM_WAIT)
+        with user_schemas_lock:
+            schema = user_schemas.get(config['USER'])
+    if schema is None or schema['DATABASE_ID'] != config['DATABASE_ID']:
+        # Фоновое определение ещё не закончилось или Notion был недоступен
+        try:
+            schema = resolve_user_schema(config['USER'])
+        except (NotionError, requests.RequestException) as e:
+            print(f"⚠️ Схемы баз для {config['USER']} не определены, клиент определит их сам: {e}")
+            schema = {}
+    return jsonify({**config, **{key: value for key, value in schema.items() if value}})
 
 @app.route('/<path:path>')
 def static_files(path):
-    """Статические файлы"""
-    return send_from_directory('.', path)
+    """Статические файлы фронтенда; остальное в корне проекта (код, базы, данные) — 404"""
+    if not ((assets and assets.get(path)) or is_public(path)):
+        abort(404)  # Как для отсутствующего файла
+    return serve_asset(path)
 
 # ==================== Push Notifications ====================
 
-def load_subscriptions():
-    """Загрузить подписки из файла"""
-    if SUBSCRIPTIONS_FILE.exists():
-        try:
-            with open(SUBSCRIPTIONS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
-
-def save_subscriptions(subscriptions):
-    """Сохранить подписки в файл"""
-    with open(SUBSCRIPTIONS_FILE, 'w') as f:
-        json.dump(subscriptions, f, indent=2)
+# Подписки держим в памяти; с диска перечитываем только после изменений базы
+subscriptions_cache = SubscriptionCache(subscription_store)
 
 @app.route('/api/push/vapid-key')
 def get_vapid_key():
@@ -178,25 +309,20 @@ def push_subscribe():
     
     data = request.get_json()
     subscription = data.get('subscription')
-    user = data.get('user', 'gleb')
+    user = request_user_id(data.get('user'))
     
     if not subscription:
         return jsonify({'error': 'Нет данных подписки'}), 400
     
-    # Загружаем существующие подписки
-    subscriptions = load_subscriptions()
-    
-    # Добавляем подписку для пользователя
-    if user not in subscriptions:
-        subscriptions[user] = []
+    if not subscription.get('endpoint'):
+        return jsonify({'error': 'Нет endpoint в подписке'}), 400
     
-    # Проверяем, нет ли уже такой подписки
-    endpoint = subscription.get('endpoint')
-    existing_endpoints = [s.get('endpoint') for s in subscriptions[user]]
+    # Та же подписка уже сохранена — на диск не пишем
+    if subscriptions_cache.find(subscription['endpoint']) == (user, subscription):
+        return jsonify({'success': True})
     
-    if endpoint not in existing_endpoints:
-        subscriptions[user].append(subscription)
-        save_subscriptions(subscriptions)
+    # Добавляем подписку для пользователя (повторная подписка того же устройства не дублируется)
+    if subscription_store.upsert(user, subscription):
         print(f"✅ Добавлена push-подписка для {user}")
     
     return jsonify({'success': True})
@@ -206,20 +332,26 @@ def push_unsubscribe():
     """Отписаться от push-уведомлений"""
     data = request.get_json()
     endpoint = data.get('endpoint')
-    user = data.get('user', 'gleb')
+    user = request_user_id(data.get('user'))
     
     if not endpoint:
         return jsonify({'error': 'Нет endpoint'}), 400
     
-    subscriptions = load_subscriptions()
-    
-    if user in subscriptions:
-        subscriptions[user] = [s for s in subscriptions[user] if s.get('endpoint') != endpoint]
-        save_subscriptions(subscriptions)
+    known = subscriptions_cache.find(endpoint)
+    if known and known[0] == user and subscription_store.delete(endpoint, user):
         print(f"✅ Удалена push-подписка для {user}")
     
     return jsonify({'success': True})
 
+def push_payload(user, message):
+    """Тело push-уведомления для пользователя"""
+    return json.dumps({
+        'title': users.resolve(user)['title'],
+        'body': message,
+        'icon': '/icons/icon-192.png',
+        'data': {'url': f'/{user}'}
+    })
+
 @app.route('/api/push/send', methods=['POST'])
 def send_push():
     """Отправить push-уведомление (для тестирования)"""
@@ -230,72 +362,164 @@ def send_push():
         return jsonify({'error': 'VAPID ключи не настроены'}), 500
     
     data = request.get_json()
-    user = data.get('user', 'gleb')
-    message = data.get('message', 'Не забудь отметить привычки!')
+    user = request_user_id(data.get('user'))
+    message = data.get('message') or users.resolve(user)['reminder']
     
-    subscriptions = load_subscriptions()
-    user_subs = subscriptions.get(user, [])
+    user_subs = subscriptions_cache.for_user(user)
     
     if not user_subs:
         return jsonify({'error': 'Нет подписок для пользователя'}), 404
     
     sent = 0
     failed = 0
+    invalid_endpoints = []
     
-    payload = json.dumps({
-        'title': 'Трекер Привычек',
-        'body': message,
-        'icon': '/icons/icon-192.png',
-        'data': {'url': f'/{user}'}
-    })
+    payload = push_payload(user, message)
+    push = pywebpush()
     
     for sub in user_subs:
+        started = time.perf_counter()
         try:
-            webpush(
+            response = push.webpush(
                 subscription_info=sub,
                 data=payload,
                 vapid_private_key=VAPID_PRIVATE_KEY,
                 vapid_claims=VAPID_CLAIMS
             )
+            observe_push(sub.get('endpoint'), time.perf_counter() - started, response.status_code)
             sent += 1
-        except WebPushException as e:
+        except push.WebPushException as e:
             print(f"❌ Ошибка отправки push: {e}")
+            status = e.response.status_code if e.response is not None else None
+            observe_push(sub.get('endpoint'), time.perf_counter() - started, status)
             failed += 1
-            # Если подписка невалидна, удаляем её
-            if e.response and e.response.status_code in [404, 410]:
-                subscriptions[user] = [s for s in subscriptions[user] if s.get('endpoint') != sub.get('endpoint')]
-                save_subscriptions(subscriptions)
+            # Если подписка невалидна, помечаем для удаления
+            if status in [404, 410]:
+                invalid_endpoints.append(sub.get('endpoint'))
+    
+    # Удаляем невалидные подписки одной транзакцией
+    if invalid_endpoints:
+        subscription_store.delete_many(invalid_endpoints)
+        print(f"🗑️ Удалено {len(invalid_endpoints)} невалидных подписок")
     
     return jsonify({'sent': sent, 'failed': failed})
 
+# ==================== Метрики ====================
+
+process_info.set(1, pid=os.getpid(), role='server')
+
+# Файл метрик планировщика push (пишется после каждой рассылки)
+PUSH_METRICS_FILE = os.getenv('PUSH_METRICS_FILE', str(DATA_DIR / 'push_scheduler.prom'))
+
+@app.route('/metrics')
+def metrics():
+    """Метрики текущего воркера в формате Prometheus"""
+    return registry.render(), 200, {'Content-Type': PROMETHEUS_CONTENT_TYPE}
+
+@app.route('/metrics/scheduler')
+def scheduler_metrics():
+    """Метрики последней рассылки планировщика push"""
+    try:
+        with open(PUSH_METRICS_FILE) as f:
+            return f.read(), 200, {'Content-Type': PROMETHEUS_CONTENT_TYPE}
+    except FileNotFoundError:
+        return '', 404, {'Content-Type': PROMETHEUS_CONTENT_TYPE}
+
 # ==================== Notion API Proxy ====================
 
+@app.route('/api/debug/assets')
+def assets_debug():
+    """Статика в памяти: отпечатки и размеры сжатых вариантов"""
+    return jsonify(assets.stats() if assets else {'enabled': False})
+
+@app.route('/api/debug/notion-pool')
+def notion_pool_debug():
+    """Статистика переиспользования соединений к Notion (в рамках текущего воркера)"""
+    return jsonify(notion_pool_stats())
+
+@app.route('/api/debug/subscriptions')
+def subscriptions_debug():
+    """Сколько раз кэш подписок проверял базу и сколько раз перечитывал её"""
+    return jsonify(subscriptions_cache.stats())
+
+@app.route('/api/debug/cache')
+def notion_cache_debug():
+    """Счётчики попаданий/промахов кэша схем Notion (в рамках текущего воркера)"""
+    return jsonify(notion_cache.stats())
+
+@app.route('/api/cache/invalidate', methods=['POST'])
+def notion_cache_invalidate():
+    """Сбросить кэш схем Notion: целиком или по префиксу endpoint (например, databases/<id>)"""
+    data = request.get_json(silent=True) or {}
+    removed = invalidate_notion_cache(data.get('prefix', ''))
+    print(f"🧹 Кэш Notion сброшен: удалено {removed} записей")
+    return jsonify({'removed': removed})
+
+def proxy_user():
+    """Пользователь запроса к прокси (для честной очереди): из параметра или referer"""
+    if request.args.get('user'):
+        return request_user_id(request.args['user'])
+    return referer_user()['id']
+
+@app.route('/api/debug/notion-flights')
+def notion_flights_debug():
+    """Объединение одинаковых чтений: сколько запросов к Notion сэкономлено (в рамках текущего воркера)"""
+    return jsonify(notion_flights.stats())
+
+@app.route('/api/debug/notion-queue')
+def notion_queue_debug():
+    """Очередь к Notion: глубина, ожидание, отклонённые запросы, токены"""
+    return jsonify(notion_scheduler.stats())
+
+proxy_seconds = registry.histogram('habbits_proxy_request_seconds', 'Полное время запроса к прокси /api/notion',
+                                   ('method', 'endpoint', 'cache'))
+proxy_overhead_seconds = registry.histogram('habbits_proxy_overhead_seconds',
+                                            'Время прокси без ожидания Notion (разбор, кэш, сериализация)',
+                                            ('method', 'endpoint'), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01,
+                                                                             0.025, 0.05, 0.1, 0.25, 1.0))
+proxy_responses = registry.counter('habbits_proxy_responses_total', 'Ответы прокси /api/notion по коду',
+                                   ('endpoint', 'status'))
+
 @app.route('/api/notion/<path:endpoint>', methods=['GET', 'POST', 'PATCH'])
 def notion_proxy(endpoint):
     """Прокси для запросов к Notion API"""
+    started = time.perf_counter()
+    timing = {'upstream': 0.0, 'cache': 'none'}
+    response = app.make_response(forward_to_notion(endpoint, timing))
+    elapsed = time.perf_counter() - started
+    label = endpoint_label(endpoint)
+    proxy_seconds.observe(elapsed, method=request.method, endpoint=label, cache=timing['cache'])
+    proxy_overhead_seconds.observe(elapsed - timing['upstream'], method=request.method, endpoint=label)
+    proxy_responses.inc(endpoint=label, status=response.status_code)
+    return response
+
+def forward_to_notion(endpoint, timing):
+    """Ответ прокси; в timing — время ожидания Notion и попадание в кэш"""
     try:
-        url = f"{NOTION_API_BASE}/{endpoint}"
-        
-        headers = {
-            'Authorization': f'Bearer {NOTION_TOKEN}',
-            'Notion-Version': NOTION_API_VERSION,
-            'Content-Type': 'application/json',
-        }
-        
         # Получаем тело запроса если есть
         body = None
         if request.method in ['POST', 'PATCH']:
             body = request.get_json()
         
-        # Выполняем запрос к Notion API
-        if request.method == 'GET':
-            response = requests.get(url, headers=headers)
-        elif request.method == 'POST':
-            response = requests.post(url, headers=headers, json=body)
-        elif request.method == 'PATCH':
-            response = requests.patch(url, headers=headers, json=body)
-        else:
-            return jsonify({'error': 'Method not allowed'}), 405
+        # Схемы баз отдаём из кэша
+        cacheable = is_cacheable(request.method, endpoint)
+        if cacheable:
+            cached = notion_cache.get(cache_key(endpoint))
+            timing['cache'] = 'hit' if cached is not None else 'miss'
+            if cached is not None:
+                return jsonify(cached), 200, {'X-Cache': 'HIT'}
+        
+        # Одинаковые одновременные чтения идут в Notion одним запросом на все потоки и воркеры
+        if NOTION_COALESCE and is_coalescable(request.method, endpoint):
+            return forward_coalesced(endpoint, body, cacheable, timing)
+        
+        # Выполняем запрос к Notion API через общую очередь (лимиты, повторы при 429/5xx)
+        streaming = NOTION_PROXY_STREAMING and not cacheable
+        upstream_started = time.perf_counter()
+        try:
+            response = notion_call(request.method, endpoint, body, proxy_user(), stream=streaming)
+        finally:
+            timing['upstream'] = time.perf_counter() - upstream_started
         
         # Возвращаем ответ
         if response.status_code >= 400:
@@ -303,17 +527,774 @@ def notion_proxy(endpoint):
             print(f"❌ Notion API ошибка {response.status_code} для {endpoint}: {error_data}")
             return jsonify(error_data), response.status_code
         
-        return jsonify(response.json())
+        if request.method == 'PATCH' and CACHEABLE_ENDPOINT_RE.match(endpoint):
+            # Схема изменилась через прокси — сбрасываем её из кэша
+            invalidate_notion_cache(cache_key(endpoint))
+        created_date = created_page_date(request.method, endpoint, body)
+        if created_date:
+            # Запись дня через прокси (старый клиент) — напоминание за этот день не нужно
+            page_index.set_logged(proxy_user(), created_date)
+        if streaming:
+            return stream_notion_response(response)
+        
+        data = response.json()
+        if cacheable:
+            notion_cache.set(cache_key(endpoint), data)
+            return jsonify(data), 200, {'X-Cache': 'MISS'}
+        
+        return jsonify(data)
         
+    except NotionBusy as e:
+        print(f"🚦 Запрос к {endpoint} отклонён: {e.message}")
+        return jsonify({'message': e.message}), 503, {'Retry-After': str(int(e.retry_after))}
+    except requests.Timeout as e:
+        print(f"⏱️ Таймаут запроса к Notion для {endpoint}: {e}")
+        return jsonify({'message': 'Notion API не ответил вовремя'}), 504
     except Exception as e:
         print(f"Ошибка прокси к Notion: {e}")
         return jsonify({'message': str(e)}), 500
 
+def forward_coalesced(endpoint, body, cacheable, timing):
+    """Ответ прокси на чтение, общее с одинаковыми одновременными запросами
+
+    Ведущий передаёт ответ потоком, как обычный прокси; тело копируется, только если
+    к моменту ответа Notion тот же запрос ждут другие потоки или воркеры.
+    """
+    method = request.method
+    upstream_started = time.perf_counter()
+    try:
+        flight = notion_flights.join(flight_key(method, endpoint, body), endpoint)
+        if flight.result is None:
+            try:
+                response = notion_call(method, endpoint, body, proxy_user(), stream=True)
+                if response.status_code < 400 and not cacheable and NOTION_PROXY_STREAMING:
+                    streamed = stream_notion_response(response, flight if flight.share() else None)
+                    streamed.headers['X-Coalesced'] = 'upstream'
+                    return streamed
+                # Ошибки и схемы баз читаются целиком и в обычном прокси
+                flight.finish(FlightResult(response.status_code, response.headers.get('Content-Type', 'application/json'),
+                                           '', response.content))
+            except BaseException as e:
+                flight.fail(e)
+                raise
+    finally:
+        timing['upstream'] = time.perf_counter() - upstream_started
+    result, source = flight.result, flight.source
+    content = gzip.decompress(result.body) if result.encoding == 'gzip' and result.body else result.body
+    
+    if result.status >= 400:
+        error_data = json.loads(content) if content else {'error': 'No response body'}
+        print(f"❌ Notion API ошибка {result.status} для {endpoint}: {error_data}")
+        return jsonify(error_data), result.status
+    
+    if cacheable:
+        data = json.loads(content)
+        notion_cache.set(cache_key(endpoint), data)
+        return jsonify(data), 200, {'X-Cache': 'MISS', 'X-Coalesced': source}
+    
+    headers = {'Content-Type': result.content_type, 'Vary': 'Accept-Encoding', 'X-Coalesced': source}
+    if accepts_gzip(request.headers.get('Accept-Encoding')):
+        headers['Content-Encoding'] = 'gzip'
+        payload = result.body if result.encoding == 'gzip' else gzip.compress(content, PROXY_GZIP_LEVEL)
+    else:
+        payload = content
+    return Response(payload, status=result.status, headers=headers)
+
+def accepts_gzip(accept_encoding):
+    """Принимает ли клиент gzip по заголовку Accept-Encoding"""
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.partition(';')
+        if coding.strip().lower() in ('gzip', '*'):
+            try:
+                return float(params.strip().partition('=')[2] or 1) > 0
+            except ValueError:
+                return True
+    return False
+
+def gzip_chunks(chunks):
+    """Сжимать поток кусков в gzip на лету"""
+    compressor = zlib.compressobj(PROXY_GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def tee_chunks(chunks, flight, response, encoding):
+    """Передавать куски дальше, собирая копию тела для ожидающих того же ответа"""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    flight.finish(FlightResult(response.status_code, response.headers.get('Content-Type', 'application/json'),
+                               encoding, b''.join(parts)))
+
+def stream_notion_response(response, tee=None):
+    """Передать успешный ответ Notion клиенту кусками, не разбирая JSON
+
+    Если Notion прислал gzip и клиент его принимает, байты идут как есть;
+    иначе тело распаковывается и, если клиент принимает gzip, сжимается заново.
+    tee — Flight, которому нужна копия тела (одинаковые запросы других потоков и воркеров).
+    """
+    client_gzip = accepts_gzip(request.headers.get('Accept-Encoding'))
+    upstream_encoding = response.headers.get('Content-Encoding', '').lower()
+    headers = {
+        'Content-Type': response.headers.get('Content-Type', 'application/json'),
+        'Vary': 'Accept-Encoding',
+        'X-Proxy-Mode': 'stream',
+    }
+    if client_gzip and upstream_encoding == 'gzip':
+        chunks = response.raw.stream(PROXY_STREAM_CHUNK, decode_content=False)
+        if tee:
+            chunks = tee_chunks(chunks, tee, response, 'gzip')
+        headers['Content-Encoding'] = 'gzip'
+        if 'Content-Length' in response.headers:
+            headers['Content-Length'] = response.headers['Content-Length']
+    else:
+        chunks = response.raw.stream(PROXY_STREAM_CHUNK, decode_content=True)
+        if tee:
+            chunks = tee_chunks(chunks, tee, response, '')
+        if client_gzip:
+            chunks = gzip_chunks(chunks)
+            headers['Content-Encoding'] = 'gzip'
+        elif not upstream_encoding and 'Content-Length' in response.headers:
+            headers['Content-Length'] = response.headers['Content-Length']
+
+    def generate():
+        try:
+            yield from chunks
+        finally:
+            response.close()
+            if tee:
+                tee.abort()  # Клиент ушёл раньше конца ответа — ожидающие пойдут в Notion сами
+
+    return Response(generate(), status=response.status_code, headers=headers)
+
+# ==================== Запись привычек ====================
+
+def habit_page_body(data_source_id, name, completed, date):
+    """Тело запроса на создание записи о привычке (как createHabitRecord)"""
+    return {
+        'parent': {'type': 'data_source_id', 'data_source_id': data_source_id},
+        'properties': {
+            'Habit': {'title': [{'text': {'content': name}}]},
+            'Date': {'date': {'start': date}},
+            'Completed': {'checkbox': completed},
+        },
+    }
+
+def energy_page_body(schema, question, answer, date):
+    """Тело запроса на создание записи об энергии (как createEnergyRecord)"""
+    return {
+        'parent': {'type': 'data_source_id', 'data_source_id': schema['dataSourceId']},
+        'properties': {
+            schema['questionField']: {'title': [{'text': {'content': question}}]},
+            schema['dateField']: {'date': {'start': date}},
+            schema['answerField']: {'select': {'name': answer}},
+        },
+    }
+
+# Общий пул для записи: ограничивает параллельность на воркер, а не на запрос
+batch_executor = ThreadPoolExecutor(max_workers=NOTION_BATCH_CONCURRENCY, thread_name_prefix='notion-batch')
+
+def create_page(item, body, user='system'):
+    """Создать страницу в Notion и вернуть результат для одного элемента batch"""
+    try:
+        response = notion_call('POST', 'pages', body, user)
+    except NotionBusy as e:
+        return {**item, 'ok': False, 'status': e.status, 'error': e.message}
+    except requests.RequestException as e:
+        return {**item, 'ok': False, 'status': 504, 'error': str(e)}
+    if response.status_code >= 400:
+        data = response.json() if response.content else {}
+        return {**item, 'ok': False, 'status': response.status_code,
+                'error': data.get('message') or f'Ошибка API: {response.status_code}'}
+    page = response.json()
+    return {**item, 'ok': True, 'status': response.status_code, 'page_id': page.get('id'), 'page': page}
+
+def write_through(user_config, results):
+    """Сразу положить созданные страницы в зеркало, не дожидаясь фоновой синхронизации"""
+    pages = {'habit': [], 'energy': []}
+    for result in results:
+        page = result.pop('page', None)
+        if page:
+            pages[result['type']].append(page)
+    try:
+        if pages['habit']:
+            mirror.upsert_habits(user_config['USER'], [parse_habit_page(page) for page in pages['habit']])
+        if pages['energy']:
+            schema = resolve_energy_schema(user_config)
+            mirror.upsert_energy(user_config['USER'], [parse_energy_page(page, schema) for page in pages['energy']])
+    except Exception as e:
+        print(f"⚠️ Не удалось записать в зеркало: {e}")
+
+DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# ==================== Запись с обновлением (upsert) ====================
+
+# Одновременные записи одного дня в воркере выполняются по очереди, чтобы не создать дубли
+# Записи одного дня пользователя идут по очереди; дни распределены по фиксированному набору блокировок
+DAY_LOCK_STRIPES = 64
+day_locks = [threading.Lock() for _ in range(DAY_LOCK_STRIPES)]
+
+# Порядок страниц при загрузке дня: номера записей каунтеров совпадают с порядком создания
+CREATED_ASCENDING = [{'timestamp': 'created_time', 'direction': 'ascending'}]
+
+def day_lock(user, date):
+    return day_locks[zlib.crc32(f"{user}:{date}".encode()) % DAY_LOCK_STRIPES]
+
+def warm_day(user_config, kind, date):
+    """Загрузить в индекс страницы дня: из свежего зеркала или одним запросом к Notion"""
+    user = user_config['USER']
+    if page_index.is_warm(user, kind, date):
+        return
+    pages = None
+    if kind == 'habit' and mirror.is_fresh(user):
+        # ordinal — номер одноимённой страницы по времени создания: зеркало годится, только если его знает
+        pages = mirror.habit_pages_on(user, Date.fromisoformat(date))
+    if pages is None and kind == 'habit':
+        data_source_id = resolve_data_source_id(user_config['DATABASE_ID'])
+        results = query_all(data_source_id, {'filter': {'property': 'Date', 'date': {'equals': date}},
+                                             'sorts': CREATED_ASCENDING}, user)
+        pages = [(record['habit'] or '', record['id']) for record in map(parse_habit_page, results)]
+    elif pages is None:
+        schema = resolve_energy_schema(user_config)
+        results = query_all(schema['dataSourceId'], {'filter': {'property': schema['dateField'], 'date': {'equals': date}},
+                                                     'sorts': CREATED_ASCENDING}, user)
+        pages = [('', page['id']) for page in results]
+    page_index.warm(user, kind, date, pages)
+
+def update_page(item, page_id, properties, create_body=None, user='system'):
+    """Обновить страницу из индекса; если её удалили в Notion — создать заново"""
+    try:
+        response = notion_call('PATCH', f'pages/{page_id}', {'properties': properties}, user)
+    except NotionBusy as e:
+        return {**item, 'ok': False, 'status': e.status, 'error': e.message}
+    except requests.RequestException as e:
+        return {**item, 'ok': False, 'status': 504, 'error': str(e)}
+    gone = response.status_code == 404 or (response.status_code == 400 and 'archived' in response.text)
+    if gone and create_body is not None:
+        return {**create_page(item, create_body, user), 'action': 'created'}
+    if response.status_code >= 400:
+        data = response.json() if response.content else {}
+        return {**item, 'ok': False, 'status': response.status_code, 'gone': gone,
+                'error': data.get('message') or f'Ошибка API: {response.status_code}'}
+    page = response.json()
+    return {**item, 'ok': True, 'status': response.status_code, 'page_id': page.get('id'), 'page': page,
+            'action': 'updated'}
+
+def upsert_day(user_config, date, habits, energy, trim=True):
+    """Записать привычки (и ответ об энергии) за день без дублей
+
+    Страницы, уже известные индексу, обновляются одним PATCH, остальные создаются.
+    Несколько записей одной привычки различаются номером (ordinal) в порядке запроса.
+    trim — отметить невыполненными лишние записи привычек из запроса (каунтер уменьшили).
+    Возвращает (результаты по элементам запроса, результаты всех записей).
+    """
+    user = user_config['USER']
+    jobs = []  # (item, функция, аргументы)
+    extra = []  # Лишние записи каунтеров: в ответ клиенту не попадают
+    with day_lock(user, date):
+        if habits:
+            data_source_id = resolve_data_source_id(user_config['DATABASE_ID'])
+            warm_day(user_config, 'habit', date)
+            existing = page_index.pages_for(user, 'habit', date)
+            counts = {}
+            explicit = set()  # Привычки с явным номером (повтор неудачных записей) не обрезаем
+            for index, habit in enumerate(habits):
+                name = habit.get('name', '')
+                if 'ordinal' in habit:
+                    explicit.add(name)
+                ordinal = int(habit.get('ordinal', counts.get(name, 0)))
+                counts[name] = max(counts.get(name, 0), ordinal + 1)
+                completed = bool(habit.get('completed'))
+                item = {'type': 'habit', 'index': index, 'name': name, 'ordinal': ordinal}
+                body = habit_page_body(data_source_id, name, completed, date)
+                page_id = existing.get((name, ordinal))
+                if page_id:
+                    jobs.append((item, update_page, (page_id, {'Completed': {'checkbox': completed}}, body, user)))
+                else:
+                    jobs.append(({**item, 'action': 'created'}, create_page, (body, user)))
+            if trim:
+                for (name, ordinal), page_id in existing.items():
+                    if name in counts and name not in explicit and ordinal >= counts[name]:
+                        item = {'type': 'habit', 'name': name, 'ordinal': ordinal}
+                        extra.append((item, update_page, (page_id, {'Completed': {'checkbox': False}}, None, user)))
+        if energy:
+            schema = resolve_energy_schema(user_config)
+            warm_day(user_config, 'energy', date)
+            answer = energy.get('answer', '')
+            item = {'type': 'energy', 'ordinal': 0}
+            body = energy_page_body(schema, energy.get('question', ''), answer, date)
+            page_id = page_index.pages_for(user, 'energy', date).get(('', 0))
+            if page_id:
+                jobs.append((item, update_page, (page_id, {schema['answerField']: {'select': {'name': answer}}}, body, user)))
+            else:
+                jobs.append(({**item, 'action': 'created'}, create_page, (body, user)))
+
+        futures = [batch_executor.submit(function, item, *args) for item, function, args in jobs + extra]
+        results = [future.result() for future in futures]
+
+        # Запоминаем созданные страницы; если страница пропала из Notion — день загрузится заново
+        entries = {'habit': [], 'energy': []}
+        for result in results:
+            if result['ok']:
+                entries[result['type']].append((result.get('name', ''), result['ordinal'], result['page_id']))
+            elif result.pop('gone', False):
+                page_index.forget_day(user, result['type'], date)
+        for kind, kind_entries in entries.items():
+            if kind_entries:
+                page_index.set_pages(user, kind, date, kind_entries)
+
+    return results[:len(jobs)], results
+
+def idempotent(user, handler):
+    """Выполнить handler() -> (body, status) один раз на Idempotency-Key; повтор получает сохранённый ответ"""
+    key = request.headers.get('Idempotency-Key')
+    if not key:
+        body, status = handler()
+        return jsonify(body), status
+    scoped_key = f"{user}:{key}"
+    state = page_index.claim(scoped_key)
+    if state == PENDING:
+        return jsonify({'error': 'Запрос с этим Idempotency-Key ещё выполняется'}), 409
+    if state != CLAIMED:
+        status, body = state
+        return jsonify(body), status, {'Idempotent-Replay': 'true'}
+    try:
+        body, status = handler()
+    except Exception:
+        page_index.release(scoped_key)
+        raise
+    if status >= 500:
+        # Notion недоступен — повтор с тем же ключом должен выполниться заново
+        page_index.release(scoped_key)
+    else:
+        page_index.finish(scoped_key, status, body)
+    return jsonify(body), status
+
+def write_body():
+    """Тело запроса записи: JSON-объект с датой-строкой, иначе None"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('date', ''), str):
+        return None
+    return data
+
+def validate_write(user_config, date):
+    if not DATE_RE.match(date):
+        return {'error': 'Дата должна быть в формате YYYY-MM-DD'}, 400
+    try:
+        Date.fromisoformat(date)
+    except ValueError:
+        # 2024-13-45 проходит шаблон, но упал бы уже после записи в Notion
+        return {'error': 'Такой даты не существует'}, 400
+    if not user_config['DATABASE_ID']:
+        return {'error': 'База данных пользователя не настроена'}, 500
+    return None
+
+def validate_items(habits, energy):
+    """Проверить элементы записи до обращения к Notion: ошибка (тело, 400) или None"""
+    for index, habit in enumerate(habits):
+        if not isinstance(habit, dict):
+            return {'error': f'Запись #{index} должна быть объектом'}, 400
+        if not isinstance(habit.get('name', ''), str):
+            return {'error': f'Название привычки в записи #{index} должно быть строкой'}, 400
+        if 'ordinal' in habit:
+            ordinal = habit['ordinal']
+            if isinstance(ordinal, bool) or not isinstance(ordinal, (int, str)) or not str(ordinal).isdigit():
+                return {'error': f'Номер записи (ordinal) в записи #{index} должен быть целым числом не меньше 0'}, 400
+    if energy is not None and not isinstance(energy, dict):
+        return {'error': 'Ответ об энергии должен быть объектом'}, 400
+    return None
+
+def finish_write(user_config, date, written):
+    """Общее после записи: зеркало, отметка дня для напоминаний и сводка недели"""
+    if any(result['ok'] for result in written):
+        page_index.set_logged(user_config['USER'], date)
+    # Запись попадает в журнал зеркала, по нему сводки недель сбрасываются во всех воркерах
+    write_through(user_config, written)
+
+@app.route('/api/habits/batch', methods=['POST'])
+def habits_batch():
+    """Записать все привычки за день (и ответ об энергии) одним запросом
+
+    Уже записанные за этот день привычки обновляются, а не создаются заново, поэтому
+    повторная отправка дня не плодит дубликаты. Записи уходят в Notion с ограниченной
+    параллельностью и повторами при 429/5xx. Ответ содержит результат по каждому
+    элементу, чтобы клиент повторил только неудачные. Поддерживает Idempotency-Key.
+    """
+    data = write_body()
+    if data is None:
+        return jsonify({'error': 'Ожидается JSON-объект с полем date в формате YYYY-MM-DD'}), 400
+    user_config = get_user_databases(data.get('user'))
+    date = data.get('date', '')
+    habits = data.get('habits') or []
+    energy = data.get('energy')
+
+    def handler():
+        error = validate_write(user_config, date)
+        if error:
+            return error
+        if not isinstance(habits, list) or not (habits or energy):
+            return {'error': 'Нет записей для отправки'}, 400
+        if len(habits) > NOTION_BATCH_MAX_ITEMS:
+            return {'error': f'Слишком много записей (максимум {NOTION_BATCH_MAX_ITEMS})'}, 400
+        error = validate_items(habits, energy)
+        if error:
+            return error
+        try:
+            results, written = upsert_day(user_config, date, habits, energy)
+        except NotionError as e:
+            return {'error': e.message}, e.status
+        except requests.RequestException as e:
+            return {'error': f'Notion API недоступен: {e}'}, 504
+
+        finish_write(user_config, date, written)
+        failed = sum(1 for result in results if not result['ok'])
+        if failed:
+            print(f"⚠️ Batch для {user_config['USER']}: {failed} из {len(results)} записей не сохранены")
+        return {
+            'results': results,
+            'succeeded': len(results) - failed,
+            'failed': failed,
+        }, 207 if failed else 200
+
+    return idempotent(user_config['USER'], handler)
+
+@app.route('/api/habits/upsert', methods=['POST'])
+def habit_upsert():
+    """Отметить одну привычку за день: {user, date, name, completed, ordinal}
+
+    Если запись уже есть в индексе — один PATCH без поиска через query.
+    """
+    data = write_body()
+    if data is None:
+        return jsonify({'error': 'Ожидается JSON-объект с полем date в формате YYYY-MM-DD'}), 400
+    user_config = get_user_databases(data.get('user'))
+    date = data.get('date', '')
+
+    def handler():
+        error = validate_write(user_config, date)
+        if error:
+            return error
+        if not data.get('name'):
+            return {'error': 'Не указано название привычки'}, 400
+        habit = {'name': data['name'], 'completed': data.get('completed', True), 'ordinal': data.get('ordinal', 0)}
+        error = validate_items([habit], None)
+        if error:
+            return error
+        try:
+            results, written = upsert_day(user_config, date, [habit], None, trim=False)
+        except NotionError as e:
+            return {'error': e.message}, e.status
+        except requests.RequestException as e:
+            return {'error': f'Notion API недоступен: {e}'}, 504
+        finish_write(user_config, date, written)
+        result = results[0]
+        return result, 200 if result['ok'] else result['status']
+
+    return idempotent(user_config['USER'], handler)
+
+# ==================== Статистика ====================
+
+# Сводки по неделям: "user:YYYY-MM-DD (понедельник)" -> (номер журнала зеркала, {'habits': {...}, 'energy': {...}}).
+# Сводка верна, пока в журнале нет новых изменений пользователя: записи через API, прокси
+# (после синхронизации) и правки в Notion сбрасывают её во всех воркерах, а не только в записавшем
+week_rollups = TTLCache(STATS_ROLLUP_MAXSIZE, STATS_ROLLUP_TTL)
+
+def week_start(day):
+    """Понедельник недели, в которую входит day"""
+    return day - timedelta(days=day.weekday())
+
+def rollup_key(user, monday):
+    return f"{user}:{monday.isoformat()}"
+
+def date_range_filter(field, start, end):
+    return [
+        {'property': field, 'date': {'on_or_after': start.isoformat()}},
+        {'property': field, 'date': {'on_or_before': end.isoformat()}},
+    ]
+
+def mirror_is_fresh(user_config):
+    """Можно ли читать данные пользователя из локального зеркала"""
+    return mirror.is_fresh(user_config['USER'], 'habits') and (
+        not user_config['ENERGY_DATABASE_ID'] or mirror.is_fresh(user_config['USER'], 'energy'))
+
+def compute_stats(user_config, start, end):
+    """Посчитать выполненные привычки и оценки энергии за период [start, end]"""
+    if mirror_is_fresh(user_config):
+        return {
+            'habits': mirror.habit_counts(user_config['USER'], start, end),
+            'energy': mirror.energy_scores(user_config['USER'], start, end),
+        }
+
+    habits = {}
+    data_source_id = resolve_data_source_id(user_config['DATABASE_ID'])
+    pages = query_all(data_source_id, {
+        'filter': {'and': date_range_filter('Date', start, end) + [
+            {'property': 'Completed', 'checkbox': {'equals': True}},
+        ]},
+    }, user_config['USER'])
+    for record in map(parse_habit_page, pages):
+        if record['habit']:
+            habits[record['habit']] = habits.get(record['habit'], 0) + 1
+
+    energy = {}
+    if user_config['ENERGY_DATABASE_ID']:
+        schema = resolve_energy_schema(user_config)
+        pages = query_all(schema['dataSourceId'], {
+            'filter': {'and': date_range_filter(schema['dateField'], start, end)},
+        }, user_config['USER'])
+        for record in (parse_energy_page(page, schema) for page in pages):
+            if record['date'] and record['score'] is not None:
+                energy[record['date']] = record['score']
+
+    return {'habits': habits, 'energy': energy}
+
+def week_stats(user_config, monday, today, version):
+    """Статистика за неделю; прошедшие недели берутся из сводок того же номера журнала version"""
+    key = rollup_key(user_config['USER'], monday)
+    sunday = monday + timedelta(days=6)
+    if sunday < today:
+        cached = week_rollups.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1], True
+    stats = compute_stats(user_config, monday, sunday)
+    if sunday < today:
+        week_rollups.set(key, (version, stats))
+    return stats, False
+
+@app.route('/api/stats')
+def get_stats():
+    """Статистика за период: число выполненных привычек и средняя энергия
+
+    Период разбивается на недели (пн–вс). Завершённые недели считаются один раз и
+    хранятся в сводках, текущая неделя всегда читается из Notion.
+    """
+    user_config = get_user_databases(request.args.get('user'))
+    try:
+        start = Date.fromisoformat(request.args.get('from', ''))
+        end = Date.fromisoformat(request.args.get('to', ''))
+    except ValueError:
+        return jsonify({'error': 'Параметры from и to должны быть в формате YYYY-MM-DD'}), 400
+    if start > end or (end - start).days >= STATS_MAX_DAYS:
+        return jsonify({'error': f'Некорректный период (максимум {STATS_MAX_DAYS} дней)'}), 400
+    if not user_config['DATABASE_ID']:
+        return jsonify({'error': 'База данных пользователя не настроена'}), 500
+
+    habits = {}
+    energy = {}
+    cached_weeks = 0
+    today = Date.today()
+    # Номер журнала до подсчёта: изменение во время подсчёта сбросит сводку при следующем запросе
+    version = mirror.last_change(user_config['USER'])
+    try:
+        monday = week_start(start)
+        while monday <= end:
+            sunday = monday + timedelta(days=6)
+            if monday < start or sunday > end:
+                # Неполные недели по краям периода считаем по точным датам
+                stats = compute_stats(user_config, max(monday, start), min(sunday, end))
+            else:
+                stats, cached = week_stats(user_config, monday, today, version)
+                cached_weeks += cached
+            for name, count in stats['habits'].items():
+                habits[name] = habits.get(name, 0) + count
+            energy.update(stats['energy'])
+            monday += timedelta(days=7)
+    except NotionError as e:
+        return jsonify({'error': e.message}), e.status
+    except requests.RequestException as e:
+        return jsonify({'error': f'Notion API недоступен: {e}'}), 504
+
+    scores = list(energy.values())
+    return jsonify({
+        'user': user_config['USER'],
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'habits': habits,
+        'energy': {
+            'days': energy,
+            'average': round(sum(scores) / len(scores), 2) if scores else None,
+            'count': len(scores),
+        },
+        'cached_weeks': cached_weeks,
+    })
+
+# ==================== Аналитика ====================
+
+@app.route('/api/analytics')
+def get_analytics():
+    """Аналитика за период по всей истории из зеркала: серии, цели, скользящие средние, энергия
+
+    Параметры: user, from и to (по умолчанию — последние 365 дней), window — окно
+    скользящего среднего в днях (7).
+    """
+    if not ANALYTICS_AVAILABLE:
+        return jsonify({'error': 'Аналитика недоступна: не установлен numpy'}), 501
+    user_config = get_user_databases(request.args.get('user'))
+    today = Date.today()
+    try:
+        end = Date.fromisoformat(request.args['to']) if request.args.get('to') else today
+        start = Date.fromisoformat(request.args['from']) if request.args.get('from') else end - timedelta(days=364)
+        window = int(request.args.get('window', '7'))
+    except ValueError:
+        return jsonify({'error': 'Параметры from и to должны быть в формате YYYY-MM-DD, window — числом дней'}), 400
+    if start > end or (end - start).days >= ANALYTICS_MAX_DAYS or window < 1:
+        return jsonify({'error': f'Некорректный период (максимум {ANALYTICS_MAX_DAYS} дней)'}), 400
+
+    synced_at = mirror.get_state(user_config['USER'], 'habits')['synced_at']
+    if synced_at is None:
+        return jsonify({'error': 'История ещё не загружена в зеркало (notion-sync.py)'}), 503
+
+    record = users.resolve(user_config['USER'])
+    result = analytics().summary(user_config['USER'], start, end, record.get('goals'), window, today)
+    return jsonify({'user': user_config['USER'], 'synced_at': synced_at, **result})
+
+# ==================== Чтение привычек ====================
+
+@app.route('/api/habits')
+def get_habits():
+    """Записи о привычках за день (по умолчанию сегодня): из зеркала или из Notion"""
+    user_config = get_user_databases(request.args.get('user'))
+    try:
+        day = Date.fromisoformat(request.args.get('date') or Date.today().isoformat())
+    except ValueError:
+        return jsonify({'error': 'Дата должна быть в формате YYYY-MM-DD'}), 400
+    if not user_config['DATABASE_ID']:
+        return jsonify({'error': 'База данных пользователя не настроена'}), 500
+
+    if mirror.is_fresh(user_config['USER']):
+        return jsonify({'results': mirror.habits_on(user_config['USER'], day), 'source': 'mirror'})
+
+    try:
+        data_source_id = resolve_data_source_id(user_config['DATABASE_ID'])
+        pages = query_all(data_source_id, {'filter': {'property': 'Date', 'date': {'equals': day.isoformat()}}},
+                          user_config['USER'])
+    except NotionError as e:
+        return jsonify({'error': e.message}), e.status
+    except requests.RequestException as e:
+        return jsonify({'error': f'Notion API недоступен: {e}'}), 504
+    records = [parse_habit_page(page) for page in pages]
+    results = [{key: record[key] for key in ('id', 'habit', 'date', 'completed')} for record in records]
+    return jsonify({'results': results, 'source': 'notion'})
+
+@app.route('/api/habits/names')
+def get_habit_names():
+    """Все названия привычек пользователя за всю историю"""
+    user_config = get_user_databases(request.args.get('user'))
+    if not user_config['DATABASE_ID']:
+        return jsonify({'error': 'База данных пользователя не настроена'}), 500
+
+    if mirror.is_fresh(user_config['USER']):
+        return jsonify({'names': mirror.habit_names(user_config['USER']), 'source': 'mirror'})
+
+    try:
+        data_source_id = resolve_data_source_id(user_config['DATABASE_ID'])
+        pages = query_all(data_source_id, {}, user_config['USER'])
+    except NotionError as e:
+        return jsonify({'error': e.message}), e.status
+    except requests.RequestException as e:
+        return jsonify({'error': f'Notion API недоступен: {e}'}), 504
+    names = sorted({record['habit'] for record in map(parse_habit_page, pages) if record['habit']})
+    return jsonify({'names': names, 'source': 'notion'})
+
+# ==================== Компактные записи ====================
+
+# Поля строк /api/records по типу записей
+RECORD_FIELDS = {
+    'habits': ('id', 'habit', 'date', 'completed'),
+    'energy': ('id', 'date', 'answer'),
+}
+COMPRESS_MIN_BYTES = 512  # Меньшие ответы не сжимаем
+
+def load_records(user_config, kind, start, end):
+    """Записи за период кортежами из RECORD_FIELDS[kind] и источник (mirror / notion)"""
+    user = user_config['USER']
+    if kind == 'habits':
+        if mirror.is_fresh(user, 'habits'):
+            return mirror.habit_rows(user, start, end), 'mirror'
+        data_source_id = resolve_data_source_id(user_config['DATABASE_ID'])
+        pages = query_all(data_source_id, {'filter': {'and': date_range_filter('Date', start, end)}}, user)
+        records = sorted(map(parse_habit_page, pages), key=lambda r: (r['date'] or '', r['habit'] or ''))
+        return [(r['id'], r['habit'], r['date'], r['completed']) for r in records], 'notion'
+
+    if mirror.is_fresh(user, 'energy'):
+        return mirror.energy_rows(user, start, end), 'mirror'
+    schema = resolve_energy_schema(user_config)
+    pages = query_all(schema['dataSourceId'], {
+        'filter': {'and': date_range_filter(schema['dateField'], start, end)},
+    }, user)
+    records = sorted((parse_energy_page(page, schema) for page in pages),
+                     key=lambda r: (r['date'] or '', r['last_edited_time'] or ''))
+    return [(r['id'], r['date'], r['answer']) for r in records], 'notion'
+
+def etag_matches(etag, if_none_match):
+    """Слабое сравнение ETag с заголовком If-None-Match"""
+    tags = [tag.strip() for tag in (if_none_match or '').split(',')]
+    return '*' in tags or etag.removeprefix('W/') in (tag.removeprefix('W/') for tag in tags)
+
+def revalidated_json(payload):
+    """JSON-ответ с ETag (304, если у браузера та же версия) и gzip, если браузер его принимает"""
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode()
+    etag = f'W/"{hashlib.sha1(body).hexdigest()[:20]}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache', 'Vary': 'Accept-Encoding'}
+    if etag_matches(etag, request.headers.get('If-None-Match')):
+        return Response(status=304, headers=headers)
+    if len(body) >= COMPRESS_MIN_BYTES and accepts_gzip(request.headers.get('Accept-Encoding')):
+        body = gzip.compress(body, PROXY_GZIP_LEVEL)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, status=200, headers=headers, content_type='application/json')
+
+@app.route('/api/records')
+def get_records():
+    """Записи о привычках или энергии за период без метаданных страниц Notion
+
+    format=rows — {"fields": [...], "rows": [[...], ...]},
+    format=columns — {"fields": [...], "columns": {поле: [...]}}.
+    """
+    user_config = get_user_databases(request.args.get('user'))
+    kind = request.args.get('kind', 'habits')
+    layout = request.args.get('format', 'rows')
+    if kind not in RECORD_FIELDS:
+        return jsonify({'error': f"kind должен быть одним из: {', '.join(RECORD_FIELDS)}"}), 400
+    if layout not in ('rows', 'columns'):
+        return jsonify({'error': 'format должен быть rows или columns'}), 400
+    try:
+        start = Date.fromisoformat(request.args.get('from') or Date.today().isoformat())
+        end = Date.fromisoformat(request.args.get('to') or start.isoformat())
+    except ValueError:
+        return jsonify({'error': 'Параметры from и to должны быть в формате YYYY-MM-DD'}), 400
+    if start > end or (end - start).days >= STATS_MAX_DAYS:
+        return jsonify({'error': f'Некорректный период (максимум {STATS_MAX_DAYS} дней)'}), 400
+    if not user_config['DATABASE_ID']:
+        return jsonify({'error': 'База данных пользователя не настроена'}), 500
+
+    try:
+        rows, source = load_records(user_config, kind, start, end)
+    except NotionError as e:
+        return jsonify({'error': e.message}), e.status
+    except requests.RequestException as e:
+        return jsonify({'error': f'Notion API недоступен: {e}'}), 504
+
+    fields = RECORD_FIELDS[kind]
+    payload = {'kind': kind, 'from': start.isoformat(), 'to': end.isoformat(), 'fields': fields, 'source': source}
+    if layout == 'rows':
+        payload['rows'] = rows
+    else:
+        payload['columns'] = {field: [row[i] for row in rows] for i, field in enumerate(fields)}
+    return revalidated_json(payload)
+
+# Прогрев в фоне: под gunicorn воркер импортирует приложение уже после bind, поэтому порт
+# открыт сразу, а первые запросы ждут в очереди сокета, пока воркер не загрузится
+threading.Thread(target=schema_refresh_loop, name='schema-refresh', daemon=True).start()
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 3000))
     debug = os.getenv('FLASK_ENV') == 'development'
     
     print(f"🚀 Запуск сервера на порту {port}")
+    print("ℹ️ Это сервер разработки Flask; в продакшене: gunicorn -c gunicorn.conf.py server:app")
     if debug:
         print("📊 Откройте http://localhost:3000 в браузере")
     
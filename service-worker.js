@@ -3,11 +3,11 @@
 const CACHE_NAME = 'habbits-v1';
 const urlsToCache = [
     '/',
-    '/gleb',
     '/styles.css',
     '/app.js',
     '/database-config.js',
     '/notion-api.js',
+    '/push-notifications.js',
     '/manifest.json'
 ];
 
@@ -41,6 +41,9 @@ self.addEventListener('activate', (event) => {
     );
 });
 
+// Файлы с отпечатком содержимого в имени (app.1a2b3c4d5e6f.js) не меняются
+const FINGERPRINTED_RE = /\.[0-9a-f]{12}\.(js|css)$/;
+
 // Fetch с кэшированием (network first, fallback to cache)
 self.addEventListener('fetch', (event) => {
     // Пропускаем API запросы
@@ -48,6 +51,20 @@ self.addEventListener('fetch', (event) => {
         return;
     }
 
+    // Неизменяемые файлы — сразу из кэша, без сети
+    if (FINGERPRINTED_RE.test(new URL(event.request.url).pathname)) {
+        event.respondWith(
+            caches.match(event.request).then((cached) => cached || fetch(event.request).then((response) => {
+                if (response.status === 200) {
+                    const responseClone = response.clone();
+                    caches.open(CACHE_NAME).then((cache) => cache.put(event.request, responseClone));
+                }
+                return response;
+            }))
+        );
+        return;
+    }
+
     event.respondWith(
         fetch(event.request)
             .then((response) => {
@@ -78,7 +95,7 @@ self.addEventListener('push', (event) => {
         badge: '/icons/icon.svg',
         tag: 'habits-reminder',
         data: {
-            url: '/gleb'
+            url: '/'
         }
     };
 
@@ -125,14 +142,14 @@ self.addEventListener('notificationclick', (event) => {
         return;
     }
 
-    const urlToOpen = event.notification.data?.url || '/gleb';
+    const urlToOpen = event.notification.data?.url || '/';
 
     event.waitUntil(
         clients.matchAll({ type: 'window', includeUncontrolled: true })
             .then((clientList) => {
                 // Если есть открытое окно, фокусируемся на нём
                 for (const client of clientList) {
-                    if (client.url.includes('/gleb') && 'focus' in client) {
+                    if (new URL(client.url).pathname.startsWith(urlToOpen) && 'focus' in client) {
                         return client.focus();
                     }
                 }
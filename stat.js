@@ -28,18 +28,14 @@ const HABITS_GOALS = {
     }
 };
 
-// Маппинг уровней энергии на числа
-const ENERGY_MAPPING = {
-    'выжат апатия': 1,
-    'тяжело': 2,
-    'норм': 3,
-    'хорошо': 4,
-    'очень хорошо': 5
-};
-
 // Инициализация при загрузке страницы
 document.addEventListener('DOMContentLoaded', async () => {
     await waitForConfig();
+    // Ссылка назад — на трекер текущего пользователя
+    const backLink = document.querySelector('.back-link');
+    if (backLink) {
+        backLink.href = `/${DATABASE_CONFIG.USER || 'gleb'}`;
+    }
     updateWeekDisplay();
 });
 
@@ -155,15 +151,14 @@ async function calculateStats() {
         const startDate = formatDateISO(monday);
         const endDate = formatDateISO(sunday);
 
-        // Загружаем данные параллельно
-        const [energyData, habitsData] = await Promise.all([
-            fetchEnergyData(startDate, endDate),
-            fetchHabitsData(startDate, endDate)
-        ]);
+        // Сервер сам проходит все страницы Notion и считает статистику
+        const stats = await fetchStats(startDate, endDate);
+        const energyData = Object.entries(stats.energy.days)
+            .map(([date, score]) => ({ date, score }));
 
         // Отображаем результаты
         displayEnergyResults(energyData, monday, sunday);
-        displayHabitsResults(habitsData);
+        displayHabitsResults(stats.habits);
 
         resultsSection.style.display = 'block';
     } catch (error) {
@@ -188,141 +183,24 @@ function formatDateISO(date) {
 }
 
 /**
- * Загрузить данные об энергии за период
+ * Загрузить статистику за период с сервера
+ * Возвращает { habits: {название: количество}, energy: { days: {дата: оценка}, average, count } }
  */
-async function fetchEnergyData(startDate, endDate) {
-    console.log(`📊 Загрузка данных энергии за ${startDate} - ${endDate}`);
-    
-    if (!DATABASE_CONFIG.ENERGY_DATABASE_ID) {
-        console.warn('ENERGY_DATABASE_ID не настроен');
-        return [];
-    }
+async function fetchStats(startDate, endDate) {
+    console.log(`📊 Загрузка статистики за ${startDate} - ${endDate}`);
 
-    try {
-        const dataSourceId = await getEnergyDataSourceId();
-        console.log('📊 Energy dataSourceId:', dataSourceId);
-        
-        const endpoint = `/data_sources/${dataSourceId}/query`;
-
-        // Получаем схему для определения названий полей
-        const schema = await getEnergyDatabaseSchema();
-        console.log('📊 Energy schema:', schema);
-
-        const filterBody = {
-            filter: {
-                and: [
-                    {
-                        property: schema.dateField,
-                        date: {
-                            on_or_after: startDate
-                        }
-                    },
-                    {
-                        property: schema.dateField,
-                        date: {
-                            on_or_before: endDate
-                        }
-                    }
-                ]
-            },
-            page_size: 100
-        };
-        console.log('📊 Energy query filter:', JSON.stringify(filterBody, null, 2));
-
-        const response = await notionRequest(endpoint, 'POST', filterBody);
-        console.log('📊 Energy response:', response);
-
-        // Парсим результаты
-        const results = [];
-        if (response.results) {
-            console.log(`📊 Найдено ${response.results.length} записей энергии`);
-            for (const page of response.results) {
-                const answerProp = page.properties?.[schema.answerField];
-                console.log('📊 Answer prop:', answerProp);
-                if (answerProp?.select?.name) {
-                    const answerText = answerProp.select.name.toLowerCase();
-                    const score = ENERGY_MAPPING[answerText];
-                    console.log(`📊 Answer: "${answerText}" -> score: ${score}`);
-                    if (score !== undefined) {
-                        results.push({
-                            date: page.properties?.[schema.dateField]?.date?.start,
-                            answer: answerProp.select.name,
-                            score: score
-                        });
-                    }
-                }
-            }
-        }
+    const user = DATABASE_CONFIG.USER || 'gleb';
+    const params = new URLSearchParams({ user, from: startDate, to: endDate });
+    const response = await fetch(`/api/stats?${params}`);
+    const data = await response.json();
 
-        console.log('📊 Energy results:', results);
-        return results;
-    } catch (error) {
-        console.error('❌ Ошибка загрузки данных об энергии:', error);
-        return [];
+    if (!response.ok) {
+        console.error(`❌ Ошибка загрузки статистики ${response.status}:`, data);
+        throw new Error(data.message || data.error || `Ошибка API: ${response.status}`);
     }
-}
 
-/**
- * Загрузить данные о привычках за период
- */
-async function fetchHabitsData(startDate, endDate) {
-    console.log(`🎯 Загрузка данных привычек за ${startDate} - ${endDate}`);
-    
-    try {
-        const dataSourceId = await getDataSourceId();
-        console.log('🎯 Habits dataSourceId:', dataSourceId);
-        
-        const endpoint = `/data_sources/${dataSourceId}/query`;
-
-        const filterBody = {
-            filter: {
-                and: [
-                    {
-                        property: 'Date',
-                        date: {
-                            on_or_after: startDate
-                        }
-                    },
-                    {
-                        property: 'Date',
-                        date: {
-                            on_or_before: endDate
-                        }
-                    },
-                    {
-                        property: 'Completed',
-                        checkbox: {
-                            equals: true
-                        }
-                    }
-                ]
-            },
-            page_size: 100
-        };
-        console.log('🎯 Habits query filter:', JSON.stringify(filterBody, null, 2));
-
-        const response = await notionRequest(endpoint, 'POST', filterBody);
-        console.log('🎯 Habits response:', response);
-
-        // Подсчитываем количество выполненных привычек
-        const habitCounts = {};
-        if (response.results) {
-            console.log(`🎯 Найдено ${response.results.length} записей привычек`);
-            for (const page of response.results) {
-                const habitProp = page.properties?.Habit;
-                if (habitProp?.title?.[0]?.plain_text) {
-                    const habitName = habitProp.title[0].plain_text;
-                    habitCounts[habitName] = (habitCounts[habitName] || 0) + 1;
-                }
-            }
-        }
-
-        console.log('🎯 Habits counts:', habitCounts);
-        return habitCounts;
-    } catch (error) {
-        console.error('❌ Ошибка загрузки данных о привычках:', error);
-        return {};
-    }
+    console.log('📊 Статистика:', data);
+    return data;
 }
 
 /**
@@ -0,0 +1,164 @@
+"""
+Статика приложения из памяти: отпечатки содержимого, предварительное сжатие, долгий кэш
+
+При старте воркера скрипты и стили читаются один раз, получают имя с хэшем
+содержимого (app.1a2b3c4d5e6f.js) и сжимаются gzip (и brotli, если установлен пакет
+brotli). Ссылки в index.html, stat.html и список urlsToCache в service-worker.js
+переписываются на эти имена. Файлы с хэшем отдаются с Cache-Control: immutable —
+браузер не спрашивает их повторно, пока не изменится содержимое. HTML, service
+worker и старые имена без хэша отдаются с no-cache и строгим ETag, так что
+повторная загрузка PWA получает 304 без тела.
+"""
+
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+from pathlib import Path
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Выключить (0), чтобы при разработке отдавать файлы с диска без перезапуска
+STATIC_ASSETS = os.getenv('STATIC_ASSETS', '1') == '1'
+
+# Скрипты и стили, получающие отпечаток содержимого в имени
+FINGERPRINTED = ('app.js', 'database-config.js', 'notion-api.js', 'push-notifications.js', 'stat.js', 'styles.css')
+# Страницы и service worker: адрес постоянный, ссылки внутри переписываются
+ENTRY_POINTS = ('index.html', 'stat.html', 'service-worker.js')
+
+# Остальное, что может запросить браузер: манифест и картинки из icons/ и images/.
+# Всё прочее в корне проекта (код, README, базы, users.json) по HTTP не отдаётся
+PUBLIC_FILES = FINGERPRINTED + ENTRY_POINTS + ('manifest.json',)
+PUBLIC_MEDIA_RE = re.compile(r'^(icons|images)/[\w-]+(\.[\w-]+)*\.(svg|png|ico|gif|jpe?g|webp)$', re.IGNORECASE)
+
+FINGERPRINT_LENGTH = 12
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+COMPRESS_MIN_BYTES = 512
+
+# Версия кэша service worker: меняется вместе с содержимым статики
+SW_CACHE_NAME_RE = re.compile(r"const CACHE_NAME = '[^']*';")
+
+
+def content_type(name):
+    if name.endswith('.js'):
+        return 'application/javascript; charset=utf-8'
+    guessed, _ = mimetypes.guess_type(name)
+    if guessed and guessed.startswith('text/'):
+        return f'{guessed}; charset=utf-8'
+    return guessed or 'application/octet-stream'
+
+
+def is_public(name):
+    """Можно ли отдать файл по этому пути (имена с отпечатком проверяет AssetPipeline)"""
+    return name in PUBLIC_FILES or bool(PUBLIC_MEDIA_RE.match(name))
+
+
+def fingerprinted_name(name, digest):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{digest[:FINGERPRINT_LENGTH]}{ext}'
+
+
+class Asset:
+    """Файл в памяти: исходные байты, сжатые варианты и строгий ETag"""
+
+    def __init__(self, name, body, cache_control):
+        self.name = name
+        self.body = body
+        self.cache_control = cache_control
+        self.content_type = content_type(name)
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.etag = f'"{self.digest[:32]}"'
+        self.encoded = {}  # Content-Encoding -> байты (только если сжатие выгодно)
+        if len(body) >= COMPRESS_MIN_BYTES:
+            # mtime=0: одинаковые байты в каждом воркере
+            self.add_encoding('gzip', gzip.compress(body, compresslevel=9, mtime=0))
+            if BROTLI_AVAILABLE:
+                self.add_encoding('br', brotli.compress(body, quality=11))
+
+    def add_encoding(self, encoding, data):
+        if len(data) < len(self.body):
+            self.encoded[encoding] = data
+
+    def etag_for(self, encoding):
+        """Строгий ETag варианта: у сжатых вариантов свой суффикс"""
+        return self.etag if encoding is None else f'"{self.digest[:32]}-{encoding}"'
+
+    def matches(self, if_none_match):
+        """Есть ли у браузера любой вариант этого содержимого (If-None-Match)"""
+        tags = [tag.strip().removeprefix('W/') for tag in (if_none_match or '').split(',')]
+        return '*' in tags or any(tag.strip('"').split('-')[0] == self.digest[:32] for tag in tags)
+
+    def negotiate(self, accept_encoding):
+        """(Content-Encoding или None, байты) по заголовку Accept-Encoding клиента"""
+        accepted = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')}
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.encoded:
+                return encoding, self.encoded[encoding]
+        return None, self.body
+
+
+class AssetPipeline:
+    """Статика приложения по URL-пути"""
+
+    def __init__(self, root='.'):
+        self.root = Path(root)
+        self.assets = {}  # 'app.1a2b3c4d5e6f.js' / 'app.js' / 'index.html' -> Asset
+        self.urls = {}  # 'app.js' -> 'app.1a2b3c4d5e6f.js'
+        self.version = None
+
+    def build(self):
+        """Прочитать, отпечатать и сжать файлы; возвращает себя"""
+        assets, urls = {}, {}
+        for name in FINGERPRINTED:
+            path = self.root / name
+            if not path.is_file():
+                continue
+            body = path.read_bytes()
+            hashed = fingerprinted_name(name, hashlib.sha256(body).hexdigest())
+            assets[hashed] = Asset(hashed, body, IMMUTABLE)
+            # Старое имя остаётся для закэшированных страниц и внешних ссылок
+            assets[name] = Asset(name, body, REVALIDATE)
+            urls[name] = hashed
+
+        version = hashlib.sha256(''.join(sorted(urls.values())).encode()).hexdigest()[:FINGERPRINT_LENGTH]
+        for name in ENTRY_POINTS:
+            path = self.root / name
+            if path.is_file():
+                text = self.rewrite(path.read_text(encoding='utf-8'), urls)
+                if name == 'service-worker.js':
+                    text = SW_CACHE_NAME_RE.sub(f"const CACHE_NAME = 'habbits-{version}';", text)
+                assets[name] = Asset(name, text.encode('utf-8'), REVALIDATE)
+
+        self.assets, self.urls, self.version = assets, urls, version
+        return self
+
+    @staticmethod
+    def rewrite(text, urls):
+        """Заменить ссылки "/app.js" и '/app.js' на имена с отпечатком"""
+        for name, hashed in urls.items():
+            for quote in ('"', "'"):
+                text = text.replace(f'{quote}/{name}{quote}', f'{quote}/{hashed}{quote}')
+        return text
+
+    def get(self, name):
+        return self.assets.get(name)
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'brotli': BROTLI_AVAILABLE,
+            'assets': {
+                name: {
+                    'bytes': len(asset.body),
+                    **{f'{encoding}_bytes': len(data) for encoding, data in asset.encoded.items()},
+                    'cache_control': asset.cache_control,
+                }
+                for name, asset in sorted(self.assets.items())
+            },
+        }
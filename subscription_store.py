@@ -0,0 +1,237 @@
+"""
+Хранилище push-подписок в SQLite
+
+Одна строка на подписку с ключом endpoint и индексом по пользователю.
+WAL-режим позволяет серверу (несколько воркеров gunicorn) и планировщику
+одновременно читать и атомарно менять отдельные подписки в общей базе.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+from metrics import registry
+
+# Путь для хранения подписок (используем /app/data в Docker)
+# Вне Docker — подкаталог data/, а не корень проекта: корень раздаётся как статика
+if os.path.exists('/app/data'):
+    DATA_DIR = LEGACY_DATA_DIR = Path('/app/data')
+elif os.path.exists('/opt/habbits'):
+    DATA_DIR, LEGACY_DATA_DIR = Path('/opt/habbits/data'), Path('/opt/habbits')
+else:
+    DATA_DIR, LEGACY_DATA_DIR = Path('data'), Path('.')
+
+SUBSCRIPTIONS_DB = Path(os.getenv('SUBSCRIPTIONS_DB', DATA_DIR / 'push_subscriptions.db'))
+# Старый формат: {user: [subscription, ...]} в JSON-файле — в data/ или там, где он лежал раньше
+LEGACY_SUBSCRIPTIONS_FILES = list(dict.fromkeys([DATA_DIR / 'push_subscriptions.json',
+                                                 LEGACY_DATA_DIR / 'push_subscriptions.json']))
+# База подписок до переноса в data/
+LEGACY_SUBSCRIPTIONS_DB = LEGACY_DATA_DIR / 'push_subscriptions.db'
+
+store_seconds = registry.histogram('habbits_subscription_store_seconds',
+                                   'Операции с базой подписок (load — чтение всех подписок)', ('op',))
+cache_checks = registry.counter('habbits_subscription_cache_checks_total',
+                                'Проверки PRAGMA data_version кэшем подписок', ('result',))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    endpoint TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    subscription TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions (user);
+"""
+
+
+class SubscriptionStore:
+    """Подписки по endpoint; по соединению SQLite на поток"""
+
+    def __init__(self, path=SUBSCRIPTIONS_DB, legacy_files=LEGACY_SUBSCRIPTIONS_FILES, legacy_db=LEGACY_SUBSCRIPTIONS_DB):
+        self.path = Path(path)
+        self.legacy_files = [Path(legacy_file) for legacy_file in legacy_files]
+        self.legacy_db = Path(legacy_db)
+        self.local = threading.local()
+        self.init_lock = threading.Lock()
+        self.initialized = False
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            with self.init_lock:
+                if not self.initialized:
+                    conn.executescript(SCHEMA)
+                    self.migrate_legacy_db(conn)
+                    for legacy_file in self.legacy_files:
+                        self.migrate_legacy(conn, legacy_file)
+                    self.initialized = True
+        return conn
+
+    def migrate_legacy_db(self, conn):
+        """Однократно перенести подписки из базы в корне проекта (до переноса в data/)"""
+        if not self.legacy_db.exists() or self.legacy_db.resolve() == self.path.resolve():
+            return
+        try:
+            conn.execute('ATTACH DATABASE ? AS legacy', (str(self.legacy_db),))
+            try:
+                with conn:
+                    moved = conn.execute('INSERT OR IGNORE INTO subscriptions SELECT * FROM legacy.subscriptions').rowcount
+            finally:
+                conn.execute('DETACH DATABASE legacy')
+        except sqlite3.Error as e:
+            print(f"❌ Не удалось перенести подписки из {self.legacy_db}: {e}")
+            return
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                legacy = self.legacy_db.with_name(self.legacy_db.name + suffix)
+                legacy.rename(legacy.with_name(legacy.name + '.migrated'))
+            except FileNotFoundError:
+                pass  # Уже переименован другим процессом
+        print(f"📦 Перенесено {moved} подписок из {self.legacy_db} в {self.path}")
+
+    def migrate_legacy(self, conn, legacy_file):
+        """Однократно перенести подписки из push_subscriptions.json"""
+        if not legacy_file.exists():
+            return
+        try:
+            with open(legacy_file, 'r') as f:
+                legacy = json.load(f)
+        except Exception as e:
+            print(f"❌ Не удалось прочитать {legacy_file} для миграции: {e}")
+            return
+
+        now = time.time()
+        rows = [
+            (sub.get('endpoint'), user, json.dumps(sub), now, now)
+            for user, subs in legacy.items()
+            for sub in subs
+            if sub.get('endpoint')
+        ]
+        # INSERT OR IGNORE: если сервер и планировщик мигрируют одновременно, дублей не будет
+        with conn:
+            conn.executemany('INSERT OR IGNORE INTO subscriptions VALUES (?, ?, ?, ?, ?)', rows)
+        try:
+            legacy_file.rename(legacy_file.with_suffix('.json.migrated'))
+        except FileNotFoundError:
+            pass  # Уже переименован другим процессом
+        print(f"📦 Перенесено {len(rows)} подписок из {legacy_file} в {self.path}")
+
+    def upsert(self, user, subscription):
+        """Добавить подписку или обновить существующую; True, если подписка новая"""
+        now = time.time()
+        with store_seconds.time(op='upsert'), self.connection() as conn:
+            existed = conn.execute('SELECT 1 FROM subscriptions WHERE endpoint = ?',
+                                   (subscription['endpoint'],)).fetchone()
+            conn.execute("""
+                INSERT INTO subscriptions (endpoint, user, subscription, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (endpoint) DO UPDATE SET
+                    user = excluded.user, subscription = excluded.subscription,
+                    updated_at = excluded.updated_at
+            """, (subscription['endpoint'], user, json.dumps(subscription), now, now))
+        return existed is None
+
+    def delete(self, endpoint, user=None):
+        """Удалить подписку (только у указанного пользователя, если он задан)"""
+        with store_seconds.time(op='delete'), self.connection() as conn:
+            if user is None:
+                cursor = conn.execute('DELETE FROM subscriptions WHERE endpoint = ?', (endpoint,))
+            else:
+                cursor = conn.execute('DELETE FROM subscriptions WHERE endpoint = ? AND user = ?',
+                                      (endpoint, user))
+        return cursor.rowcount
+
+    def delete_many(self, endpoints):
+        """Удалить несколько подписок одной транзакцией"""
+        with store_seconds.time(op='delete_many'), self.connection() as conn:
+            cursor = conn.executemany('DELETE FROM subscriptions WHERE endpoint = ?',
+                                      [(endpoint,) for endpoint in endpoints])
+        return cursor.rowcount
+
+    def get(self, endpoint):
+        row = self.connection().execute(
+            'SELECT subscription FROM subscriptions WHERE endpoint = ?', (endpoint,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def for_user(self, user):
+        """Подписки пользователя"""
+        with store_seconds.time(op='for_user'):
+            rows = self.connection().execute(
+                'SELECT subscription FROM subscriptions WHERE user = ? ORDER BY created_at', (user,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def all_by_user(self):
+        """Все подписки в виде {user: [subscription, ...]}"""
+        result = {}
+        with store_seconds.time(op='load'):
+            rows = self.connection().execute(
+                'SELECT user, subscription FROM subscriptions ORDER BY user, created_at').fetchall()
+            for user, subscription in rows:
+                result.setdefault(user, []).append(json.loads(subscription))
+        return result
+
+
+class SubscriptionCache:
+    """Подписки в памяти процесса с проверкой изменений базы
+
+    PRAGMA data_version на отдельном соединении меняется после любого коммита
+    другим соединением (воркеры gunicorn, планировщик, свои же потоки), поэтому
+    подписки перечитываются с диска только после реальных изменений.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.watcher = None
+        self.version = None
+        self.by_user = {}
+        self.by_endpoint = {}
+        self.reloads = 0
+        self.checks = 0
+
+    def refresh(self):
+        """Перечитать подписки, если база изменилась с прошлой проверки"""
+        with self.lock:
+            if self.watcher is None:
+                self.store.connection()  # Схема и миграция до первого чтения
+                self.watcher = sqlite3.connect(self.store.path, timeout=30, check_same_thread=False)
+            version = self.watcher.execute('PRAGMA data_version').fetchone()[0]
+            self.checks += 1
+            cache_checks.inc(result='hit' if version == self.version else 'reload')
+            if version != self.version:
+                self.by_user = self.store.all_by_user()
+                self.by_endpoint = {sub['endpoint']: (user, sub)
+                                    for user, subs in self.by_user.items() for sub in subs}
+                self.version = version
+                self.reloads += 1
+            return self.by_user, self.by_endpoint
+
+    def for_user(self, user):
+        by_user, _ = self.refresh()
+        return list(by_user.get(user, []))
+
+    def find(self, endpoint):
+        """(user, subscription) по endpoint или None"""
+        _, by_endpoint = self.refresh()
+        return by_endpoint.get(endpoint)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'users': len(self.by_user),
+                'subscriptions': len(self.by_endpoint),
+                'checks': self.checks,
+                'reloads': self.reloads,
+            }
+
+
+subscription_store = SubscriptionStore()
@@ -0,0 +1,196 @@
+"""
+Реестр пользователей трекера: базы Notion, часовой пояс, время и текст напоминания, оформление
+
+Пользователи описываются в JSON-файле USERS_FILE (см. users.example.json). Строковые
+значения могут ссылаться на переменные окружения ($DATABASE_ID). Файл перечитывается
+при изменении (проверка mtime не чаще раза в USERS_RELOAD_INTERVAL секунд), поэтому новый
+пользователь подключается без перезапуска. Без файла реестр собирается из старых
+переменных окружения (DATABASE_ID, ENERGY_DATABASE_ID, DASHA_DATABASE_ID).
+"""
+
+import os
+import json
+import time
+import threading
+from pathlib import Path
+
+# Путь к файлу пользователей: каталог данных (/app/data в Docker), а не корень проекта,
+# который раздаётся как статика и копируется в образ
+if os.path.exists('/app/data'):
+    DATA_DIR = LEGACY_DATA_DIR = Path('/app/data')
+elif os.path.exists('/opt/habbits'):
+    DATA_DIR, LEGACY_DATA_DIR = Path('/opt/habbits/data'), Path('/opt/habbits')
+else:
+    DATA_DIR, LEGACY_DATA_DIR = Path('data'), Path('.')
+
+if os.getenv('USERS_FILE'):
+    USERS_FILE = Path(os.getenv('USERS_FILE'))
+elif not (DATA_DIR / 'users.json').exists() and (LEGACY_DATA_DIR / 'users.json').exists():
+    # Прежнее расположение работает, пока файл не перенесут
+    USERS_FILE = LEGACY_DATA_DIR / 'users.json'
+    print(f"⚠️ {USERS_FILE} лежит в корне проекта — перенесите его в {DATA_DIR / 'users.json'}")
+else:
+    USERS_FILE = DATA_DIR / 'users.json'
+
+USERS_RELOAD_INTERVAL = float(os.getenv('USERS_RELOAD_INTERVAL', '5'))  # Секунд между проверками файла
+
+DEFAULT_TIMEZONE = 'Europe/Moscow'
+DEFAULT_REMINDER = 'Не забудь отметить привычки!'
+DEFAULT_REMINDER_TIME = os.getenv('REMINDER_TIME', '23:00')  # Местное время напоминания (ЧЧ:ММ)
+
+# База данных для Глеба (по умолчанию)
+GLEB_DATABASE_ID = os.getenv('DATABASE_ID')  # Для обратной совместимости
+GLEB_ENERGY_DATABASE_ID = os.getenv('ENERGY_DATABASE_ID', '')  # Опционально
+GLEB_ENERGY_DATA_SOURCE_ID = os.getenv('ENERGY_DATA_SOURCE_ID', '')  # Опционально
+# База данных для Даши
+DASHA_DATABASE_ID = os.getenv('DASHA_DATABASE_ID', '')
+
+
+def legacy_users():
+    """Реестр из переменных окружения (как до появления USERS_FILE)"""
+    return {
+        'default': 'gleb',
+        'users': {
+            'gleb': {
+                'database_id': GLEB_DATABASE_ID,
+                'energy_database_id': GLEB_ENERGY_DATABASE_ID,
+                'energy_data_source_id': GLEB_ENERGY_DATA_SOURCE_ID,
+                'title': 'Трекер Привычек',
+                'emoji': '💪',
+                'stats': True,
+                'reminder': 'Привет! Не забудь отметить привычки за сегодня 💪',
+            },
+            'dasha': {
+                'database_id': DASHA_DATABASE_ID,
+                'energy_database_id': None,  # У Даши нет вопроса об энергии
+                'title': 'Привычки Даши',
+                'emoji': '🌸',
+                'reminder': 'Привет! Пора отметить привычки за сегодня ✨',
+            },
+        },
+    }
+
+
+def expand(value):
+    """Подставить переменные окружения в строковые значения"""
+    if isinstance(value, str):
+        return os.path.expandvars(value) or None
+    if isinstance(value, list):
+        return [expand(item) for item in value]
+    if isinstance(value, dict):
+        return {key: expand(item) for key, item in value.items()}
+    return value
+
+
+def normalize_user(user_id, raw):
+    """Запись пользователя со значениями по умолчанию"""
+    raw = expand(raw)
+    return {
+        'id': user_id,
+        'database_id': raw.get('database_id'),
+        'energy_database_id': raw.get('energy_database_id'),
+        'energy_data_source_id': raw.get('energy_data_source_id'),
+        'timezone': raw.get('timezone') or DEFAULT_TIMEZONE,
+        'reminder': raw.get('reminder') or DEFAULT_REMINDER,
+        'reminder_time': raw.get('reminder_time') or DEFAULT_REMINDER_TIME,
+        'title': raw.get('title') or 'Трекер Привычек',
+        'short_name': raw.get('short_name') or 'Привычки',
+        'emoji': raw.get('emoji') or '💪',
+        'theme_color': raw.get('theme_color') or '#667eea',
+        'stats': bool(raw.get('stats', False)),
+        'habits': raw.get('habits'),  # {категория: [привычки]}; None — список по умолчанию в app.js
+        'goals': raw.get('goals'),  # {привычка: раз в неделю} для /api/analytics; None — цели из stat.js
+    }
+
+
+class UserRegistry:
+    """Пользователи по id (поиск за O(1)) с перечитыванием файла при изменении"""
+
+    def __init__(self, path=USERS_FILE):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.users = {}
+        self.default = None
+        self.mtime = None
+        self.checked_at = 0.0
+        self.version = 0
+        self.reload()
+
+    def file_mtime(self):
+        try:
+            return self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reload(self):
+        """Перечитать пользователей; при ошибке в файле остаётся прежний реестр"""
+        mtime = self.file_mtime()
+        if mtime is None:
+            data, source = legacy_users(), 'переменных окружения'
+        else:
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"❌ Не удалось прочитать {self.path}, пользователи не изменены: {e}")
+                self.mtime = mtime
+                return False
+            source = str(self.path)
+
+        users = {user_id: normalize_user(user_id, raw) for user_id, raw in (data.get('users') or {}).items()}
+        default = data.get('default') if data.get('default') in users else next(iter(users), None)
+        with self.lock:
+            self.users = users
+            self.default = default
+            self.mtime = mtime
+            self.version += 1
+        print(f"👥 Пользователи загружены из {source}: {', '.join(users) or 'нет'}")
+        return True
+
+    def check(self):
+        """Перечитать файл, если он изменился (не чаще раза в USERS_RELOAD_INTERVAL)"""
+        now = time.monotonic()
+        if now - self.checked_at < USERS_RELOAD_INTERVAL:
+            return
+        self.checked_at = now
+        if self.file_mtime() != self.mtime:
+            self.reload()
+
+    def get(self, user_id):
+        """Пользователь по id или None"""
+        self.check()
+        return self.users.get(user_id)
+
+    def resolve(self, user_id):
+        """Пользователь по id; неизвестные и пустые id — пользователь по умолчанию"""
+        self.check()
+        users = self.users
+        return users.get(user_id) or users.get(self.default)
+
+    def all(self):
+        self.check()
+        return list(self.users.values())
+
+    def from_path(self, path):
+        """Пользователь по первому сегменту пути (/dasha, /dasha/stat) или по умолчанию"""
+        segment = (path or '').lstrip('/').split('/', 1)[0]
+        return self.resolve(segment)
+
+
+registry = UserRegistry()
+
+
+def get_user_databases(user):
+    """Базы данных Notion пользователя (неизвестные пользователи — пользователь по умолчанию)"""
+    record = registry.resolve(user) or normalize_user(user, {})
+    return {
+        'DATABASE_ID': record['database_id'],
+        'ENERGY_DATABASE_ID': record['energy_database_id'],
+        'ENERGY_DATA_SOURCE_ID': record['energy_data_source_id'],
+        'USER': record['id'],
+    }
+
+
+def configured_users():
+    """Пользователи, у которых настроена база привычек"""
+    return [record['id'] for record in registry.all() if record['database_id']]
@@ -42,6 +42,9 @@ fi
 echo "📁 Создаём директории..."
 mkdir -p /opt/habbits
 chown gleb:gleb /opt/habbits
+# Состояние webhook (история деплоев) — вне репозитория
+mkdir -p /var/lib/habbits
+chown gleb:gleb /var/lib/habbits
 
 # Клонируем репозиторий
 if [ ! -d "/opt/habbits/.git" ]; then
@@ -81,3 +84,4 @@ echo "1. Создайте файл /opt/habbits/.env с переменными 
 echo "2. Запустите: cd /opt/habbits && docker compose up -d"
 echo "3. Настройте nginx (см. nginx-habbits.conf)"
 echo "4. Добавьте webhook в GitHub: http://YOUR_IP:9000/deploy"
+echo "5. История деплоев (время сборки и простоя): http://YOUR_IP:9000/status"
@@ -2,28 +2,320 @@
 """
 Простой webhook-сервер для автоматического деплоя при пуше в GitHub
 Запускается как systemd-сервис на порту 9000
+
+Пуши в main встают в очередь, которую разбирает один поток: пуши, пришедшие во время
+деплоя, сливаются в один деплой последнего коммита. По списку изменённых файлов
+выбирается способ деплоя:
+- только статика (js/css/html/иконки) — файлы копируются в работающий контейнер, а
+  gunicorn получает HUP и плавно перезапускает воркеры, без пересборки и простоя;
+- только документация — ничего не делаем;
+- остальное — сборка образа с кэшем слоёв, проверка нового образа во временном
+  контейнере и только потом замена работающего.
+Длительность сборки и простоя каждого деплоя видна на GET /status.
 """
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import deque
+from fnmatch import fnmatch
 import subprocess
+import threading
 import json
 import hmac
 import hashlib
 import os
+import time
+import urllib.error
+import urllib.request
 
 WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', 'habbits-deploy-secret-2026')
-DEPLOY_SCRIPT = '/opt/habbits/deploy.sh'
+DEPLOY_DIR = os.getenv('DEPLOY_DIR', '/opt/habbits')
+DEPLOY_BRANCH = os.getenv('DEPLOY_BRANCH', 'main')
+DEPLOY_DEBOUNCE = float(os.getenv('DEPLOY_DEBOUNCE', '5'))  # Секунд ждать следующих пушей перед деплоем
+# История деплоев хранится вне репозитория: иначе она попадёт в образ и в раздачу статики
+DEPLOY_HISTORY_FILE = os.getenv('DEPLOY_HISTORY_FILE', '/var/lib/habbits/deploy_history.json')
+LEGACY_DEPLOY_HISTORY_FILE = os.path.join(DEPLOY_DIR, 'deploy_history.json')
+DEPLOY_HISTORY_SIZE = int(os.getenv('DEPLOY_HISTORY_SIZE', '50'))
+
+# Контейнер приложения (docker-compose.yml) и проверка здоровья
+APP_SERVICE = os.getenv('APP_SERVICE', 'habbits')
+APP_CONTAINER = os.getenv('APP_CONTAINER', 'habbits-app')
+HEALTH_URL = os.getenv('HEALTH_URL', 'http://127.0.0.1:3000/')
+HEALTH_TIMEOUT = float(os.getenv('HEALTH_TIMEOUT', '60'))  # Секунд ждать, пока контейнер станет здоровым
+CANDIDATE_PORT = int(os.getenv('CANDIDATE_PORT', '3901'))  # Порт временного контейнера с новым образом
+
+# Изменения, для которых хватает копирования файлов в контейнер
+STATIC_PATTERNS = ['*.js', '*.css', '*.html', 'icons/*', 'images/*']
+# Изменения, не влияющие на работающее приложение
+IGNORED_PATTERNS = ['*.md', 'bench/*']
+
+
+def matches(path, patterns):
+    return any(fnmatch(path, pattern) for pattern in patterns)
+
+
+def classify(changes):
+    """Способ деплоя по списку изменений [(статус, путь), ...]: noop, static или full"""
+    paths = [path for _, path in changes if not matches(path, IGNORED_PATTERNS)]
+    if not paths:
+        return 'noop'
+    if all(matches(path, STATIC_PATTERNS) for path in paths):
+        return 'static'
+    return 'full'
+
+
+class DeployFailed(Exception):
+    pass
+
+
+def run(*command, timeout=1800):
+    """Выполнить команду в DEPLOY_DIR; при ошибке — DeployFailed с хвостом вывода"""
+    result = subprocess.run(command, cwd=DEPLOY_DIR, capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        output = (result.stdout + result.stderr).strip().splitlines()
+        raise DeployFailed(f"{' '.join(command)}: код {result.returncode}\n" + '\n'.join(output[-20:]))
+    return result.stdout.strip()
+
+
+def wait_healthy(url, timeout=HEALTH_TIMEOUT):
+    """Ждать ответа без ошибки сервера; возвращает секунды ожидания"""
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                if response.status < 500:
+                    return time.monotonic() - started
+        except urllib.error.HTTPError as e:
+            if e.code < 500:
+                return time.monotonic() - started
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise DeployFailed(f'{url} не ответил за {timeout:.0f}с')
+
+
+class DeployQueue:
+    """Очередь деплоев с одним исполнителем; ожидающие пуши сливаются в один"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.pending = None  # Ожидающий деплой (последний пуш)
+        self.current = None  # Выполняющийся деплой
+        self.history = deque(self.load_history(), maxlen=DEPLOY_HISTORY_SIZE)
+        self.next_id = max((record['id'] for record in self.history), default=0) + 1
+        self.worker = threading.Thread(target=self.run_forever, name='deploy', daemon=True)
+
+    def start(self):
+        self.worker.start()
+
+    # ---------- Очередь ----------
+
+    def submit(self, commit, pusher=''):
+        """Поставить деплой коммита; если деплой уже ждёт — заменить его коммит новым"""
+        with self.lock:
+            now = time.time()
+            if self.pending:
+                self.pending.update(commit=commit, pusher=pusher, last_push_at=now)
+                self.pending['pushes'] += 1
+            else:
+                self.pending = {
+                    'id': self.next_id, 'commit': commit, 'pusher': pusher,
+                    'requested_at': now, 'last_push_at': now, 'pushes': 1,
+                }
+                self.next_id += 1
+            self.wakeup.notify()
+            return dict(self.pending)
+
+    def take(self):
+        """Дождаться ожидающего деплоя и паузы DEPLOY_DEBOUNCE после последнего пуша"""
+        with self.lock:
+            while True:
+                if self.pending:
+                    quiet = time.time() - self.pending['last_push_at']
+                    if quiet >= DEPLOY_DEBOUNCE:
+                        job, self.pending = self.pending, None
+                        self.current = job
+                        return job
+                    self.wakeup.wait(DEPLOY_DEBOUNCE - quiet)
+                else:
+                    self.wakeup.wait()
+
+    def run_forever(self):
+        while True:
+            job = self.take()
+            record = self.deploy(job)
+            with self.lock:
+                self.current = None
+                self.history.append(record)
+                history = list(self.history)
+            self.save_history(history)
+
+    # ---------- Деплой ----------
+
+    def deploy(self, job):
+        record = {**job, 'started_at': time.time(), 'status': 'running', 'kind': None,
+                  'build_seconds': None, 'downtime_seconds': None}
+        with self.lock:
+            self.current = record
+        print(f"🚀 Деплой #{job['id']}: {job['commit'][:8] or DEPLOY_BRANCH} (пушей: {job['pushes']})")
+        try:
+            run('git', 'fetch', 'origin', DEPLOY_BRANCH)
+            # Сравниваем с последним успешным деплоем, а не с HEAD: HEAD мог остаться на неудачном коммите
+            before, failed_since = self.last_deployed()
+            before = before or run('git', 'rev-parse', 'HEAD')
+            # Разом берём последний коммит ветки: в него уже входят все слитые пуши
+            target = run('git', 'rev-parse', f'origin/{DEPLOY_BRANCH}')
+            changes = [tuple(line.split('\t', 1)) for line in
+                       run('git', 'diff', '--name-status', '--no-renames', before, target).splitlines() if line]
+            record.update(deployed_commit=target, previous_commit=before, changed_files=len(changes))
+            if failed_since:
+                # После неудачного деплоя работающий контейнер может не совпадать ни с одним коммитом — пересобираем
+                kind = 'full'
+            else:
+                kind = classify(changes) if before != target else 'noop'
+            record['kind'] = kind
+            run('git', 'reset', '--hard', target)
+
+            if kind == 'static' and not self.container_running():
+                kind = record['kind'] = 'full'
+            if kind == 'static':
+                self.deploy_static(changes, record)
+            elif kind == 'full':
+                self.deploy_full(record)
+            record['status'] = 'ok'
+            print(f"✅ Деплой #{job['id']} ({kind}) завершён: сборка {record['build_seconds'] or 0:.1f}с, "
+                  f"простой {record['downtime_seconds'] or 0:.1f}с")
+        except (DeployFailed, subprocess.TimeoutExpired) as e:
+            record.update(status='failed', error=str(e))
+            print(f"❌ Деплой #{job['id']} не удался: {e}")
+        record['finished_at'] = time.time()
+        record['duration_seconds'] = round(record['finished_at'] - record['started_at'], 2)
+        return record
+
+    def last_deployed(self):
+        """(коммит последнего успешного деплоя или None, был ли после него неудачный деплой)"""
+        failed_since = False
+        with self.lock:
+            history = list(self.history)
+        for record in reversed(history):
+            if record.get('status') == 'ok' and record.get('deployed_commit'):
+                return record['deployed_commit'], failed_since
+            if record.get('status') == 'failed':
+                failed_since = True
+        return None, failed_since
+
+    def container_running(self):
+        try:
+            return run('docker', 'inspect', '-f', '{{.State.Running}}', APP_CONTAINER) == 'true'
+        except DeployFailed:
+            return False
+
+    def deploy_static(self, changes, record):
+        """Скопировать изменённую статику в контейнер и плавно перезапустить воркеры (HUP)"""
+        started = time.monotonic()
+        for status, path in changes:
+            if matches(path, IGNORED_PATTERNS):
+                continue
+            if status.startswith('D'):
+                run('docker', 'exec', APP_CONTAINER, 'rm', '-f', f'/app/{path}')
+            else:
+                run('docker', 'exec', APP_CONTAINER, 'mkdir', '-p', os.path.dirname(f'/app/{path}'))
+                run('docker', 'cp', os.path.join(DEPLOY_DIR, path), f'{APP_CONTAINER}:/app/{path}')
+        # Новые воркеры gunicorn заново собирают статику (отпечатки, сжатие), старые доживают запросы
+        run('docker', 'kill', '--signal', 'HUP', APP_CONTAINER)
+        record['build_seconds'] = round(time.monotonic() - started, 2)
+        record['downtime_seconds'] = 0.0
+        record['health_seconds'] = round(wait_healthy(HEALTH_URL), 2)
+
+    def deploy_full(self, record):
+        """Собрать образ (с кэшем слоёв), проверить его во временном контейнере, затем заменить"""
+        started = time.monotonic()
+        run('docker', 'compose', 'build')
+        record['build_seconds'] = round(time.monotonic() - started, 2)
+
+        # Новый образ должен подняться до замены: иначе работающий контейнер остаётся как есть
+        candidate = f'{APP_CONTAINER}-candidate'
+        subprocess.run(['docker', 'rm', '-f', candidate], cwd=DEPLOY_DIR, capture_output=True)
+        run('docker', 'compose', 'run', '-d', '--rm', '--no-deps', '--name', candidate,
+            '-p', f'127.0.0.1:{CANDIDATE_PORT}:3000', APP_SERVICE)
+        try:
+            record['candidate_seconds'] = round(wait_healthy(f'http://127.0.0.1:{CANDIDATE_PORT}/'), 2)
+        except DeployFailed:
+            logs = subprocess.run(['docker', 'logs', '--tail', '50', candidate], capture_output=True, text=True)
+            raise DeployFailed(f'Новый образ не прошёл проверку здоровья, контейнер не заменён\n'
+                               f'{logs.stdout}{logs.stderr}')
+        finally:
+            subprocess.run(['docker', 'rm', '-f', candidate], cwd=DEPLOY_DIR, capture_output=True)
+
+        swapped = time.monotonic()
+        run('docker', 'compose', 'up', '-d')
+        wait_healthy(HEALTH_URL)
+        record['downtime_seconds'] = round(time.monotonic() - swapped, 2)
+
+    # ---------- Состояние ----------
+
+    def load_history(self):
+        # Прежние версии писали историю в каталог репозитория — подхватываем её один раз
+        for path in (DEPLOY_HISTORY_FILE, LEGACY_DEPLOY_HISTORY_FILE):
+            try:
+                with open(path) as f:
+                    return json.load(f)[-DEPLOY_HISTORY_SIZE:]
+            except (OSError, ValueError):
+                continue
+        return []
+
+    def save_history(self, history):
+        tmp = f'{DEPLOY_HISTORY_FILE}.tmp'
+        try:
+            os.makedirs(os.path.dirname(DEPLOY_HISTORY_FILE) or '.', exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump(history, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, DEPLOY_HISTORY_FILE)
+            if (os.path.exists(LEGACY_DEPLOY_HISTORY_FILE)
+                    and os.path.abspath(LEGACY_DEPLOY_HISTORY_FILE) != os.path.abspath(DEPLOY_HISTORY_FILE)):
+                # Не оставлять старую копию в каталоге репозитория
+                os.remove(LEGACY_DEPLOY_HISTORY_FILE)
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить историю деплоев: {e}")
+
+    def status(self):
+        with self.lock:
+            history = list(self.history)
+            return {
+                'current': dict(self.current) if self.current else None,
+                'pending': dict(self.pending) if self.pending else None,
+                'history': history[::-1],
+            }
+
+
+deploy_queue = DeployQueue()
+
 
 class WebhookHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/status':
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_json(200, deploy_queue.status())
+
     def do_POST(self):
         if self.path != '/deploy':
             self.send_response(404)
             self.end_headers()
             return
-        
+
         content_length = int(self.headers.get('Content-Length', 0))
         body = self.rfile.read(content_length)
-        
+
         # Проверяем подпись GitHub (опционально)
         signature = self.headers.get('X-Hub-Signature-256', '')
         if signature:
@@ -37,34 +329,31 @@ class WebhookHandler(BaseHTTPRequestHandler):
                 self.send_response(401)
                 self.end_headers()
                 return
-        
+
         try:
             payload = json.loads(body)
             ref = payload.get('ref', '')
-            
-            # Деплоим только при пуше в main
-            if ref == 'refs/heads/main':
-                print(f"🚀 Получен push в main, запускаем деплой...")
-                subprocess.Popen(['/bin/bash', DEPLOY_SCRIPT])
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'status': 'deploying'}).encode())
+
+            # Деплоим только при пуше в основную ветку
+            if ref == f'refs/heads/{DEPLOY_BRANCH}':
+                job = deploy_queue.submit(payload.get('after', ''), (payload.get('pusher') or {}).get('name', ''))
+                print(f"📥 Получен push в {DEPLOY_BRANCH}, деплой #{job['id']} в очереди (пушей: {job['pushes']})")
+                self.send_json(202, {'status': 'queued', 'deploy': job['id'], 'pushes': job['pushes']})
             else:
                 print(f"ℹ️ Пуш в {ref}, пропускаем")
                 self.send_response(200)
                 self.end_headers()
-                
+
         except Exception as e:
             print(f"❌ Ошибка: {e}")
             self.send_response(500)
             self.end_headers()
-    
+
     def log_message(self, format, *args):
         print(f"[webhook] {args[0]}")
 
 if __name__ == '__main__':
-    server = HTTPServer(('0.0.0.0', 9000), WebhookHandler)
+    deploy_queue.start()
+    server = ThreadingHTTPServer(('0.0.0.0', 9000), WebhookHandler)
     print("🎣 Webhook-сервер запущен на порту 9000")
     server.serve_forever()